@@ -0,0 +1,293 @@
+"""
+Fake WebDriver for the benchmark. It serves the recorded pages in benchmarks/fixtures instead of a real browser,
+and answers the calls made by the google_scrapping package (find_element, send_keys, the W3C actions of ActionChains,
+execute_script with the page state, extraction, next page and page metrics scripts, the resource blocking of the
+lightweight mode...). Every call waits a configurable round-trip latency, like a remote driver would.
+"""
+
+import os
+import random
+import threading
+from itertools import zip_longest
+from time import sleep
+from urllib.parse import urljoin, urlparse
+
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.remote.command import Command
+
+# The pages are parsed and the results extracted by the offline parser of the script, with the same selectors.
+from google_scrapping.extraction import compile_selector, parse_html, parse_results
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Bytes of the images, fonts and scripts loaded by each page in a real browser, on top of the document. They are
+# not downloaded when the profile blocks the heavy resources (only the scripts are).
+SUBRESOURCE_BYTES = {
+    "google_home": {"heavy": 180_000, "other": 420_000},
+    "serp_results": {"heavy": 350_000, "other": 600_000},
+    "serp_empty": {"heavy": 60_000, "other": 450_000},
+    "serp_captcha": {"heavy": 40_000, "other": 250_000},
+}
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as file:
+        return file.read()
+
+
+# * ____________________ FAKE DRIVER ____________________ * #
+
+class FakeElement:
+
+    def __init__(self, driver, node):
+        self.driver = driver
+        self.node = node
+
+    @property
+    def parent(self):
+        return self.driver
+
+    @property
+    def text(self):
+        self.driver.round_trip()
+        return self.node.text
+
+    def is_displayed(self):
+        self.driver.round_trip()
+        return True
+
+    def is_enabled(self):
+        self.driver.round_trip()
+        return True
+
+    def click(self):
+        self.driver.round_trip()
+
+    def send_keys(self, *keys):
+        self.driver.round_trip()
+        self.driver.typed(keys)
+
+    def get_attribute(self, name):
+        self.driver.round_trip()
+        return self.node.attrs.get(name)
+
+
+class FakeSwitchTo:
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def frame(self, element):
+        self.driver.round_trip()
+        self.driver.frame = element.node
+
+    def default_content(self):
+        self.driver.round_trip()
+        self.driver.frame = None
+
+
+class FakeCommandExecutor:
+
+    def __init__(self):
+        self.commands = {}
+
+    def add_command(self, name, method, url):
+        self.commands[name] = (method, url)
+
+
+class FakeDriver:
+    """
+    Fake remote WebDriver. The page served after a search is chosen at random: the captcha fixture with
+    "captcha_rate", the empty fixture with "empty_rate", or the results fixture.
+
+    Args:
+        latency: float, seconds of each WebDriver call (round trip to the remote driver)
+        page_load: float, seconds to load a page
+        captcha_rate: float, between 0 and 1
+        empty_rate: float, between 0 and 1
+        seed: int, for the random choice of the pages
+    """
+
+    def __init__(self, latency=0.005, page_load=0.3, captcha_rate=0.0, empty_rate=0.0, seed=None):
+        self.latency = latency
+        self.page_load = page_load
+        self.captcha_rate = captcha_rate
+        self.empty_rate = empty_rate
+        self.random = random.Random(seed)
+
+        self.command_executor = FakeCommandExecutor()
+        self.blocked = False
+
+        self.switch_to = FakeSwitchTo(self)
+        self.frame = None
+        self.typing = ""
+        self.round_trips = 0
+        self.lock = threading.Lock()
+
+        self.current_url = "about:blank"
+        self.page_source = ""
+        self.page = "blank"
+        self.tree = parse_html("")
+
+    # Calls of the WebDriver API
+
+    def round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        sleep(self.latency)
+
+    def load(self, url, page):
+        sleep(self.page_load)
+
+        self.current_url = url
+        self.page = page
+        self.page_source = load_fixture(f"{page}.html")
+        self.tree = parse_html(self.page_source)
+        self.frame = None
+
+    def serp_page(self):
+        draw = self.random.random()
+
+        if draw < self.captcha_rate:
+            return "serp_captcha"
+
+        if draw < self.captcha_rate + self.empty_rate:
+            return "serp_empty"
+
+        return "serp_results"
+
+    def get(self, url):
+        self.round_trip()
+
+        if urlparse(url).path.startswith("/search"):
+            self.load(url, self.serp_page())
+        else:
+            self.load(url, "google_home")
+
+    def refresh(self):
+        self.round_trip()
+        self.load(self.current_url, self.page)
+
+    def execute(self, command, params=None):
+        self.round_trip()
+
+        # Network.setBlockedURLs in Mimic. In Stealthfox, the preferences are set by a script in the chrome context.
+        if command == "executeCdpCommand" and params["cmd"] == "Network.setBlockedURLs":
+            self.blocked = True
+
+        # W3C actions of ActionChains: the keys are typed in the focused element, and the pauses are waited.
+        if command == Command.W3C_ACTIONS:
+            self.perform_actions(params["actions"])
+
+        return {"value": None}
+
+    def perform_actions(self, devices):
+        # The actions of all devices run in ticks: a tick lasts as much as its longest pause.
+        for tick in zip_longest(*(device["actions"] for device in devices), fillvalue={}):
+            sleep(max((action.get("duration", 0) for action in tick if action.get("type") == "pause"), default=0) / 1000)
+
+            self.typed([action["value"] for action in tick if action.get("type") == "keyDown"])
+
+    def maximize_window(self):
+        self.round_trip()
+
+    def quit(self):
+        self.round_trip()
+
+    def typed(self, keys):
+        for key in keys:
+            if key == Keys.ENTER:
+                self.get(f"https://www.google.com/search?q={self.typing}")
+                self.typing = ""
+
+            elif key == Keys.BACKSPACE:
+                self.typing = self.typing[:-1]
+
+            else:
+                self.typing += key
+
+    def match(self, by, value):
+        if by == By.ID:
+            return lambda node: node.attrs.get("id") == value
+
+        if by == By.TAG_NAME:
+            return lambda node: node.tag == value
+
+        if by == By.CSS_SELECTOR:
+            return compile_selector(value)
+
+        if by == By.XPATH and "reCAPTCHA" in value:
+            return lambda node: node.tag == "iframe" and "reCAPTCHA" in (node.attrs.get("title") or "")
+
+        raise NotImplementedError(f"Locator not supported by the fake driver: {by} {value}")
+
+    def find_element(self, by, value):
+        self.round_trip()
+
+        if self.frame is not None:
+            # The reCAPTCHA iframe only has the checkbox.
+            if by == By.ID and value == "recaptcha-anchor":
+                return FakeElement(self, self.frame)
+            raise NoSuchElementException(value)
+
+        node = next(filter(self.match(by, value), self.tree.iter()), None)
+        if node is None:
+            raise NoSuchElementException(value)
+
+        return FakeElement(self, node)
+
+    def find_elements(self, by, value):
+        self.round_trip()
+        return [FakeElement(self, node) for node in filter(self.match(by, value), self.tree.iter())]
+
+    def execute_script(self, script, *args):
+        self.round_trip()
+
+        # Only the scripts of the package are known, recognized by what they look for.
+        if "'captcha'" in script and "'results'" in script:
+            return self.page_state()
+
+        if "displayed_url" in script:
+            return self.extract_results() or []
+
+        if "pnnext" in script:
+            return self.next_page()
+
+        if "transferSize" in script:
+            return self.page_metrics()
+
+        if "Services.prefs" in script:
+            self.blocked = True
+            return None
+
+        return False
+
+    # Emulation of the scripts
+
+    def page_state(self):
+        if self.page == "serp_captcha":
+            return "captcha"
+
+        if self.page == "serp_empty":
+            return "empty"
+
+        if self.page == "serp_results":
+            return "results"
+
+        return None
+
+    def page_metrics(self):
+        resources = SUBRESOURCE_BYTES.get(self.page, {"heavy": 0, "other": 0})
+        transferred = len(self.page_source.encode()) + resources["other"] + (0 if self.blocked else resources["heavy"])
+
+        return {"transferred": transferred, "ready": self.page_load}
+
+    def next_page(self):
+        anchor = next((node for node in self.tree.iter() if node.tag == "a" and node.attrs.get("id") == "pnnext"), None)
+        return urljoin(self.current_url, anchor.attrs["href"]) if anchor else None
+
+    def extract_results(self):
+        return parse_results(self.tree, self.current_url)
@@ -0,0 +1,124 @@
+"""
+Import-time benchmark of the google_scrapping package. Each module is imported in a new interpreter with
+"python -X importtime", from an empty folder, and the benchmark shows its cumulative import time (the best of some
+runs), the heavy dependencies it imported (Selenium, requests...), and the files it created (none is expected).
+
+Run it from the repository root:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --output imports.json
+    python -m benchmarks.import_time --baseline imports.json --tolerance 0.5
+
+With --baseline, the script exits with status 1 when the import time of a module grows more than the tolerance, so
+the startup cost of the workers stays measured.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The package alone, the modules used by the workers of the re-parse and the work queue commands must stay light. The command line and the
+# runner are measured too, as the cost of a full start.
+TARGETS = [
+    "google_scrapping",
+    "google_scrapping.config",
+    "google_scrapping.extraction",
+    "google_scrapping.archive",
+    "google_scrapping.workqueue",
+    "google_scrapping.scheduler",
+    "google_scrapping.api",
+    "google_scrapping.cli",
+    "google_scrapping.runner",
+]
+
+HEAVY = ["selenium", "requests", "urllib3", "dotenv", "pytz"]
+
+
+def measure(target, runs):
+    """
+    Imports a module in new interpreters, and reads its cumulative import time.
+
+    Returns:
+        result: dictionary, with "module", "milliseconds", "heavy" (list of strings) and "created" (list of files)
+    """
+
+    times = []
+
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix="google_scrapping_import_") as folder:
+            env = dict(os.environ, PYTHONPATH=ROOT)
+            process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {target}"], cwd=folder, env=env, capture_output=True, text=True, check=True)
+            created = sorted(os.listdir(folder))
+
+        # Lines like "import time:       255 |        255 | google_scrapping"
+        imported = {}
+        for line in process.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+                _, cumulative, name = line[len("import time:"):].split("|")
+                imported[name.strip()] = int(cumulative)
+
+        times.append(imported[target])
+
+    heavy = [name for name in HEAVY if name in imported]
+    return {"module": target, "milliseconds": min(times) / 1000, "heavy": heavy, "created": created}
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    Compares the import times with a previous output of the benchmark.
+
+    Returns:
+        regressions: list of strings
+    """
+
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = {result["module"]: result for result in json.load(file)}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["module"])
+
+        if previous and result["milliseconds"] > previous["milliseconds"] * (1 + tolerance):
+            regressions.append(f"{result['module']}: {result['milliseconds']:.1f} ms, baseline {previous['milliseconds']:.1f} ms")
+
+    return regressions
+
+
+def handling_args():
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the google_scrapping package.")
+    parser.add_argument("modules", nargs="*", default=TARGETS, help="Modules to import. Default: the package and its main modules.")
+    parser.add_argument("--runs", type=int, default=5, help="Imports of each module; the best one is kept. Default: 5.")
+    parser.add_argument("--output", help="Saves the results in this JSON file.")
+    parser.add_argument("--baseline", help="JSON file of a previous run, to check for regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Accepted growth of the import time against the baseline. Default: 0.5.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = handling_args()
+
+    results = [measure(module, args.runs) for module in args.modules]
+
+    for result in results:
+        heavy = ", ".join(result["heavy"]) or "none"
+        created = ", ".join(result["created"]) or "none"
+        print(f"{result['module']:<30} {result['milliseconds']:>8.1f} ms    heavy imports: {heavy:<40} files created: {created}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+        print(f"\nResults saved in {args.output}.")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,226 @@
+"""
+Offline benchmark of the google_scrapping package. It runs the real main() against the local Multilogin stand-in
+(benchmarks/standin.py) and the fake WebDriver (benchmarks/fake_webdriver.py), and compares a sequential run with a
+concurrent one: queries per minute, p50/p95/max per stage, peak memory and API calls.
+
+Run it from the repository root, so config.json is found:
+
+    python -m benchmarks.run_benchmark --queries 20 --workers 4
+    python -m benchmarks.run_benchmark --output bench.json
+    python -m benchmarks.run_benchmark --baseline bench.json --tolerance 0.2
+
+With --baseline, the script exits with status 1 when the queries per minute of a scenario drop more than the
+tolerance, so it can catch performance regressions.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+from itertools import count
+from time import perf_counter
+from types import SimpleNamespace
+
+import google_scrapping as gs
+from google_scrapping import browser, config
+
+from benchmarks.fake_webdriver import FakeDriver
+from benchmarks.standin import StandinServer
+
+
+QUERIES = [
+    "multilogin", "antidetect browser", "browser fingerprinting", "web scraping with selenium",
+    "residential proxies", "how to manage multiple accounts", "canvas fingerprint", "webrtc leak test",
+    "python requests session", "google search operators", "sticky session proxy", "headless chrome detection",
+]
+
+
+def configure(server, args):
+    """
+    Points the package to the stand-in and the fake driver, with the pacing of the benchmark.
+    """
+
+    config.USERNAME = "bench@standin.local"
+    config.PASSWORD = "standin"
+    config.TOKEN = None
+
+    config.API.update({"BASE": server.url, "LAUNCHER": f"{server.url}/", "PROXY_BASE": server.url, "TOKEN_PATH": "standin_token.json"})
+    gs.API_CLIENT.configure()
+
+    gs.PACER.use(args.pacing)
+
+    if args.lightweight:
+        config.LIGHTWEIGHT.update({"ENABLED": True, "HEADLESS": True, "BLOCK": ["image", "media", "font"]})
+        config.PROFILE_MODE = "lightweight"
+
+    # Every scenario must do the searches, not read them from a previous run. The sections are updated in place,
+    # since they are also the default arguments of the script.
+    config.CACHE.clear()
+    config.CACHE["ENABLED"] = False
+    config.ARCHIVE.update({"ENABLED": args.archive, "PATH": "serp_archive"})
+    config.URL_INDEX.update({"ENABLED": args.url_index, "PATH": "url_index.db"})
+
+    # The adaptive controller decides on short windows, so it acts within the few queries of a scenario.
+    config.ADAPTIVE.update({"ENABLED": args.adaptive, "WINDOW_SECONDS": 60, "MIN_SAMPLES": 4, "DECISION_SECONDS": 0})
+
+    seeds = count(args.seed)
+    browser.webdriver = SimpleNamespace(Remote=lambda command_executor, options: FakeDriver(
+        latency=args.driver_latency,
+        page_load=args.page_load,
+        captcha_rate=args.captcha_rate,
+        empty_rate=args.empty_rate,
+        seed=next(seeds),
+    ))
+
+
+def reset_stats(server):
+    """
+    Clears the stats kept by the package and the stand-in, so each scenario is measured alone.
+    """
+
+    gs.STAGE_TIMINGS.reset()
+    gs.session.SEARCH_LATENCY.clear()
+    browser.PAGE_STATE_LATENCY.clear()
+    gs.PACER.slept.clear()
+    gs.PACER.started = perf_counter()
+    server.calls.clear()
+
+
+def run_scenario(name, workers, queries, server, args):
+    """
+    Runs main() once and collects its performance.
+
+    Returns:
+        result: dictionary
+    """
+
+    reset_stats(server)
+    tracemalloc.start()
+    started = perf_counter()
+
+    report = gs.main(queries, workers=workers, options={"mode": args.mode, "depth": args.depth, "output_format": "jsonl"}, journal=gs.RunJournal())
+
+    elapsed = perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "scenario": name,
+        "workers": workers,
+        "queries": report["queries"],
+        "elapsed_seconds": elapsed,
+        "queries_per_minute": report["queries_per_minute"],
+        "peak_memory_mb": peak / 1024 / 1024,
+        "transfer": report["transfer"],
+        "typing": report["typing"],
+        "stages": {stage: {key: stats[key] for key in ("count", "p50", "p95", "max")} for stage, stats in report["stages"].items()},
+        "api_calls": dict(server.calls),
+    }
+
+
+def print_results(results):
+    for result in results:
+        print(f"\n{result['scenario']} ({result['workers']} workers): {result['queries']} queries in {result['elapsed_seconds']:.1f}s, "
+              f"{result['queries_per_minute']:.1f} queries/min, peak memory {result['peak_memory_mb']:.1f} MB")
+
+        for stage, stats in result["stages"].items():
+            print(f"    {stage:<14} n={stats['count']:<4} p50={stats['p50']:.3f}s  p95={stats['p95']:.3f}s  max={stats['max']:.3f}s")
+
+        transfer = result["transfer"]
+        print(f"    transfer ({transfer['profile_mode']}): {transfer['bytes_per_query'] / 1024:.0f} KB/query, {transfer['bytes_per_page'] / 1024:.0f} KB/page")
+        typing = result["typing"]
+        if typing["queries"]:
+            print(f"    typing: {typing['keystrokes']} keystrokes in {typing['round_trips']} round trips, "
+                  f"planned {typing['planned_seconds']:.1f}s, actual {typing['actual_seconds']:.1f}s")
+
+        print(f"    API calls: {result['api_calls']}")
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    Compares the queries per minute with a previous output of the benchmark.
+
+    Returns:
+        regressions: list of strings
+    """
+
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = {result["scenario"]: result for result in json.load(file)}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["scenario"])
+
+        if previous and result["queries_per_minute"] < previous["queries_per_minute"] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: {result['queries_per_minute']:.1f} queries/min, baseline {previous['queries_per_minute']:.1f}")
+
+    return regressions
+
+
+def handling_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the google_scrapping package with a stand-in launcher and a fake WebDriver.")
+    parser.add_argument("--queries", type=int, default=12, help="Number of queries per scenario. Default: 12.")
+    parser.add_argument("--workers", type=int, default=4, help="Workers of the concurrent scenario. Default: 4.")
+    parser.add_argument("--mode", choices=["typing", "direct"], default="typing", help="Search mode. Default: typing.")
+    parser.add_argument("--depth", type=int, default=1, help="Results pages per query. Default: 1.")
+    parser.add_argument("--archive", action="store_true", help="Saves the results pages in the SERP archive (ARCHIVE in config.json).")
+    parser.add_argument("--lightweight", action="store_true", help="Uses lightweight profiles (LIGHTWEIGHT in config.json).")
+    parser.add_argument("--url-index", action="store_true", help="Flags repeated URLs in the URL index (URL_INDEX in config.json).")
+    parser.add_argument("--adaptive", action="store_true", help="Enables the adaptive controller (ADAPTIVE in config.json), deciding every 4 searches.")
+    parser.add_argument("--pacing", choices=list(gs.PACING_PROFILES), default="zero", help="Pacing profile. Default: zero.")
+    parser.add_argument("--driver-latency", type=float, default=0.005, help="Seconds of each WebDriver call. Default: 0.005.")
+    parser.add_argument("--page-load", type=float, default=0.3, help="Seconds to load a page. Default: 0.3.")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="Share of searches answered with a captcha. Default: 0.")
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="Share of searches with no results. Default: 0.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the fake driver's page choice. Default: 1.")
+    parser.add_argument("--output", help="Saves the results in this JSON file.")
+    parser.add_argument("--baseline", help="JSON file of a previous run, to check for regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Accepted drop of queries per minute against the baseline. Default: 0.2.")
+    parser.add_argument("--verbose", action="store_true", help="Shows the logs of the script.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = handling_args()
+
+    config.load_config()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    # Outputs, journal, token, logs and report of the runs go to a temporary folder.
+    os.chdir(tempfile.mkdtemp(prefix="google_scrapping_bench_"))
+    gs.setup_logging(level=logging.INFO if args.verbose else logging.WARNING)
+
+    queries = [QUERIES[i % len(QUERIES)] + (f" {i // len(QUERIES)}" if i >= len(QUERIES) else "") for i in range(args.queries)]
+
+    server = StandinServer().start()
+
+    try:
+        configure(server, args)
+
+        results = [
+            run_scenario("sequential", 1, queries, server, args),
+            run_scenario("concurrent", args.workers, queries, server, args),
+        ]
+
+    finally:
+        server.stop()
+
+    print_results(results)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+        print(f"\nResults saved in {output}.")
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        sys.exit(1 if regressions else 0)
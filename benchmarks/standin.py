@@ -0,0 +1,151 @@
+"""
+Local stand-in for the Multilogin endpoints used by the google_scrapping package (MLX_BASE, MLX_LAUNCHER and the
+proxy API), so the script can be benchmarked without a Multilogin account. Each endpoint answers with the same payload
+shape as the real API, after a configurable latency.
+
+It can also be started alone, to point config.json "API" at it:
+
+    python -m benchmarks.standin --port 8765
+"""
+
+import argparse
+import base64
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+
+# Latency of each endpoint, in seconds. The values are close to what we see with a launcher running on the same host.
+DEFAULT_LATENCY = {
+    "signin": 0.2,
+    "connection_url": 0.3,
+    "validate": 0.4,
+    "profile_quick": 2.0,
+    "profile_stop": 0.3,
+}
+
+
+def fake_token(minutes=30):
+    """
+    Builds a JWT-like token with an "exp" claim, so the client can read its expiration.
+
+    Args:
+        minutes: int
+
+    Returns:
+        token: string
+    """
+
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    expires_at = int(datetime.now().timestamp()) + minutes * 60
+    return f"{encode({'alg': 'none'})}.{encode({'exp': expires_at})}.standin"
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        logging.debug(f"Stand-in: {format % args}")
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        return self.headers.get("Authorization", "").startswith("Bearer ")
+
+    def route(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        if method == "POST" and self.path.endswith("/user/signin"):
+            return "signin", 200, {"status": {"http_code": 200}, "data": {"token": fake_token()}}
+
+        if not self.authorized():
+            return "unauthorized", 401, {"status": {"http_code": 401, "message": "Unauthorized"}}
+
+        if method == "POST" and self.path.endswith("/v1/proxy/connection_url"):
+            session = uuid.uuid4().hex[:8]
+            return "connection_url", 201, {"status": {"http_code": 201}, "data": f"{session}.proxy.standin.local:8080:user-{session}:standin"}
+
+        if method == "POST" and self.path.endswith("/v1/proxy/validate"):
+            return "validate", 200, {"status": {"http_code": 200, "message": "Proxy is valid"}}
+
+        if method == "POST" and self.path.endswith("/v3/profile/quick"):
+            profile_id = str(uuid.uuid4())
+            return "profile_quick", 200, {"status": {"http_code": 200}, "data": {"id": profile_id, "port": 40000}}
+
+        if method == "GET" and "/v1/profile/stop/p/" in self.path:
+            return "profile_stop", 200, {"status": {"http_code": 200, "message": "Profile stopped"}}
+
+        return "not_found", 404, {"status": {"http_code": 404, "message": f"Unknown endpoint {self.path}"}}
+
+    def handle_method(self, method):
+        endpoint, status, payload = self.route(method)
+
+        self.server.count(endpoint)
+        sleep(self.server.latency.get(endpoint, 0))
+
+        self.reply(status, payload)
+
+    def do_GET(self):
+        self.handle_method("GET")
+
+    def do_POST(self):
+        self.handle_method("POST")
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server for the stand-in endpoints. It counts the calls to each endpoint.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=None):
+        super().__init__(("127.0.0.1", port), StandinHandler)
+
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="standin", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Multilogin endpoints.")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    server = StandinServer(args.port)
+    logging.info(f"Stand-in listening on {server.url}. Use it as API.BASE, API.LAUNCHER ({server.url}/) and API.PROXY_BASE.")
+    server.serve_forever()
@@ -0,0 +1,72 @@
+"""
+Google Search scrapping with Multilogin quick profiles.
+
+The package is split in modules: config (the .env file and config.json), api (Multilogin client and proxies), browser
+and session (the quick profile and the search of a query), extraction (selectors and offline parser), output (writer,
+run journal and cache), archive, queries, scheduler, workqueue (queue shared by several hosts) and runner (worker pool
+and main). Importing the package is cheap: nothing is read or created, and the modules (with Selenium and requests)
+are only imported when one of the names below is used. The configuration is loaded explicitly with load_config(), before a run:
+
+    import google_scrapping as gs
+
+    gs.load_config("config.json")
+    gs.main(["multilogin"], workers=2)
+"""
+
+import importlib
+
+
+# Public names of the package, with the module where they are defined.
+EXPORTS = {
+    "load_config": "config",
+    "setup_logging": "logs",
+    "PACING_PROFILES": "pacing",
+    "Pacer": "pacing",
+    "PACER": "pacing",
+    "AdaptiveController": "adaptive",
+    "StageTimings": "timings",
+    "STAGE_TIMINGS": "timings",
+    "MultiloginClient": "api",
+    "API_CLIENT": "api",
+    "ProxyPool": "api",
+    "compile_selector": "extraction",
+    "parse_html": "extraction",
+    "parse_results": "extraction",
+    "iter_queries": "queries",
+    "make_job": "queries",
+    "QueryScheduler": "scheduler",
+    "SharedScheduler": "scheduler",
+    "ResultWriter": "output",
+    "SharedResultWriter": "output",
+    "RunJournal": "output",
+    "ResultCache": "output",
+    "SerpArchive": "archive",
+    "reparse_archive": "archive",
+    "UrlIndex": "urlindex",
+    "normalize_url": "urlindex",
+    "SqliteWorkQueue": "workqueue",
+    "RemoteWorkQueue": "workqueue",
+    "open_work_queue": "workqueue",
+    "ProfileSession": "session",
+    "run_search": "session",
+    "main": "runner",
+}
+
+MODULES = ["config", "logs", "pacing", "adaptive", "timings", "api", "extraction", "queries", "scheduler", "output", "archive", "urlindex", "workqueue", "browser", "session", "runner", "cli"]
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(name):
+    # Imports the module of a public name (or a module itself) on first use.
+    if name in EXPORTS:
+        return getattr(importlib.import_module(f".{EXPORTS[name]}", __name__), name)
+
+    if name in MODULES:
+        return importlib.import_module(f".{name}", __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted([*globals(), *EXPORTS, *MODULES])
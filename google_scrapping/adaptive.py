@@ -0,0 +1,204 @@
+"""
+Adaptive throughput controller: it watches the outcome of the searches (captchas, timeouts and pages without results)
+in a sliding window, for the whole run and for each proxy geo, and adjusts the number of active workers and the
+pacing, additive-increase/multiplicative-decrease style, within the bounds of "ADAPTIVE" in config.json.
+"""
+
+import logging
+import threading
+from collections import deque
+from time import monotonic
+
+from . import config
+from .pacing import PACER
+
+
+# Outcomes of a search, and the ones watched by the controller with their threshold in "THRESHOLDS".
+OUTCOMES = ["ok", "captcha", "timeout", "empty", "error"]
+
+WATCHED = {"captcha": "CAPTCHA_RATE", "timeout": "TIMEOUT_RATE", "empty": "EMPTY_RATE"}
+
+DEFAULT_THRESHOLDS = {"CAPTCHA_RATE": 0.1, "TIMEOUT_RATE": 0.2, "EMPTY_RATE": 0.3}
+
+OVERALL = "overall"
+
+
+class AdaptiveController:
+    """
+    Feedback controller of the worker pool. Every search outcome goes in the window of the run and of its geo. At most
+    every "DECISION_SECONDS", once a window has "MIN_SAMPLES" outcomes, their rates are compared with the thresholds:
+
+    - Above a threshold, for the whole run: the active workers are multiplied by "DECREASE_FACTOR" and the pacing
+      scale is divided by it. For a geo: only the pacing scale of the geo is divided by it.
+    - Below all of them: one worker is added ("INCREASE_STEP") and the pacing scale goes down by "PACING_STEP".
+
+    The geos only have their own decisions when the run has more than one geo.
+
+    The workers above the active count are parked (their profile is closed) until they are needed again. A window is
+    cleared after each change, so the next decision only sees the outcomes of the new settings. Each decision is
+    logged with the rates that caused it.
+
+    Args:
+        workers: int, workers of the pool, the upper bound of the active workers
+    """
+
+    def __init__(self, workers, policy=config.ADAPTIVE):
+        self.window_seconds = policy.get("WINDOW_SECONDS", 300)
+        self.min_samples = policy.get("MIN_SAMPLES", 10)
+        self.decision_seconds = policy.get("DECISION_SECONDS", 60)
+
+        self.max_concurrency = workers
+        self.min_concurrency = min(max(policy.get("MIN_CONCURRENCY", 1), 1), workers)
+        self.increase_step = policy.get("INCREASE_STEP", 1)
+        self.decrease_factor = policy.get("DECREASE_FACTOR", 0.5)
+
+        self.min_pacing = policy.get("MIN_PACING", 1.0)
+        self.max_pacing = policy.get("MAX_PACING", 4.0)
+        self.pacing_step = policy.get("PACING_STEP", 0.25)
+
+        # A threshold set to null is not watched.
+        thresholds = {**DEFAULT_THRESHOLDS, **policy.get("THRESHOLDS", {})}
+        self.thresholds = {outcome: thresholds[name] for outcome, name in WATCHED.items() if thresholds.get(name) is not None}
+
+        start = policy.get("START_CONCURRENCY") or workers
+        self.concurrency = min(max(start, self.min_concurrency), workers)
+
+        # The scales of the pacer start from the lower bound of each run.
+        PACER.scale = self.min_pacing
+        PACER.geo_scales.clear()
+
+        self.condition = threading.Condition()
+        self.windows = {}
+        self.decided = {}
+        self.draining = False
+
+        # Stats for the run summary
+        self.decisions = []
+
+    def admits(self, worker_id):
+        with self.condition:
+            return self.draining or worker_id <= self.concurrency
+
+    def wait_turn(self, worker_id):
+        """
+        Blocks a parked worker until the active workers include it again, or until the queue is drained.
+        """
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.draining or worker_id <= self.concurrency)
+
+    def drain(self):
+        """
+        Releases the parked workers, once a worker found nothing left to do, so they can finish too.
+        """
+
+        with self.condition:
+            self.draining = True
+            self.condition.notify_all()
+
+    def observe(self, geo, outcome):
+        """
+        Records the outcome of a search, and takes the decisions that are due.
+
+        Args:
+            geo: string, geo key of the query
+            outcome: string, one of OUTCOMES
+        """
+
+        now = monotonic()
+
+        with self.condition:
+            for scope in (OVERALL, geo):
+                window = self.windows.setdefault(scope, deque())
+                window.append((now, outcome))
+
+                while window and window[0][0] < now - self.window_seconds:
+                    window.popleft()
+
+                # With a single geo, its window is the one of the whole run, so only the run decides.
+                if scope != OVERALL and len(self.windows) <= 2:
+                    continue
+
+                if now - self.decided.get(scope, float("-inf")) >= self.decision_seconds and len(window) >= self.min_samples:
+                    self.decide(scope, window, now)
+
+    def decide(self, scope, window, now):
+        # The caller holds the condition.
+        counts = {outcome: 0 for outcome in OUTCOMES}
+        for _, outcome in window:
+            counts[outcome] += 1
+
+        rates = {outcome: counts[outcome] / len(window) for outcome in self.thresholds}
+        breaches = [f"{outcome} rate {rates[outcome]:.0%} > {limit:.0%}" for outcome, limit in self.thresholds.items() if rates[outcome] > limit]
+        observed = ", ".join(f"{outcome} {rate:.0%}" for outcome, rate in rates.items())
+
+        self.decided[scope] = now
+        label = scope if scope == OVERALL else f"geo '{scope}'"
+
+        concurrency = self.concurrency
+        pacing = PACER.scale if scope == OVERALL else PACER.geo_scales.get(scope, 1.0)
+
+        if breaches:
+            action = "decrease"
+            pacing = min(pacing / self.decrease_factor, self.max_pacing)
+
+            if scope == OVERALL:
+                concurrency = max(int(concurrency * self.decrease_factor), self.min_concurrency)
+
+        else:
+            action = "increase"
+            pacing = max(pacing - self.pacing_step, self.min_pacing if scope == OVERALL else 1.0)
+
+            if scope == OVERALL:
+                concurrency = min(concurrency + self.increase_step, self.max_concurrency)
+
+        previous = PACER.scale if scope == OVERALL else PACER.geo_scales.get(scope, 1.0)
+
+        if concurrency == self.concurrency and pacing == previous:
+            logging.debug(f"Adaptive controller ({label}): {observed} in {len(window)} searches. No change, at the bounds.")
+            return
+
+        reason = "; ".join(breaches) if breaches else "all rates under the thresholds"
+
+        if scope == OVERALL:
+            logging.info(f"Adaptive controller ({label}): {reason} in {len(window)} searches. "
+                         f"{action.capitalize()}: workers {self.concurrency} -> {concurrency}, pacing x{previous:.2f} -> x{pacing:.2f}.")
+            self.concurrency = concurrency
+            PACER.scale = pacing
+            self.condition.notify_all()
+
+        else:
+            logging.info(f"Adaptive controller ({label}): {reason} in {len(window)} searches. "
+                         f"{action.capitalize()}: pacing x{previous:.2f} -> x{pacing:.2f}.")
+
+            if pacing == 1.0:
+                PACER.geo_scales.pop(scope, None)
+            else:
+                PACER.geo_scales[scope] = pacing
+
+        self.decisions.append({"scope": scope, "action": action, "rates": rates, "samples": len(window), "concurrency": self.concurrency, "pacing": pacing})
+        window.clear()
+
+    def report(self):
+        decreases = sum(1 for decision in self.decisions if decision["action"] == "decrease")
+        geo_scales = ", ".join(f"{geo} x{scale:.2f}" for geo, scale in PACER.geo_scales.items()) or "none"
+
+        logging.info(f"Adaptive controller: {len(self.decisions)} decisions ({decreases} decreases). "
+                     f"Final workers {self.concurrency}/{self.max_concurrency}, pacing x{PACER.scale:.2f}, slowed geos: {geo_scales}.")
+
+
+def create_adaptive_controller(workers):
+    """
+    Starts the adaptive controller if it's enabled in config.json.
+
+    Args:
+        workers: int, workers of the pool
+
+    Returns:
+        controller: AdaptiveController, or None if it's disabled
+    """
+
+    if not config.ADAPTIVE.get("ENABLED", False):
+        return None
+
+    return AdaptiveController(workers)
@@ -0,0 +1,649 @@
+"""
+Multilogin API client (sign in, token, proxies and quick profiles stop), and the proxy pool that prefetches
+validated proxies for the workers.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from time import perf_counter, sleep
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import config
+from .pacing import PACER
+from .queries import query_geo, geo_key
+from .scheduler import backoff_delay, ProxyError
+
+
+def token_expiry(token):
+    """
+    Reads the expiration ("exp") of a JWT token, without validating it.
+
+    Args:
+        token: string
+
+    Returns:
+        expires_at: float, timestamp, or 0 if it can't be read
+    """
+
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload)).get("exp", 0))
+
+    except Exception:
+        return 0
+
+
+class MultiloginClient:
+    """
+    Client for the Multilogin APIs (MLX_BASE, MLX_LAUNCHER and the proxy API). It keeps a pooled keep-alive
+    requests.Session shared by all workers, with the same timeout and retries for every call. The token is persisted
+    on disk with its expiration, reused while it's valid, and renewed automatically when it expires or a call gets a 401.
+    The base URLs can be changed in "API" in config.json, e.g. to point to a local stand-in.
+    """
+
+    def __init__(self, policy=None):
+        self.lock = threading.Lock()
+        self.configure(policy)
+
+    def configure(self, policy=None):
+        """
+        Applies "API" of config.json (base URLs, timeout, retries, pool and token file) with a new session.
+
+        Args:
+            policy: dictionary, by default config.API
+        """
+
+        policy = config.API if policy is None else policy
+
+        self.base = policy.get("BASE") or config.MLX_BASE
+        self.launcher = policy.get("LAUNCHER") or config.MLX_LAUNCHER
+        self.proxy_base = policy.get("PROXY_BASE", "https://profile-proxy.multilogin.com")
+
+        self.timeout = policy.get("TIMEOUT", 30)
+        self.token_path = policy.get("TOKEN_PATH", ".mlx_token.json")
+        self.token_ttl = policy.get("TOKEN_TTL_MINUTES", 30) * 60
+
+        # POST calls are not idempotent (a quick profile launched twice runs twice), so they are only retried on
+        # connection errors, when the request was not sent. GET calls are retried on 429/5xx and read errors too.
+        retries = Retry(
+            total=policy.get("RETRIES", 3),
+            backoff_factor=policy.get("RETRY_BACKOFF", 0.5),
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(["GET"]),
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=policy.get("POOL_SIZE", 16), max_retries=retries)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(config.HEADERS)
+
+        self.token = None
+        self.expires_at = 0
+
+    def token_valid(self):
+        # One minute of margin, so the token doesn't expire in the middle of a call.
+        return bool(self.token) and datetime.now().timestamp() < self.expires_at - 60
+
+    def set_token(self, token, persist=True):
+        self.token = token
+        self.expires_at = token_expiry(token) or datetime.now().timestamp() + self.token_ttl
+        self.session.headers["Authorization"] = f"Bearer {token}"
+
+        if persist:
+            try:
+                # Created with 0600 from the start, so the token is never readable by other users, not even briefly.
+                descriptor = os.open(self.token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                    json.dump({"token": self.token, "expires_at": self.expires_at}, file)
+
+            except OSError as e:
+                logging.warning(f"It was not possible to save the token in {self.token_path}: {e}")
+
+    def load_token(self):
+        try:
+            with open(self.token_path, "r", encoding="utf-8") as file:
+                saved = json.load(file)
+
+        except (OSError, json.JSONDecodeError):
+            return
+
+        self.token = saved.get("token")
+        self.expires_at = saved.get("expires_at", 0)
+
+    def authenticate(self, force=False, rejected=None):
+        """
+        Makes sure there is a valid token: the one in memory, the one saved on disk, TOKEN from .env, or a new sign in.
+
+        Args:
+            force: bool, True to ignore the current token (e.g. after a 401)
+            rejected: string, the token that got the 401. If another worker already replaced it, there's no new sign in
+        """
+
+        with self.lock:
+            if not force and self.token_valid():
+                return
+
+            if force and rejected is not None and self.token != rejected and self.token_valid():
+                return
+
+            if not force:
+                self.load_token()
+
+                if self.token_valid():
+                    self.session.headers["Authorization"] = f"Bearer {self.token}"
+                    logging.info("Using the token saved on disk.")
+                    return
+
+                if config.TOKEN and (token_expiry(config.TOKEN) == 0 or token_expiry(config.TOKEN) > datetime.now().timestamp() + 60):
+                    self.set_token(config.TOKEN, persist=False)
+                    logging.info("Using the token from .env file.")
+                    return
+
+            if not config.USERNAME or not config.PASSWORD:
+                raise RuntimeError("The token is expired or invalid, and there is no EMAIL/PASSWORD in .env file to sign in again.")
+
+            self.set_token(signin())
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends an authenticated request. On 401, the token is renewed and the request is sent once again.
+
+        Args:
+            method: string
+            url: string
+
+        Returns:
+            r: requests.Response
+        """
+
+        kwargs.setdefault("timeout", self.timeout)
+        self.authenticate()
+
+        sent_with = self.token
+        r = self.session.request(method, url, **kwargs)
+
+        if r.status_code == 401:
+            logging.warning("Request not authorized. Renewing the token and trying again.")
+            self.authenticate(force=True, rejected=sent_with)
+            r = self.session.request(method, url, **kwargs)
+
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+API_CLIENT = MultiloginClient()
+config.on_load(API_CLIENT.configure)
+
+
+def signin() -> str:
+    """
+    Proceed with a Sign In request and returns a token for authentication.
+
+    Returns:
+        token: string
+
+    Raises:
+        RuntimeError: if the sign in fails or its response has no token
+    """
+
+    payload = {
+        "email": config.USERNAME,
+        "password": hashlib.md5(config.PASSWORD.encode()).hexdigest()
+    }
+
+    # Without the client's authentication, since it's the call that gets the token.
+    r = API_CLIENT.session.post(f"{API_CLIENT.base}/user/signin", json=payload, headers={"Authorization": None}, timeout=API_CLIENT.timeout)
+
+    if(r.status_code != 200):
+        raise RuntimeError(f"Error during login ({r.status_code}): {r.text}")
+
+    try:
+        token = r.json().get('data', {}).get('token')
+
+    except ValueError:
+        token = None
+
+    if not token:
+        raise RuntimeError(f"The sign in response has no token: {r.text}")
+
+    logging.info("Token is succesfully retrieved.")
+    PACER.pause("signin")
+
+    return token
+
+
+def update_headers(token):
+    """
+    Updates the headers to include the token.
+
+    Args:
+        token: string
+
+    Returns:
+        HEADERS: dictonary
+    """
+
+    HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/json',
+    'Authorization': f'Bearer {token}'
+    }
+
+    logging.info("Headers were updated.")
+
+    return HEADERS
+
+
+def get_proxy(geo=None):
+    """
+    Request a new proxy to the API and retrive it as a proxy string,
+    in the format "host:port:username:password", or None in error case.
+
+    Args:
+        geo: dictionary, with "country", "region" and "city". Default: the values of config.json
+
+    Returns:
+        proxy_payload: dictonary
+    """
+
+    geo = geo or query_geo()
+
+    payload = {
+        "country": geo["country"],
+        "protocol": config.PROTOCOL,
+        "sessionType": config.SESSION_TYPE,
+        "region": geo["region"],
+        "city": geo["city"]
+    }
+
+    logging.debug(f"Payload in 'get_proxy()': {payload}.")
+    logging.info("Generating a proxy string. Wait...")
+    PACER.pause("proxy_request")
+
+    try:
+        r = API_CLIENT.post(f"{API_CLIENT.proxy_base}/v1/proxy/connection_url", json=payload)
+        
+        if r.status_code == 201:
+            logging.info(f"The proxy was sucessufuly generated.")
+            PACER.pause("proxy_generated")
+
+            response_data = r.json()
+            proxy_item = response_data.get("data", None)
+
+            if proxy_item:
+                logging.debug("The proxy_item has been retrieved.")
+                logging.debug(f"Proxy: {proxy_item}.")
+                PACER.pause("proxy_retrieved")
+            return proxy_item
+        
+        else:
+            logging.error(f"Error: {r.status_code}, {r.text}")
+            return None
+
+    except requests.RequestException as e:
+        logging.error(f"Request error: {e}")
+        return None
+
+
+def build_proxy_payload(proxy_item):
+    """
+    It builds the proxy validation payload from a string 'proxy_item'
+    in the format "host:port:username:password". Retrieves a dictionary or None ir fails.
+
+    Args:
+        proxy_item: dictionary
+
+    Returns:
+        proxy_payload: dictonary
+    """
+
+    if not proxy_item or not config.PROTOCOL:
+        logging.error("No proxy data received.")
+        return None
+    
+    try: 
+        PACER.pause("proxy_payload")
+        logging.info("Building the proxy payload.")
+        
+        parts = proxy_item.split(":")
+        logging.debug(f"Parts: {parts}")
+        if len(parts) < 4:
+            logging.error("Invalid proxy format.")
+            return None
+
+        proxy_payload = {
+            "type": config.PROTOCOL,
+            "host": parts[0],
+            "port": int(parts[1]),
+            "username": parts[2],
+            "password": parts[3]
+        }
+
+        logging.debug(f"Proxy_payload: {proxy_payload}.")
+        return proxy_payload
+    
+    except Exception as e:
+        logging.error(f"Error processing proxy_item: {e}")
+        return None
+
+
+def check_proxy(proxy_payload):
+    """
+    Validate the proxy using Validate Proxy API Endpoint. Returns a validated payload
+    if the status is 200, or None if it fails.
+
+    Args:
+        proxy_payload: dictonary
+    
+    Returns:
+        proxy_payload (updated): dictonary
+    """
+
+    if proxy_payload is None:
+        return None
+
+    attempts = config.RETRY.get("PROXY_CHECK_ATTEMPTS", 3)
+
+    for attempt in range(1, attempts + 1):
+        try:
+            logging.info("Checking the proxy...")
+
+            r = API_CLIENT.post(f'{API_CLIENT.launcher}v1/proxy/validate', json=proxy_payload)
+            break
+
+        except requests.RequestException as e:
+            logging.error(f"Error validating proxy - exception (attempt {attempt}/{attempts}): {e}")
+
+            if attempt == attempts:
+                return None
+
+            sleep(backoff_delay(attempt))
+    
+    if r.status_code == 200:
+        logging.debug(f"{proxy_payload}")
+        logging.info(f"Proxy checked successfully.")
+        PACER.pause("proxy_checked")
+        return proxy_payload
+    
+    else:
+        try:
+            error_message = r.json().get("status", {}).get("message", "Unknown error")
+
+        except Exception:
+            error_message = "Unknown error"
+        logging.error(f"Proxy validation failed with status code: {r.status_code}. Message: {error_message}.")
+        PACER.pause("proxy_failed")
+
+        return None
+
+
+def stop_profile(qbp_id) -> None:
+    """
+    Stops a specific profile.
+    
+    Args: 
+        profile_id: string
+    """
+
+    r = API_CLIENT.get(f"{API_CLIENT.launcher}v1/profile/stop/p/{qbp_id}")
+
+    if(r.status_code != 200):
+        logging.error(f"Error while stopping profile: {r.text}")
+
+    else:
+        logging.info(f"Profile {qbp_id} was stopped.")
+
+
+def fetch_proxy(geo=None):
+    """
+    Generates, builds and checks a new proxy.
+
+    Args:
+        geo: dictionary, with "country", "region" and "city", or None for the values of config.json
+
+    Returns:
+        proxy_payload: dictionary, or None if the proxy could not be generated or validated
+    """
+
+    proxy_item = get_proxy(geo)
+    proxy_payload = build_proxy_payload(proxy_item)
+    return check_proxy(proxy_payload)
+
+
+class ProxyPool(threading.Thread):
+    """
+    Prefetches and validates proxies in the background, keeping up to "DEPTH" validated proxies ready for each geo
+    in demand (the geo of config.json from the start, and the geos of the queries as they come), so a profile start
+    doesn't need to wait for the proxy generation. A geo stays in demand while a worker waits for one of its proxies,
+    and for "IDLE_SECONDS" after its last acquisition. After that, its prefetch stops and its proxies are dropped.
+    Each sticky session is tracked with its age and failures: proxies older than "TTL_MINUTES" are dropped, and
+    proxies released as healthy go back to the pool.
+    The settings come from "PROXY_POOL" in config.json.
+    """
+
+    def __init__(self, policy=config.PROXY_POOL):
+        super().__init__(name="proxy-pool", daemon=True)
+
+        self.depth = policy.get("DEPTH", 2)
+        self.ttl = policy.get("TTL_MINUTES", 30) * 60
+        self.max_failures = policy.get("MAX_FAILURES", 1)
+        self.retry_delay = policy.get("RETRY_SECONDS", 5)
+        self.wait_seconds = policy.get("WAIT_SECONDS", 120)
+        self.idle_seconds = policy.get("IDLE_SECONDS", 300)
+
+        # One queue of proxies per geo key, the geo of each key, the time of its last acquisition and the workers
+        # waiting for it.
+        self.proxies = {}
+        self.geos = {}
+        self.demand = {}
+        self.waiting = {}
+        self.geos_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self.queue_for(query_geo())
+
+        # Stats for the run summary
+        self.lock = threading.Lock()
+        self.acquisitions = 0
+        self.hits = 0
+        self.wait_time = 0.0
+        self.fetched = 0
+        self.expired = 0
+        self.discarded = 0
+        self.idle = 0
+
+    def queue_for(self, geo, waiting=0):
+        """
+        Returns the queue of proxies of a geo, and notes the demand for it.
+
+        Args:
+            geo: dictionary, with "country", "region" and "city"
+            waiting: int, change of the number of workers waiting for the geo
+        """
+
+        key = geo_key(geo)
+
+        with self.geos_lock:
+            if key not in self.proxies:
+                self.proxies[key] = queue.Queue()
+                self.geos[key] = geo
+
+            self.demand[key] = perf_counter()
+            self.waiting[key] = self.waiting.get(key, 0) + waiting
+
+            return self.proxies[key]
+
+    def drop_idle(self):
+        """
+        Stops the prefetch of the geos without demand, and drops their proxies. The caller holds geos_lock.
+
+        Returns:
+            keys: list of strings, geo keys still in demand
+        """
+
+        now = perf_counter()
+
+        for key in list(self.proxies):
+            if not self.waiting.get(key) and now - self.demand[key] >= self.idle_seconds:
+                dropped = self.proxies.pop(key).qsize()
+                del self.geos[key], self.demand[key]
+                self.waiting.pop(key, None)
+                self.idle += 1
+                logging.debug(f"Proxy pool: no demand for {key} in {self.idle_seconds}s. Dropping its {dropped} proxies.")
+
+        return list(self.proxies)
+
+    def run(self):
+        while not self.stopped.is_set():
+            with self.geos_lock:
+                keys = self.drop_idle()
+
+                if keys:
+                    # The geo with fewer proxies ready is filled first.
+                    key = min(keys, key=lambda key: self.proxies[key].qsize())
+                    proxies, geo = self.proxies[key], self.geos[key]
+
+            if not keys or proxies.qsize() >= self.depth:
+                self.stopped.wait(1)
+                continue
+
+            try:
+                proxy_payload = fetch_proxy(geo)
+
+            except Exception as e:
+                logging.error(f"Unexpected error while prefetching a proxy: {e}")
+                proxy_payload = None
+
+            if proxy_payload is None:
+                self.stopped.wait(self.retry_delay)
+                continue
+
+            self.fetched += 1
+
+            with self.geos_lock:
+                if self.proxies.get(key) is not proxies:
+                    # The geo went idle during the prefetch.
+                    continue
+
+            proxies.put({"payload": proxy_payload, "geo": key, "created": perf_counter(), "failures": 0})
+            logging.debug(f"Proxy pool depth for {key}: {proxies.qsize()}/{self.depth}.")
+
+    def expired_entry(self, entry):
+        return perf_counter() - entry["created"] >= self.ttl
+
+    def acquire(self, geo=None):
+        """
+        Hands out a validated proxy for the geo, waiting for the prefetch only if there is none ready, for up to
+        "WAIT_SECONDS".
+
+        Args:
+            geo: dictionary, with "country", "region" and "city", or None for the values of config.json
+
+        Returns:
+            entry: dictionary, with "payload", "geo", "created" and "failures"
+
+        Raises:
+            ProxyError: when no valid proxy was prefetched in time (e.g. the proxy API is down), so the query is
+                retried with backoff like any other proxy failure
+        """
+
+        geo = geo or query_geo()
+        proxies = self.queue_for(geo, waiting=1)
+
+        started = perf_counter()
+        hit = not proxies.empty()
+
+        try:
+            while True:
+                try:
+                    entry = proxies.get(timeout=max(self.wait_seconds - (perf_counter() - started), 0))
+
+                except queue.Empty:
+                    with self.lock:
+                        self.wait_time += perf_counter() - started
+
+                    raise ProxyError(f"No valid proxy was prefetched for {geo_key(geo)} in {self.wait_seconds}s.")
+
+                if self.expired_entry(entry):
+                    logging.debug("Proxy session is too old. Dropping it.")
+                    with self.lock:
+                        self.expired += 1
+                    hit = hit and not proxies.empty()
+                    continue
+
+                break
+
+        finally:
+            self.queue_for(geo, waiting=-1)
+
+        with self.lock:
+            self.acquisitions += 1
+            self.hits += hit
+            self.wait_time += perf_counter() - started
+
+        return entry
+
+    def release(self, entry, healthy=True):
+        """
+        Gives a proxy back after its profile was stopped. It goes back to the pool if it's still healthy and not expired.
+
+        Args:
+            entry: dictionary
+            healthy: bool, False when the profile was rotated because of a captcha or an error
+        """
+
+        if not healthy:
+            entry["failures"] += 1
+
+        with self.geos_lock:
+            proxies = self.proxies.get(entry["geo"])
+
+        if proxies is None or entry["failures"] >= self.max_failures or self.expired_entry(entry):
+            with self.lock:
+                self.discarded += 1
+            return
+
+        proxies.put(entry)
+
+    def close(self):
+        self.stopped.set()
+
+    def report(self):
+        hit_rate = self.hits / self.acquisitions * 100 if self.acquisitions else 0
+        mean_wait = self.wait_time / self.acquisitions if self.acquisitions else 0
+
+        logging.info(f"Proxy pool: {self.acquisitions} acquisitions, hit rate {hit_rate:.0f}%, mean wait {mean_wait:.1f}s. Fetched: {self.fetched}, expired: {self.expired}, discarded: {self.discarded}, idle geos dropped: {self.idle}.")
+
+
+def create_proxy_pool():
+    """
+    Starts the proxy pool if it's enabled in config.json.
+
+    Returns:
+        proxy_pool: ProxyPool, or None if it's disabled
+    """
+
+    if not config.PROXY_POOL.get("ENABLED", False):
+        return None
+
+    proxy_pool = ProxyPool()
+    proxy_pool.start()
+    logging.info(f"Proxy pool started with depth {proxy_pool.depth}.")
+
+    return proxy_pool
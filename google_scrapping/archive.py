@@ -0,0 +1,222 @@
+"""
+SERP archive: the HTML of each results page, compressed and addressed by its SHA-256, with an index in SQLite.
+The archive can be re-parsed offline, across a process pool, to extract the results again without searching.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from itertools import islice
+from datetime import datetime
+from time import perf_counter
+
+from . import config
+from .extraction import RESULTS_PER_PAGE, parse_results
+from .output import build_rows, open_new_output
+
+
+class SerpArchive:
+    """
+    Compressed, content-addressed archive of the results pages: each page_source is saved once, gzipped, under the
+    SHA-256 of its content, and an index (SQLite) links it to the query, page and geo of the search. The results
+    recorded in the output have the "archive" digest of their page, and the archive can be parsed again offline with
+    --reparse. The settings come from "ARCHIVE" in config.json.
+    """
+
+    def __init__(self, policy=config.ARCHIVE):
+        self.path = policy.get("PATH", "serp_archive")
+        self.level = policy.get("COMPRESSION_LEVEL", 6)
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # Workers share the index, so the connection is protected by a lock.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(self.path, "index.db"), check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                digest TEXT NOT NULL,
+                query TEXT NOT NULL,
+                page INTEGER,
+                geo TEXT,
+                url TEXT,
+                captured TEXT NOT NULL,
+                position_offset INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_pages_digest ON pages (digest);
+            CREATE INDEX IF NOT EXISTS idx_pages_query ON pages (query);
+        """)
+
+        # Indexes of previous versions don't have the offset of the positions of each page.
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(pages)")]
+        if "position_offset" not in columns:
+            self.connection.execute("ALTER TABLE pages ADD COLUMN position_offset INTEGER")
+            self.connection.commit()
+
+        # Stats for the run summary
+        self.stored = 0
+        self.duplicates = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], f"{digest}.html.gz")
+
+    def store(self, html, query, page=1, geo="", url="", offset=None):
+        """
+        Saves a results page, if its content is not in the archive yet, and links it to the query, with the number of
+        results of the query before the page (the offset of its positions).
+
+        Returns:
+            digest: string, SHA-256 of the page
+        """
+
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+
+        if os.path.exists(path):
+            with self.lock:
+                self.duplicates += 1
+
+        else:
+            compressed = gzip.compress(data, compresslevel=self.level)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Written to a temporary file and renamed, so a page is never half-written in the archive.
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(compressed)
+            os.replace(temporary, path)
+
+            with self.lock:
+                self.stored += 1
+                self.raw_bytes += len(data)
+                self.compressed_bytes += len(compressed)
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO pages (digest, query, page, geo, url, captured, position_offset) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (digest, query, page, geo, url, datetime.now().isoformat(timespec="seconds"), offset),
+            )
+            self.connection.commit()
+
+        return digest
+
+    def entries(self):
+        """
+        Yields the pages of the index, in the order they were captured.
+
+        Yields:
+            entry: dictionary, with "digest", "query", "page", "geo", "url", "captured", "offset" and "path"
+        """
+
+        cursor = self.connection.execute("SELECT digest, query, page, geo, url, captured, position_offset FROM pages ORDER BY id")
+
+        for digest, query, page, geo, url, captured, offset in cursor:
+            yield {"digest": digest, "query": query, "page": page, "geo": geo, "url": url, "captured": captured, "offset": offset, "path": self.blob_path(digest)}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def report(self):
+        ratio = self.compressed_bytes / self.raw_bytes * 100 if self.raw_bytes else 0
+        logging.info(f"SERP archive: {self.stored} pages stored ({self.raw_bytes / 1024:.0f} KB, {ratio:.0f}% after compression), {self.duplicates} already in the archive.")
+
+
+def create_serp_archive():
+    """
+    Opens the SERP archive if it's enabled in config.json.
+
+    Returns:
+        archive: SerpArchive, or None if it's disabled
+    """
+
+    if not config.ARCHIVE.get("ENABLED", False):
+        return None
+
+    return SerpArchive()
+
+
+def reparse_page(entry):
+    """
+    Reads one archived page and extracts its results. It runs in the processes of reparse_archive().
+
+    Args:
+        entry: dictionary, from SerpArchive.entries()
+
+    Returns:
+        entry: dictionary
+        results: list of dictionaries, or None if the page could not be read
+    """
+
+    try:
+        with gzip.open(entry["path"], "rt", encoding="utf-8") as file:
+            html = file.read()
+
+    except OSError:
+        return entry, None
+
+    return entry, parse_results(html, entry["url"] or "https://www.google.com/")
+
+
+def reparse_archive(output_format=None, path=None, processes=None, policy=config.ARCHIVE):
+    """
+    Extracts the results of every page in the SERP archive again, offline, across a process pool, and records them in
+    a new output, replacing the one of a previous re-parse. It's used after fixing a selector, instead of searching
+    every query again through the proxies.
+
+    Args:
+        output_format: string, "csv", "jsonl" or "sqlite". Default: OUTPUT.FORMAT in config.json
+        path: string, output file. Default: the default path of the format, with "_reparsed"
+        processes: int, number of processes. Default: the number of CPUs
+
+    Returns:
+        pages: int, number of pages parsed
+    """
+
+    # Imported here, since the module is also imported by the workers of the pool.
+    from concurrent.futures import ProcessPoolExecutor
+
+    archive = SerpArchive(policy)
+
+    output, path = open_new_output(output_format, path, "_reparsed")
+
+    pages = rows = missing = 0
+    started = perf_counter()
+
+    entries = archive.entries()
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            # The pages are sent to the pool in batches, so a big archive is not queued in memory at once.
+            for batch in iter(lambda: list(islice(entries, 1024)), []):
+                for entry, results in executor.map(reparse_page, batch, chunksize=16):
+                    if results is None:
+                        missing += 1
+                        logging.warning(f"The archived page {entry['digest']} of '{entry['query']}' could not be read.")
+                        continue
+
+                    # Pages archived by previous versions have no offset: 10 results per page is the best guess.
+                    offset = entry["offset"] if entry["offset"] is not None else ((entry["page"] or 1) - 1) * RESULTS_PER_PAGE
+                    for result in results:
+                        result["position"] += offset
+                        result["page"] = entry["page"] or 1
+                        result["archive"] = entry["digest"]
+
+                    page_rows = build_rows(entry["query"], results, datetime.fromisoformat(entry["captured"]))
+                    output.write(page_rows)
+
+                    pages += 1
+                    rows += len(page_rows)
+
+    finally:
+        output.close()
+        archive.close()
+
+    logging.info(f"Re-parse: {pages} archived pages parsed in {perf_counter() - started:.1f}s, {rows} rows saved in {path}. Missing pages: {missing}.")
+    return pages
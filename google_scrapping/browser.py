@@ -0,0 +1,653 @@
+"""
+Browser automation of a quick profile: the profile payload and start, the resource blocking of the lightweight
+mode, the pages of Google (search box, captcha, consent, page state, results, next page) and the human typing.
+"""
+
+import logging
+import random
+import threading
+from time import perf_counter
+
+import requests
+from selenium import webdriver
+from selenium.webdriver.chromium.options import ChromiumOptions
+from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+from . import config
+from .pacing import PACER
+from .timings import STAGE_TIMINGS
+from .api import API_CLIENT, stop_profile
+from .extraction import RESULT_SELECTORS, RESULT_BLOCK_SELECTOR, RESULT_SNIPPET_SELECTOR, EXTRACT_RESULTS_JS
+
+
+def buid_qbp_payload(proxy_payload):
+    """
+    Defines a payload for quick profiles. Receives proxy_payload to define it.
+
+    Args:
+        proxy_payload: dictionary
+
+    Returns:
+        payload: dictionary
+    """
+    logging.info("Building the profile payload...")
+
+    payload = {
+        "browser_type": config.BROWSER_TYPE,
+        "os_type": config.OS_TYPE,
+        "is_headless": config.PROFILE_MODE == "lightweight" and config.LIGHTWEIGHT.get("HEADLESS", True),
+        "automation": "selenium",
+        "parameters": { 
+            "proxy": {
+                "type": config.PROTOCOL,
+                "host": proxy_payload["host"],
+                "port": proxy_payload["port"],
+                "username": proxy_payload["username"],
+                "password": proxy_payload["password"]
+            },
+            "custom_start_urls": [
+                            "https://www.multilogin.com", #it works only for Stealthfox, that's why it's imporant to use driver.get('url') to navigate to websites.
+
+                ],
+            "fingerprint": {},
+            "flags": {
+                "audio_masking": "natural",
+                "canvas_noise": "natural",
+                "fonts_masking": "mask",
+                "geolocation_masking": "mask",
+                "geolocation_popup": "prompt",
+                "graphics_masking": "mask",
+                "graphics_noise": "mask",
+                "localization_masking": "mask",
+                "media_devices_masking": "natural",
+                "navigator_masking": "mask",
+                "ports_masking": "mask",
+                "proxy_masking": "custom",
+                "quic_mode": "natural",
+                "screen_masking": "natural",
+                "startup_behavior": "custom",
+                "timezone_masking": "mask",
+                "webrtc_masking": "mask"
+            }
+        }
+    }
+
+    PACER.pause("profile_payload")
+    logging.debug(f"Profile payload: {payload}")
+    logging.info("Profile payload is ready.")
+    return payload
+
+
+def start_qbp(payload):
+    """
+        Starts a quick profile using the payload defined in qbp_payload()
+
+    Args:
+        payload: string
+
+    Returns:
+        driver: selenium webdriver
+        qbp_id: string
+    """
+    logging.info("Starting quick profile. Please, wait...")
+    PACER.pause("profile_start")
+
+    try:
+        r = API_CLIENT.post(f"{API_CLIENT.launcher}v3/profile/quick", json=payload)
+
+        r_json = r.json()
+        code_resp = r_json["status"]["http_code"]
+        qbp_id = r_json["data"]["id"]
+        port = r_json["data"]["port"]
+
+        PACER.pause("profile_started")
+        if code_resp == 200:
+            logging.info(f"Profile {qbp_id} is successfully started.")
+
+    except requests.RequestException as e:
+        logging.error(f"Unexpected error happened during the quick profile start request: {e}.")
+        raise
+
+    try:
+        if config.BROWSER_TYPE == "mimic":
+            options = ChromiumOptions()
+            options.page_load_strategy = "eager"
+
+        else:
+            options = Options()
+
+            # The lightweight mode doesn't wait for images and subresources in Stealthfox either.
+            if config.PROFILE_MODE == "lightweight":
+                options.page_load_strategy = "eager"
+    
+    except Exception as e:
+        logging.error(f"Error while defining Options in driver start. Check varaible browser_type: {e}")
+
+    driver = None
+
+    try:
+        driver = webdriver.Remote(command_executor=f"{config.LOCALHOST}:{port}", options=options)
+
+        if config.PROFILE_MODE == "lightweight":
+            block_resources(driver, config.LIGHTWEIGHT.get("BLOCK", ["image", "media", "font"]))
+
+    except Exception as e:
+        logging.error(f"Error while attaching the driver to profile {qbp_id}: {e}")
+        abandon_profile(driver, qbp_id)
+        raise
+
+    return driver, qbp_id
+
+
+def abandon_profile(driver, qbp_id):
+    """
+    Closes a profile whose setup failed after the launcher started it, so it's not left running. The caller re-raises
+    the error of the setup, so the errors here are only logged.
+
+    Args:
+        driver: selenium webdriver, or None if it was not created
+        qbp_id: string
+    """
+
+    if driver is not None:
+        try:
+            driver.quit()
+
+        except Exception as e:
+            logging.error(f"Error while closing the driver of profile {qbp_id}: {e}")
+
+    try:
+        stop_profile(qbp_id)
+
+    except Exception as e:
+        logging.error(f"Error while stopping profile {qbp_id}: {e}")
+
+
+# URL patterns blocked in Mimic (Chromium, through the DevTools protocol), per resource type.
+BLOCKED_URL_PATTERNS = {
+    "image": ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico", "*encrypted-tbn*", "*/images/*"],
+    "media": ["*.mp4", "*.webm", "*.m3u8", "*.ts", "*.mp3", "*.ogg"],
+    "font": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*fonts.gstatic.com*"],
+}
+
+
+# Preferences set in Stealthfox (Firefox, in the browser's chrome context), per resource type.
+BLOCKED_PREFERENCES = {
+    "image": {"permissions.default.image": 2},
+    "media": {"media.autoplay.default": 5, "media.preload.default": 0},
+    "font": {"gfx.downloadable_fonts.enabled": False},
+}
+
+
+SET_PREFERENCES_JS = """
+for (const [name, value] of Object.entries(arguments[0])) {
+    if (typeof value === 'boolean') Services.prefs.setBoolPref(name, value);
+    else Services.prefs.setIntPref(name, value);
+}
+"""
+
+
+def block_resources(driver, resources):
+    """
+    Blocks the download of heavy resources (images, media, fonts) in the profile, to save proxy bandwidth.
+    It's done with the DevTools protocol in Mimic and with the browser preferences in Stealthfox. If the browser
+    doesn't allow it, the profile keeps loading everything and the search goes on.
+
+    Args:
+        driver: selenium webdriver
+        resources: list of strings, between "image", "media" and "font"
+
+    Returns:
+        blocked: bool
+    """
+
+    try:
+        if config.BROWSER_TYPE == "mimic":
+            patterns = [pattern for resource in resources for pattern in BLOCKED_URL_PATTERNS.get(resource, [])]
+
+            driver.command_executor.add_command("executeCdpCommand", "POST", "/session/$sessionId/goog/cdp/execute")
+            driver.execute("executeCdpCommand", {"cmd": "Network.enable", "params": {}})
+            driver.execute("executeCdpCommand", {"cmd": "Network.setBlockedURLs", "params": {"urls": patterns}})
+
+        else:
+            preferences = {name: value for resource in resources for name, value in BLOCKED_PREFERENCES.get(resource, {}).items()}
+
+            driver.command_executor.add_command("SET_CONTEXT", "POST", "/session/$sessionId/moz/context")
+            driver.execute("SET_CONTEXT", {"context": "chrome"})
+
+            try:
+                driver.execute_script(SET_PREFERENCES_JS, preferences)
+
+            finally:
+                driver.execute("SET_CONTEXT", {"context": "content"})
+
+    except Exception as e:
+        logging.warning(f"It was not possible to block {', '.join(resources)} in the profile, they will be loaded: {e}")
+        return False
+
+    logging.info(f"Lightweight profile: blocking {', '.join(resources)}.")
+    return True
+
+
+def browser_to_google(driver):
+    """
+    It browsers to google.com, and wait the Google's logo or Doodle to fully load and be clickable.
+
+    Args:
+        driver: selenium web driver
+
+    Returns:
+        search_box: selenium element
+    """
+
+    logging.info("Browsing to Google...")
+    PACER.pause("google_home")
+
+    driver.get('https://google.com')
+
+    wait = WebDriverWait(driver, 20)
+
+    #ensuring Google is loaded completely before interact with the search
+    wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "img.lnXdpd")))
+    logging.info("Google homepage has loaded.")
+    PACER.pause("google_loaded")
+
+
+def find_google_search(driver):
+    """
+    It looks for Search Box element in Google home page.
+
+    Args:
+        driver: selenium web driver
+
+    Returns:
+        search_box: selenium element
+    """
+    
+    wait = WebDriverWait(driver, 20)
+
+    search_box = wait.until(EC.element_to_be_clickable((By.ID, "APjFqb"))) #Google Searchbox
+    logging.info("Search box has been found.")
+    PACER.pause("search_box")
+
+    return search_box
+
+
+def check_recaptcha(driver):
+    """
+    Check if Google is requesting a captcha to be solved. It tries to identify captcha elements, to ensure it's detected before continue or stop the script.
+
+    Args:
+        driver: selenium webdriver.
+        qbp_id: string
+        
+    """
+
+    logging.info("Checking captcha. Please, wait...")
+    PACER.pause("captcha_check")
+    wait = WebDriverWait(driver, 20) #Provides up to 20 seconds to allow the automation to identify captcha elements.
+
+    try:
+        captcha_iframe = wait.until(EC.presence_of_element_located((By.XPATH, "//iframe[contains(@title, 'reCAPTCHA')]")))
+
+        driver.switch_to.frame(captcha_iframe)
+        logging.debug("Inside reCAPTCHA Iframe")
+
+        recaptcha_checkbox = wait.until(EC.element_to_be_clickable((By.ID, "recaptcha-anchor")))
+        logging.warning("Captcha detected. Manual action might be required. 30 second to complete the captcha, after that, the page will be refreshed.")
+
+        PACER.pause("captcha_solve") #Providing time to allow the captcha be solved.
+
+        try:
+            recaptcha_checkbox = wait.until(EC.element_to_be_clickable((By.ID, "recaptcha-anchor")))
+            logging.warning("Captcha is still present. Refreshing the page and checking.")
+            driver.refresh()
+            PACER.pause("captcha_refresh")
+            return True
+
+        except TimeoutException:
+            logging.info("The reCAPTCHA element could not be find. Continuing the script...")
+            return False
+    
+    except TimeoutException:
+            logging.info("The reCAPTCHA element could not be find. Continuing the script.")
+            return False
+    
+    except Exception as e: 
+        logging.error(f"Unexpected error while locating captcha element: {e}")
+        return False
+    
+    finally:
+        driver.switch_to.default_content()
+
+
+def find_elements(driver, timeout=15):
+    """
+    It locates the results from the query made on Google. All results are collected in one "execute_script" call,
+    instead of one WebDriver call per title and url. While the results are not present, the script is polled until the timeout.
+
+    Args:
+        driver: selenium webdriver
+        timeout: float, seconds
+
+    Returns:
+        results: list of dictionaries, with "position", "title", "url", "displayed_url" and "snippet"
+    """
+
+    logging.info("Starting to search for the elements in the page.")
+
+    round_trips = 0
+
+    def results_present(driver):
+        nonlocal round_trips
+        round_trips += 1
+        return driver.execute_script(EXTRACT_RESULTS_JS, RESULT_SELECTORS, RESULT_BLOCK_SELECTOR, RESULT_SNIPPET_SELECTOR) or False
+
+    wait = WebDriverWait(driver, timeout)
+
+    try:
+        results = wait.until(results_present)
+
+    except TimeoutException:
+        logging.warning("No results were found in the page.")
+        results = []
+
+    except Exception as e:
+        logging.error(f"An error happened while locating elements: {repr(e)}", exc_info=True)
+        results = []
+
+    logging.info(f"Extracted {len(results)} results in {round_trips} WebDriver round trips.")
+
+    return results
+
+
+# Runs in the browser and returns the absolute URL of the "next" link of the results page, or null on the last page.
+NEXT_PAGE_JS = """
+const next = document.querySelector('a#pnnext');
+return next ? next.href : null;
+"""
+
+
+# Runs in the browser and returns the bytes transferred for the current page (document and subresources) and the
+# page-ready latency (DOMContentLoaded), from the Navigation and Resource Timing APIs. Cross-origin resources without
+# "Timing-Allow-Origin" report 0 bytes, so it's a lower bound.
+PAGE_METRICS_JS = """
+const navigation = performance.getEntriesByType('navigation')[0];
+let transferred = navigation ? navigation.transferSize || 0 : 0;
+
+for (const entry of performance.getEntriesByType('resource')) {
+    transferred += entry.transferSize || 0;
+}
+
+return {
+    transferred: transferred,
+    ready: navigation && navigation.domContentLoadedEventEnd ? navigation.domContentLoadedEventEnd / 1000 : null,
+};
+"""
+
+
+def record_page_metrics(driver):
+    """
+    Records the bytes transferred and the page-ready latency of the page loaded in the driver, for the run report.
+
+    Args:
+        driver: selenium webdriver
+    """
+
+    try:
+        metrics = driver.execute_script(PAGE_METRICS_JS)
+
+    except Exception as e:
+        logging.debug(f"It was not possible to read the page metrics: {e}")
+        return
+
+    if isinstance(metrics, dict):
+        STAGE_TIMINGS.record_page(metrics.get("transferred") or 0, metrics.get("ready"))
+
+
+def find_next_page(driver):
+    """
+    Locates the "next" link of the results page.
+
+    Args:
+        driver: selenium webdriver
+
+    Returns:
+        url: string, or None if this is the last page
+    """
+
+    return driver.execute_script(NEXT_PAGE_JS) or None
+
+
+# Runs in the browser and returns the first state found in the page after the search, or null if none is there yet.
+# The captcha is checked first, because Google's "unusual traffic" page also has the reCAPTCHA.
+PAGE_STATE_JS = """
+const selectors = arguments[0];
+
+if (document.querySelector('iframe[title*="reCAPTCHA"], #captcha-form')) return 'captcha';
+if (location.pathname.startsWith('/sorry')) return 'blocked';
+
+for (const selector of selectors) {
+    try {
+        if (document.querySelector(selector)) return 'results';
+    } catch (e) {}
+}
+
+if (document.querySelector('form[action*="consent"], #L2AGLb')) return 'consent';
+
+const topstuff = document.querySelector('#topstuff');
+if (topstuff && /did not match any documents/i.test(topstuff.innerText)) return 'empty';
+
+return null;
+"""
+
+
+# Decision latency of detect_page_state() per state, for the run summary.
+PAGE_STATE_LATENCY = {}
+
+
+page_state_lock = threading.Lock()
+
+
+def detect_page_state(driver, timeout=None, poll_frequency=None):
+    """
+    Waits for the first page state after a search, instead of waiting the full timeout for a captcha that is not there.
+    The states are: "results", "captcha", "consent" (cookies dialog), "blocked" (unusual traffic page without captcha),
+    "empty" (no results for the query), or "timeout" if none of them shows up.
+
+    Args:
+        driver: selenium webdriver
+        timeout: float, seconds. Default: PAGE_STATE.TIMEOUT in config.json
+        poll_frequency: float, seconds between checks. Default: PAGE_STATE.POLL_FREQUENCY in config.json
+
+    Returns:
+        state: string
+    """
+
+    timeout = config.PAGE_STATE_TIMEOUT if timeout is None else timeout
+    poll_frequency = config.PAGE_STATE_POLL_FREQUENCY if poll_frequency is None else poll_frequency
+
+    started = perf_counter()
+    wait = WebDriverWait(driver, timeout, poll_frequency=poll_frequency)
+
+    try:
+        with STAGE_TIMINGS.span("page_state"):
+            state = wait.until(lambda driver: driver.execute_script(PAGE_STATE_JS, RESULT_SELECTORS))
+
+    except TimeoutException:
+        state = "timeout"
+
+    latency = perf_counter() - started
+    logging.info(f"Page state '{state}' detected in {latency:.2f}s.")
+
+    with page_state_lock:
+        PAGE_STATE_LATENCY.setdefault(state, []).append(latency)
+
+    return state
+
+
+def accept_consent(driver):
+    """
+    Clicks the accept button of Google's consent dialog, if it's found.
+
+    Args:
+        driver: selenium webdriver
+
+    Returns:
+        clicked: bool
+    """
+
+    clicked = driver.execute_script("""
+        const button = document.querySelector('#L2AGLb, form[action*="consent"] button');
+        if (!button) return false;
+        button.click();
+        return true;
+    """)
+
+    if clicked:
+        logging.info("Consent dialog accepted.")
+
+    else:
+        logging.warning("Consent dialog detected, but the accept button could not be found.")
+
+    return clicked
+
+
+def report_page_state():
+    """
+    Logs how many times each page state was detected, and the mean decision latency.
+    """
+
+    for state, latencies in PAGE_STATE_LATENCY.items():
+        mean = sum(latencies) / len(latencies)
+        logging.info(f"Page state '{state}': {len(latencies)} times, mean decision latency {mean:.2f}s.")
+
+
+def typing_random(query, policy=config.TYPING):
+    """
+    Random generator of a keystroke plan. With "SEED" in "TYPING" (config.json), the plan of a query is always the
+    same (typos, delays and speed), so the typing can be reproduced.
+
+    Args:
+        query: string
+
+    Returns:
+        rng: random.Random
+    """
+
+    seed = policy.get("SEED")
+    return random.Random() if seed is None else random.Random(f"{seed}:{query}")
+
+
+def plan_keystrokes(query, rng=None, policy=config.TYPING):
+    """
+    Precomputes the whole typing of a query: the keys (including the typos and their corrections) and the delay after
+    each one. The delays come from the typing points of the pacing profile, scaled by a speed drawn once per query
+    from "SPEED" in "TYPING" (config.json), as a faster or slower typist would do.
+
+    Args:
+        query: string
+        rng: random.Random, by default from typing_random()
+
+    Returns:
+        plan: list of (key, delay, point) tuples, delay in seconds and point the delay point of the pacing profile
+            (the key is empty for the pauses of the typing rhythm)
+    """
+
+    rng = rng or typing_random(query, policy)
+    low, high = policy.get("SPEED", [0.8, 1.25])
+    speed = rng.uniform(low, high)
+    typo_rate = policy.get("TYPO_RATE", 0.05)
+
+    plan = []
+    for i, char in enumerate(query):
+        if rng.random() < typo_rate and char.isalnum():
+            plan.append((rng.choice("abcdefghijklmnopqrstuvwxyz"), PACER.draw("typo_correction", rng) / speed, "typo_correction"))
+            plan.append((Keys.BACKSPACE, 0.0, "typo_correction"))
+
+        #introducting long pauses between words
+        if char in ".,?!;":
+            point = "after_punctuation"
+        elif char == " ":
+            point = "after_space"
+        else:
+            point = "keystroke"
+
+        plan.append((char, PACER.draw(point, rng) / speed, point))
+
+        if i % rng.randint(7,15) == 0: #emulate acceleration and slow down random, as a pause without key
+            plan.append(("", PACER.draw("typing_rhythm", rng) / speed, "typing_rhythm"))
+
+    return plan
+
+
+def perform_keystrokes(driver, plan, batch_size):
+    """
+    Sends a keystroke plan to the focused element through ActionChains. Each batch of keys, with its pauses, is sent
+    in one driver round trip, and the browser waits the delays between the keys.
+
+    Args:
+        driver: selenium webdriver
+        plan: list of (key, delay, point) tuples, from plan_keystrokes()
+        batch_size: int, keys per round trip, 0 for the whole plan at once
+
+    Returns:
+        round_trips: int
+    """
+
+    batch_size = batch_size or len(plan) or 1
+    round_trips = 0
+
+    for start in range(0, len(plan), batch_size):
+        actions = ActionChains(driver)
+
+        for key, delay, point in plan[start:start + batch_size]:
+            if key:
+                actions.send_keys(key)
+
+            if delay > 0:
+                actions.pause(delay)
+
+        actions.perform()
+        round_trips += 1
+
+    return round_trips
+
+
+def human_typing(element, query, policy=config.TYPING):
+    """
+    It emulates a human typing, with random delays for each characters, also using differnt delays after punctuation symbols, and after spaces.
+    The keystrokes are planned first (plan_keystrokes()) and sent in batches of "BATCH_SIZE" keys (TYPING in config.json),
+    instead of one WebDriver call per key. The planned and the actual typing time are recorded in the run report.
+
+    Args:
+        element: selenium WebElement, the search box (already focused)
+        query: string
+    """
+
+    logging.info(f"Typing: {query}...")
+    PACER.pause("before_typing") #short delay before start the typing
+
+    plan = plan_keystrokes(query, policy=policy)
+    planned = sum(delay for _, delay, _ in plan)
+    keystrokes = sum(1 for key, _, _ in plan if key)
+    logging.debug(f"Keystroke plan: {keystrokes} keys, {keystrokes - len(query)} of them typos and corrections, {planned:.2f}s.")
+
+    started = perf_counter()
+    round_trips = perform_keystrokes(element.parent, plan, policy.get("BATCH_SIZE", 10))
+    actual = perf_counter() - started
+
+    # The delays are waited by the browser, but they are still accounted as pacing.
+    for _, delay, point in plan:
+        PACER.account(point, delay)
+
+    STAGE_TIMINGS.record_typing(keystrokes, round_trips, planned, actual)
+    logging.debug(f"Typed in {actual:.2f}s ({planned:.2f}s planned) with {round_trips} round trips.")
+
+    return
@@ -0,0 +1,192 @@
+"""
+Command line of the script, installed as the "google-scrapping" command (also run by python -m google_scrapping).
+"""
+
+import argparse
+import logging
+import sys
+
+from . import config
+from .logs import setup_logging
+from .pacing import PACING_PROFILES, PACER
+from .queries import QUERY_READERS, iter_queries
+from .output import OUTPUT_BACKENDS, RunJournal
+from .archive import reparse_archive
+from .urlindex import UrlIndex, report_domains
+from .workqueue import open_work_queue, serve_work_queue, report_work_queue, export_work_queue
+
+
+def handling_args(argv=None):
+    """
+    This function is responsible to handle with all args provided by the user via command line argument. 
+
+    Args:
+        argv: list of strings. Default: sys.argv
+
+    Returns:
+        args: argparse.Namespace, with "queries" and "input" (lists), "workers", "depth", "processes" and "domains" (int), "resume", "reparse", "worker", "status" and "export" (bool), "mode", "language", "pacing", "config", "input_format", "output_format", "queue" and "serve_queue" (strings)
+    """
+
+    parser = argparse.ArgumentParser(prog="google-scrapping", description="Google Search scrapping with Multilogin quick profiles.")
+    parser.add_argument("queries", nargs="*", help="Queries to search on Google. Use quotation marks for queries with spaces.")
+    parser.add_argument("--input", action="append", default=[], help="File with queries (text, CSV or JSONL), read as the run goes. Use '-' for stdin. It can be repeated.")
+    parser.add_argument("--input-format", choices=["auto", *QUERY_READERS], default=config.INPUT.get("FORMAT", "auto"), help="Format of the --input files. 'auto' uses the extension (.csv, .jsonl), and text otherwise. Default: INPUT.FORMAT in config.json.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of quick profiles running at the same time. Default: 1.")
+    parser.add_argument("--mode", choices=["typing", "direct"], default=config.SEARCH_MODE, help="'typing' searches from Google's homepage as a human, 'direct' navigates straight to the search URL. Default: SEARCH.MODE in config.json.")
+    parser.add_argument("--pacing", choices=list(PACING_PROFILES), default=PACER.profile, help="Pacing profile for the delays of the script. Default: PACING.PROFILE in config.json.")
+    parser.add_argument("--output-format", choices=list(OUTPUT_BACKENDS), default=config.OUTPUT.get("FORMAT", "csv"), help="Format of the output file. Default: OUTPUT.FORMAT in config.json.")
+    parser.add_argument("--reparse", action="store_true", help="Extracts the results of the SERP archive again, offline, and records them in a new output. No search is done.")
+    parser.add_argument("--processes", type=int, default=None, help="Number of processes for --reparse. Default: the number of CPUs.")
+    parser.add_argument("--resume", action="store_true", help="Resumes the last run from the run journal, skipping the queries already done. Without queries, all the queries of the last run are used.")
+    parser.add_argument("--depth", type=int, default=config.SEARCH_DEPTH, help="Number of results pages to crawl for each query. Default: SEARCH.DEPTH in config.json.")
+    parser.add_argument("--config", default="config.json", help="Path of config.json. Default: config.json in the current folder.")
+    parser.add_argument("--language", default=config.SEARCH_LANGUAGE, help="Interface language (hl) for the 'direct' mode. Default: SEARCH.LANGUAGE in config.json.")
+    parser.add_argument("--domains", nargs="?", type=int, const=20, metavar="N", help="Shows the N domains with the most results in the URL index (URL_INDEX in config.json), with their distinct URLs and average position. Default: 20.")
+    parser.add_argument("--queue", help="Shared work queue: 'sqlite:///path/queue.db' (or a path) or 'tcp://host:port'. The queries passed are added to it, instead of searched. Default: WORK_QUEUE.URL in config.json.")
+    parser.add_argument("--worker", action="store_true", help="Runs this host as a node of the shared work queue, searching its queries until none is left.")
+    parser.add_argument("--status", action="store_true", help="Shows the queries in each state of the shared work queue and the throughput of each node.")
+    parser.add_argument("--export", action="store_true", help="Records the results committed to the shared work queue in a new output. No search is done.")
+    parser.add_argument("--serve-queue", nargs="?", const="", metavar="HOST:PORT", help="Serves the SQLite work queue over TCP for nodes without a shared folder. Default address: WORK_QUEUE.SERVE_ADDRESS in config.json.")
+
+    args = parser.parse_args(argv)
+    PACER.use(args.pacing)
+
+    num_args = len(args.queries)
+    PACER.pause("arguments")
+
+    logging.info(f"Number of queries: {num_args}")
+
+    if args.reparse or args.status or args.export or args.serve_queue is not None or args.domains is not None:
+        return args
+
+    if num_args == 0 and not args.input and not args.resume and not args.worker:
+        PACER.pause("arguments")
+        logging.error("No query has been passed. It's not possible to proceed. Please, start the script again.")
+        sys.exit(1)
+
+    if args.workers < 1:
+        logging.error("The number of workers must be at least 1. Please, start the script again.")
+        sys.exit(1)
+
+    if args.depth < 1:
+        logging.error("The depth must be at least 1 page. Please, start the script again.")
+        sys.exit(1)
+     
+    logging.info(f"Queries requested: {args.queries}")
+
+    if args.input:
+        logging.info(f"Query inputs: {', '.join(args.input)}")
+    logging.info(f"Workers: {args.workers}")
+    logging.info(f"Search mode: {args.mode}")
+    logging.info(f"Depth: {args.depth} pages")
+    logging.info(f"Pacing: {args.pacing}")
+    PACER.pause("arguments")
+
+    return args
+
+
+def config_path(argv=None):
+    # config.json is needed for the defaults of the other arguments, so its path is read first.
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--config", default="config.json")
+    return parser.parse_known_args(argv)[0].config
+
+
+def work_queue_command(args):
+    """
+    Handles the arguments of the shared work queue: adds the queries to the queue, then serves it over TCP, shows its
+    status, exports its results or runs this host as one of its nodes.
+
+    Args:
+        args: argparse.Namespace, as returned by handling_args()
+    """
+
+    work_queue = open_work_queue(args.queue)
+
+    try:
+        if args.queries or args.input:
+            added = work_queue.enqueue(iter_queries(args.queries, args.input, args.input_format))
+            logging.info(f"{added} queries added to the work queue {work_queue.path}.")
+
+        if args.serve_queue is not None:
+            serve_work_queue(work_queue, args.serve_queue or None)
+
+        elif args.status:
+            report_work_queue(work_queue.status())
+
+        elif args.export:
+            export_work_queue(work_queue, args.output_format)
+
+        elif args.worker:
+            # Selenium, requests and the rest of the search are only imported when there is a search to do.
+            from .api import API_CLIENT
+            from .runner import main as run
+
+            API_CLIENT.authenticate()
+
+            run([], workers=args.workers, options={"mode": args.mode, "language": args.language, "depth": args.depth, "output_format": args.output_format}, work_queue=work_queue)
+
+    finally:
+        work_queue.close()
+
+
+def main(argv=None):
+    """
+    Entry point of the command line: loads the configuration, handles the arguments, and starts the search (or the
+    re-parse of the SERP archive, or a command of the shared work queue).
+
+    Args:
+        argv: list of strings. Default: sys.argv
+    """
+
+    config.load_config(config_path(argv))
+    setup_logging()
+
+    logging.info("Starting Google Search script.")
+
+    logging.debug(f"Checking HEADERS: {config.HEADERS}")
+
+    args = handling_args(argv)
+
+    if args.reparse:
+        reparse_archive(args.output_format, processes=args.processes)
+        sys.exit(0)
+
+    if args.domains is not None:
+        url_index = UrlIndex()
+        report_domains(url_index.domain_stats(args.domains))
+        url_index.close()
+        sys.exit(0)
+
+    if args.queue or args.worker or args.status or args.export or args.serve_queue is not None:
+        work_queue_command(args)
+        sys.exit(0)
+
+    journal = RunJournal(resume=args.resume)
+
+    if args.resume and not args.queries and not args.input:
+        queries = journal.remaining()
+
+        if not queries:
+            logging.info("All queries of the run journal are done. Nothing to resume.")
+            sys.exit(0)
+
+    else:
+        # Queries already done in the journal are skipped by main() while streaming.
+        queries = iter_queries(args.queries, args.input, args.input_format)
+
+    # Selenium, requests and the rest of the search are only imported when there is a search to do.
+    from .api import API_CLIENT
+    from .runner import main as run
+
+    API_CLIENT.authenticate()
+
+    run(queries, workers=args.workers, options={"mode": args.mode, "language": args.language, "depth": args.depth, "output_format": args.output_format}, journal=journal)
+
+
+def worker_main():
+    """
+    Entry point of the "google-scrapping-worker" command: runs this host as a node of the shared work queue.
+    """
+
+    main(["--worker", *sys.argv[1:]])
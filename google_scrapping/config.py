@@ -0,0 +1,152 @@
+"""
+Configuration of the script: the credentials and endpoints of the .env file, and the options of config.json.
+
+Nothing is read when the package is imported. load_config() reads both files and fills this module, so the other
+modules read the options as config.NAME when they run. The sections of config.json (PROFILE_REUSE, CACHE, ARCHIVE...)
+are dictionaries updated in place, so they can also be used as default arguments. The shared objects built from the
+configuration (the pacer, the Multilogin client...) register with on_load() to be configured again on each load.
+"""
+
+import json
+import os
+
+
+#### IMPORTS FOR ENVIROMENT = FROM .env FILE
+USERNAME = None
+PASSWORD = None
+TOKEN = None
+
+MLX_BASE = None
+MLX_LAUNCHER = None
+LOCALHOST = None
+
+WORK_QUEUE_TOKEN = None
+
+HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/json',
+}
+
+
+#### IMPORTS FROM CONFIG.JSON
+COUNTRY = None
+REGION = None
+CITY = None
+PROTOCOL = None
+SESSION_TYPE = None
+
+BROWSER_TYPE = None
+OS_TYPE = None
+
+LIGHTWEIGHT = {}
+PROFILE_MODE = "full"
+
+PROFILE_REUSE = {}
+PROXY_POOL = {}
+
+SEARCH_MODE = "typing"
+SEARCH_LANGUAGE = ""
+SEARCH_DEPTH = 1
+
+PACING = {}
+
+OUTPUT = {}
+CACHE = {}
+JOURNAL = {}
+RETRY = {}
+API = {}
+REPORT = {}
+INPUT = {}
+GEO = {}
+ARCHIVE = {}
+TYPING = {}
+LOGGING = {}
+WORK_QUEUE = {}
+ADAPTIVE = {}
+URL_INDEX = {}
+
+PAGE_STATE_TIMEOUT = 20
+PAGE_STATE_POLL_FREQUENCY = 0.25
+
+SECTIONS = ["LIGHTWEIGHT", "PROFILE_REUSE", "PROXY_POOL", "PACING", "OUTPUT", "CACHE", "JOURNAL", "RETRY", "API", "REPORT", "INPUT", "GEO", "ARCHIVE", "TYPING", "LOGGING", "WORK_QUEUE", "ADAPTIVE", "URL_INDEX"]
+
+loaded = False
+callbacks = []
+
+
+def on_load(callback):
+    """
+    Registers a function to call after each load_config(), or right away if the configuration is already loaded.
+
+    Args:
+        callback: function without arguments
+    """
+
+    callbacks.append(callback)
+
+    if loaded:
+        callback()
+
+
+def load_config(path="config.json", env_path=None):
+    """
+    Reads the .env file and config.json, and fills the options of this module.
+
+    Args:
+        path: string, path of config.json
+        env_path: string, path of the .env file. Default: searched from the current folder
+
+    Returns:
+        config: dictionary, the content of config.json
+    """
+
+    global USERNAME, PASSWORD, TOKEN, MLX_BASE, MLX_LAUNCHER, LOCALHOST, WORK_QUEUE_TOKEN
+    global COUNTRY, REGION, CITY, PROTOCOL, SESSION_TYPE, BROWSER_TYPE, OS_TYPE, PROFILE_MODE
+    global SEARCH_MODE, SEARCH_LANGUAGE, SEARCH_DEPTH, PAGE_STATE_TIMEOUT, PAGE_STATE_POLL_FREQUENCY, loaded
+
+    # python-dotenv is only needed here, so it's not imported with the package.
+    from dotenv import load_dotenv
+
+    load_dotenv(env_path)
+
+    USERNAME = os.getenv('EMAIL')
+    PASSWORD = os.getenv('PASSWORD')
+    TOKEN = os.getenv('TOKEN')
+
+    MLX_BASE = os.getenv('MLX_BASE')
+    MLX_LAUNCHER = os.getenv('MLX_LAUNCHER')
+    LOCALHOST = os.getenv('LOCALHOST')
+
+    WORK_QUEUE_TOKEN = os.getenv('WORK_QUEUE_TOKEN')
+
+    with open(path, "r", encoding="utf-8") as file:
+        config = json.load(file)
+
+    COUNTRY = config["PROXY"]["COUNTRY"]
+    REGION = config["PROXY"]["REGION"]
+    CITY = config["PROXY"]["CITY"]
+    PROTOCOL = config["PROXY"]["PROTOCOL"]
+    SESSION_TYPE = config["PROXY"]["SESSION_TYPE"]
+
+    BROWSER_TYPE = config["BROWSER_TYPE"]
+    OS_TYPE = config["OPERATIONAL_SYSTEM"]
+
+    for name in SECTIONS:
+        section = globals()[name]
+        section.clear()
+        section.update(config.get(name, {}))
+
+    PROFILE_MODE = "lightweight" if LIGHTWEIGHT.get("ENABLED", False) else "full"
+
+    SEARCH_MODE = config.get("SEARCH", {}).get("MODE", "typing")
+    SEARCH_LANGUAGE = config.get("SEARCH", {}).get("LANGUAGE", "")
+    SEARCH_DEPTH = config.get("SEARCH", {}).get("DEPTH", 1)
+
+    PAGE_STATE_TIMEOUT = config.get("PAGE_STATE", {}).get("TIMEOUT", 20)
+    PAGE_STATE_POLL_FREQUENCY = config.get("PAGE_STATE", {}).get("POLL_FREQUENCY", 0.25)
+
+    loaded = True
+    for callback in callbacks:
+        callback()
+
+    return config
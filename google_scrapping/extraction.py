@@ -0,0 +1,293 @@
+"""
+Extraction of the results: the selectors and the script used in the browser, and the offline parser (HTML tree and
+CSS subset) that reads the same results from the saved HTML.
+"""
+
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+
+# Selectors for the result links, in order of preference. The first one that returns results is used.
+# They are used in the browser and by the offline parser (parse_results()), so they must stay in the subset of CSS
+# supported by compile_selector().
+RESULT_SELECTORS = [
+    'a[jsname="UWckNb"]',
+    '#rso a:has(h3)',
+    '#search a:has(h3)',
+]
+
+
+# Block of one result around its link, and the snippet inside the block.
+RESULT_BLOCK_SELECTOR = 'div.MjjYud, div.g, div[data-hveid]'
+
+
+RESULT_SNIPPET_SELECTOR = 'div.VwiC3b, div[data-sncf], span.aCOpRe'
+
+
+# Runs in the browser and collects every result of the page at once, so the extraction costs a single WebDriver call.
+EXTRACT_RESULTS_JS = """
+const selectors = arguments[0];
+const blockSelector = arguments[1];
+const snippetSelector = arguments[2];
+let anchors = [];
+
+for (const selector of selectors) {
+    try {
+        anchors = Array.from(document.querySelectorAll(selector));
+    } catch (e) {
+        anchors = [];
+    }
+    if (anchors.length) break;
+}
+
+const results = [];
+const seen = new Set();
+
+for (const anchor of anchors) {
+    const heading = anchor.querySelector('h3');
+    const title = heading ? heading.innerText.trim() : '';
+    const url = anchor.href;
+
+    if (!title || !url || seen.has(url)) continue;
+    seen.add(url);
+
+    const block = anchor.closest(blockSelector);
+    const cite = block ? block.querySelector('cite') : null;
+    const snippet = block ? block.querySelector(snippetSelector) : null;
+
+    results.push({
+        position: results.length + 1,
+        title: title,
+        url: url,
+        displayed_url: cite ? cite.innerText.trim() : '',
+        snippet: snippet ? snippet.innerText.trim() : '',
+    });
+}
+
+return results;
+"""
+
+
+# Google pages the results 10 by 10, with the "start" parameter as offset.
+RESULTS_PER_PAGE = 10
+
+
+# Tags without content or end tag in HTML.
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class HtmlNode:
+    """
+    Element of the tree built by parse_html(), with its tag, attributes and children (nodes and text).
+    """
+
+    def __init__(self, tag, attrs, parent=None):
+        self.tag = tag
+        self.attrs = {name: value or "" for name, value in attrs}
+        self.parent = parent
+        self.children = []
+
+    @property
+    def classes(self):
+        return set(self.attrs.get("class", "").split())
+
+    @property
+    def text(self):
+        parts = [child if isinstance(child, str) else child.text for child in self.children if not isinstance(child, HtmlNode) or child.tag not in ("script", "style")]
+        return " ".join(" ".join(parts).split())
+
+    def iter(self):
+        for child in self.children:
+            if isinstance(child, HtmlNode):
+                yield child
+                yield from child.iter()
+
+    def ancestors(self):
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+
+class HtmlTreeBuilder(HTMLParser):
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = HtmlNode("#document", [])
+        self.current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        node = HtmlNode(tag, attrs, self.current)
+        self.current.children.append(node)
+
+        if tag not in VOID_TAGS:
+            self.current = node
+
+    def handle_startendtag(self, tag, attrs):
+        self.current.children.append(HtmlNode(tag, attrs, self.current))
+
+    def handle_endtag(self, tag):
+        # Closes the nearest open element with this tag, and the ones left open inside it.
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data):
+        self.current.children.append(data)
+
+
+def parse_html(html):
+    """
+    Parses an HTML page in a tree of HtmlNode, with the standard library parser.
+
+    Args:
+        html: string
+
+    Returns:
+        root: HtmlNode
+    """
+
+    builder = HtmlTreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+# Parts of a simple CSS selector: tag, #id, .class, [attribute], [attribute="value"], [attribute*="value"] and :has(...).
+SELECTOR_PART = re.compile(r'([a-zA-Z][\w-]*)|#([\w-]+)|\.([\w-]+)|\[([\w-]+)(?:([*^$]?=)"?([^"\]]*)"?)?\]|:has\(([^)]*)\)')
+
+
+@lru_cache(maxsize=64)
+def compile_selector(selector):
+    """
+    Compiles a CSS selector of the subset used by RESULT_SELECTORS (descendant combinator, tag, id, class, attributes
+    and ":has()", in comma-separated groups) into a function that tells if a node matches it.
+
+    Args:
+        selector: string
+
+    Returns:
+        match: function, receiving an HtmlNode
+    """
+
+    def compound(text):
+        checks = []
+        position = 0
+
+        for part in SELECTOR_PART.finditer(text):
+            if part.start() != position:
+                raise ValueError(f"Unsupported CSS selector: {selector}")
+            position = part.end()
+
+            tag, id_, class_, attribute, operator, value, has = part.groups()
+
+            if tag:
+                checks.append(lambda node, tag=tag.lower(): node.tag == tag)
+            elif id_:
+                checks.append(lambda node, id_=id_: node.attrs.get("id") == id_)
+            elif class_:
+                checks.append(lambda node, class_=class_: class_ in node.classes)
+            elif attribute and not operator:
+                checks.append(lambda node, attribute=attribute: attribute in node.attrs)
+            elif attribute:
+                tests = {"=": str.__eq__, "*=": str.__contains__, "^=": str.startswith, "$=": str.endswith}
+                checks.append(lambda node, attribute=attribute, test=tests[operator], value=value: attribute in node.attrs and test(node.attrs[attribute], value))
+            else:
+                inner = compile_selector(has)
+                checks.append(lambda node, inner=inner: any(inner(child) for child in node.iter()))
+
+        if position != len(text):
+            raise ValueError(f"Unsupported CSS selector: {selector}")
+
+        return lambda node: all(check(node) for check in checks)
+
+    def chain(text):
+        # "a b c": the node matches "c", and it has ancestors matching "b" and then "a".
+        parts = [compound(part) for part in re.split(r"\s+(?![^(]*\))", text.strip())]
+        last, ancestors = parts[-1], parts[:-1]
+
+        def match(node):
+            if not last(node):
+                return False
+
+            remaining = list(reversed(ancestors))
+            for ancestor in node.ancestors():
+                if remaining and remaining[0](ancestor):
+                    remaining.pop(0)
+
+            return not remaining
+
+        return match
+
+    groups = [chain(group) for group in selector.split(",") if group.strip()]
+    return lambda node: any(group(node) for group in groups)
+
+
+def select(root, selector):
+    """
+    Returns the nodes under "root" matching the CSS selector, in document order.
+    """
+
+    match = compile_selector(selector)
+    return [node for node in root.iter() if match(node)]
+
+
+def closest(node, selector):
+    """
+    Returns the node itself or its nearest ancestor matching the CSS selector, like Element.closest() in the browser.
+    """
+
+    match = compile_selector(selector)
+    return next((candidate for candidate in (node, *node.ancestors()) if match(candidate)), None)
+
+
+def parse_results(html, base_url="https://www.google.com/"):
+    """
+    Extracts the results of a results page offline, with the same selectors and rules as EXTRACT_RESULTS_JS.
+
+    Args:
+        html: string, or the root HtmlNode of a page already parsed
+        base_url: string, to resolve relative links
+
+    Returns:
+        results: list of dictionaries, with "position", "title", "url", "displayed_url" and "snippet"
+    """
+
+    root = parse_html(html) if isinstance(html, str) else html
+
+    anchors = []
+    for selector in RESULT_SELECTORS:
+        anchors = select(root, selector)
+        if anchors:
+            break
+
+    results = []
+    seen = set()
+
+    for anchor in anchors:
+        heading = next((node for node in anchor.iter() if node.tag == "h3"), None)
+        title = heading.text if heading else ""
+        url = urljoin(base_url, anchor.attrs["href"]) if anchor.attrs.get("href") else ""
+
+        if not title or not url or url in seen:
+            continue
+        seen.add(url)
+
+        block = closest(anchor, RESULT_BLOCK_SELECTOR)
+        cite = next(iter(select(block, "cite")), None) if block else None
+        snippet = next(iter(select(block, RESULT_SNIPPET_SELECTOR)), None) if block else None
+
+        results.append({
+            "position": len(results) + 1,
+            "title": title,
+            "url": url,
+            "displayed_url": cite.text if cite else "",
+            "snippet": snippet.text if snippet else "",
+        })
+
+    return results
@@ -0,0 +1,251 @@
+"""
+Structure for logs: the timezone and JSON formatters, and the file and console handlers of the root logger. They are
+attached by setup_logging(), when the script starts, and not when the package is imported.
+
+The records are not written by the threads that log them: they go through a queue to a background listener, which
+formats and writes them, so a slow disk or console never stalls the workers. The options come from "LOGGING" in
+config.json.
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+from time import monotonic
+
+from . import config
+
+
+# IDs of the query, worker and profile of the current thread, added to its log records.
+LOG_CONTEXT = contextvars.ContextVar("log_context", default={})
+
+CONTEXT_FIELDS = ("query", "worker", "profile")
+
+listener = None
+
+
+class TimezoneFormatter(logging.Formatter):
+    def __init__(self, fmt=None, datefmt=None, tz=None):
+        super().__init__(fmt, datefmt)
+
+        # pytz is only needed to write the logs, so it's not imported with the package.
+        import pytz
+
+        # Defining Timezone - Pattern UTC
+        self.tz = pytz.timezone(tz) if tz else pytz.UTC
+        self.second = None
+        self.localized = None
+
+    def formatTime(self, record, datefmt=None):
+        # Convert logs timestamp to the defined timezone. The localized datetime is kept for the whole second, since
+        # most records of a second share it, and only the microseconds change.
+        second = int(record.created)
+
+        if second != self.second:
+            self.second = second
+            self.localized = datetime.fromtimestamp(second, self.tz)
+
+        dt = self.localized.replace(microsecond=int((record.created - second) * 1_000_000))
+        return dt.strftime(datefmt) if datefmt else dt.isoformat()
+
+
+class JsonFormatter(TimezoneFormatter):
+    """
+    Formats each record as one JSON line, with the time, level, thread, source, message and the IDs of the query,
+    worker and profile when they are known.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "source": f"{record.filename}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds the IDs of LOG_CONTEXT to each record, in the thread that logs it.
+    """
+
+    def filter(self, record):
+        context = LOG_CONTEXT.get()
+
+        for field in CONTEXT_FIELDS:
+            setattr(record, field, context.get(field))
+
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops the debug records of a line of code logged more than "messages" times in "seconds" (e.g. inside a loop).
+    The next record of that line that gets through tells how many were dropped. Other levels are never dropped.
+
+    Args:
+        messages: int, records of the same line let through per window
+        seconds: float, length of the window
+    """
+
+    def __init__(self, messages=5, seconds=10):
+        super().__init__()
+        self.messages = messages
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.windows = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not self.messages:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = monotonic()
+
+        with self.lock:
+            started, count, dropped = self.windows.get(key, (now, 0, 0))
+
+            if now - started >= self.seconds:
+                started, count = now, 0
+
+            if count >= self.messages:
+                self.windows[key] = (started, count, dropped + 1)
+                return False
+
+            self.windows[key] = (started, count + 1, 0)
+
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar debug messages dropped)"
+            record.args = None
+
+        return True
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues the records for the listener. The message is formatted in the thread that logs (its arguments may change
+    later), but the traceback is kept apart, so the JSON lines have it in its own field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+def bind_log_context(**ids):
+    """
+    Adds IDs (query, worker, profile) to the next log records of the current thread. None removes an ID.
+    """
+
+    context = {**LOG_CONTEXT.get(), **ids}
+    LOG_CONTEXT.set({field: value for field, value in context.items() if value is not None})
+
+
+def setup_logging(policy=None, level=None):
+    """
+    Configures the root logger: the records go through a queue to a background listener, which writes them in the
+    log file (rotated by size) and in the console, as text or JSON lines, with the timestamps in the timezone of the
+    project. Repeated debug records are rate limited before they are queued.
+
+    Args:
+        policy: dictionary, by default config.LOGGING
+        level: int, e.g. logging.INFO, instead of "LEVEL" of the policy
+
+    Returns:
+        logger: logging.Logger
+    """
+
+    global listener
+
+    policy = config.LOGGING if policy is None else policy
+    logger = logging.getLogger()
+
+    # INFO or above by default. With DEBUG, all debugging info is shown (e.g. the payloads).
+    logger.setLevel(level if level is not None else policy.get("LEVEL", "INFO"))
+
+    if listener is not None:
+        return logger
+
+    # Configuring the logger and timestamp format
+    timezone = policy.get("TIMEZONE", "America/Sao_Paulo")
+    if policy.get("FORMAT", "text") == "json":
+        formatter = JsonFormatter(tz=timezone)
+    else:
+        formatter = TimezoneFormatter(
+            fmt="%(asctime)s\t%(levelname)s\t%(filename)s:%(lineno)d\t%(message)s",
+            datefmt="%d-%m-%Y %H:%M:%S.%f %Z",
+            tz=timezone
+        )
+
+    log_file = policy.get("PATH", os.path.join("logs", "google_scrapping.log"))
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True) # Creates 'logs' folder if it doesn't exist.
+
+    handlers = [logging.handlers.RotatingFileHandler(log_file, maxBytes=policy.get("MAX_BYTES", 10 * 1024 * 1024), backupCount=policy.get("BACKUP_COUNT", 5), encoding="utf-8")]
+
+    if policy.get("CONSOLE", True):
+        handlers.append(logging.StreamHandler(sys.stdout))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # The queue has no limit, so logging never blocks the thread that logs.
+    records = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+
+    rate_limit = policy.get("DEBUG_RATE_LIMIT", {})
+    queue_handler.addFilter(RateLimitFilter(rate_limit.get("MESSAGES", 5), rate_limit.get("SECONDS", 10)))
+
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+
+    return logger
+
+
+def stop_logging():
+    """
+    Writes the records still in the queue and stops the listener.
+    """
+
+    global listener
+
+    if listener is None:
+        return
+
+    listener.stop()
+    listener = None
+
+    for handler in logging.getLogger().handlers[:]:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logging.getLogger().removeHandler(handler)
@@ -0,0 +1,769 @@
+"""
+Output of the results (CSV, JSONL or SQLite) written by a single writer thread, the run journal used to resume a run,
+and the cache of results of recent queries.
+"""
+
+import csv
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from time import perf_counter
+from urllib.parse import urlparse
+
+from . import config
+from .timings import STAGE_TIMINGS
+from .queries import make_job, as_job
+from .urlindex import normalize_url
+
+
+def build_rows(query, results, captured=None):
+    """
+    Builds the rows to be recorded for the results of one query, with the date, time, normalized URL and domain of
+    each result. "repeat" is set by the URL index, when it's enabled.
+
+    Args:
+        query: string
+        results: list of dictionaries, as returned by find_elements()
+        captured: datetime of the search. Default: now
+
+    Returns:
+        rows: list of dictionaries
+    """
+
+    now = captured or datetime.now()
+    date = now.strftime("%Y-%m-%d")
+    time = now.strftime("%H:%M:%S")
+
+    strip_params = config.URL_INDEX.get("STRIP_PARAMS", [])
+
+    rows = []
+    for result in results:
+        normalized = normalize_url(result["url"], strip_params)
+        domain = urlparse(normalized).netloc.lower().removeprefix("www.")
+        rows.append({
+            "date": date,
+            "time": time,
+            "query": query,
+            "position": result.get("position"),
+            "page": result.get("page", 1),
+            "title": result["title"],
+            "url": result["url"],
+            "displayed_url": result.get("displayed_url", ""),
+            "snippet": result.get("snippet", ""),
+            "domain": domain,
+            "archive": result.get("archive"),
+            "normalized_url": normalized,
+            "repeat": None,
+        })
+
+    return rows
+
+
+class CsvBackend:
+    """
+    Records the rows in a CSV file, with the original layout: Date, Time, Query, Title and URL.
+    """
+
+    default_path = "google_search.csv"
+
+    def __init__(self, path):
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+
+        self.file = open(path, "a", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+
+        if write_header:
+            self.writer.writerow(["Date", "Time", "Query", "Title", "URL"])
+
+    def write(self, rows):
+        self.writer.writerows([row["date"], row["time"], row["query"], row["title"], row["url"]] for row in rows)
+
+    def flush(self, fsync=False):
+        self.file.flush()
+
+        if fsync:
+            os.fsync(self.file.fileno())
+
+    def position(self):
+        return self.file.tell()
+
+    def truncate(self, position):
+        self.file.truncate(position)
+        self.file.seek(position)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlBackend:
+    """
+    Records the rows as newline-delimited JSON, one result per line with all its fields.
+    """
+
+    default_path = "google_search.jsonl"
+
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, rows):
+        self.file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    def flush(self, fsync=False):
+        self.file.flush()
+
+        if fsync:
+            os.fsync(self.file.fileno())
+
+    def position(self):
+        return self.file.tell()
+
+    def truncate(self, position):
+        self.file.truncate(position)
+        self.file.seek(position)
+
+    def close(self):
+        self.file.close()
+
+
+class SqliteBackend:
+    """
+    Records the rows in a SQLite database, in the "results" table, with indexes on query, date and domain.
+    """
+
+    default_path = "google_search.db"
+
+    def __init__(self, path):
+        # The connection is created by the writer thread's owner, but only the writer thread uses it.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                query TEXT NOT NULL,
+                position INTEGER,
+                page INTEGER,
+                title TEXT,
+                url TEXT,
+                displayed_url TEXT,
+                snippet TEXT,
+                domain TEXT,
+                archive TEXT,
+                normalized_url TEXT,
+                repeat INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_query ON results (query);
+            CREATE INDEX IF NOT EXISTS idx_results_date ON results (date);
+            CREATE INDEX IF NOT EXISTS idx_results_domain ON results (domain);
+        """)
+
+        # Databases created by older versions don't have the newer columns.
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(results)")]
+        for column, column_type in (("page", "INTEGER"), ("archive", "TEXT"), ("normalized_url", "TEXT"), ("repeat", "INTEGER")):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE results ADD COLUMN {column} {column_type}")
+
+    def write(self, rows):
+        self.connection.executemany(
+            "INSERT INTO results (date, time, query, position, page, title, url, displayed_url, snippet, domain, archive, normalized_url, repeat) "
+            "VALUES (:date, :time, :query, :position, :page, :title, :url, :displayed_url, :snippet, :domain, :archive, :normalized_url, :repeat)",
+            rows,
+        )
+
+    def flush(self, fsync=False):
+        self.connection.commit()
+
+    def position(self):
+        return self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM results").fetchone()[0]
+
+    def truncate(self, position):
+        self.connection.execute("DELETE FROM results WHERE id > ?", (position,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+OUTPUT_BACKENDS = {
+    "csv": CsvBackend,
+    "jsonl": JsonlBackend,
+    "sqlite": SqliteBackend,
+}
+
+
+def open_new_output(output_format=None, path=None, suffix=""):
+    """
+    Opens an output that only has the rows recorded from now on, for the results recorded again from the SERP archive
+    or the work queue. The backends append to an existing file, so a previous file at the path is replaced.
+
+    Args:
+        output_format: string, "csv", "jsonl" or "sqlite". Default: OUTPUT.FORMAT in config.json
+        path: string, output file. Default: the default path of the format, with the suffix
+        suffix: string, e.g. "_reparsed"
+
+    Returns:
+        output: CsvBackend, JsonlBackend or SqliteBackend
+        path: string
+    """
+
+    output_format = output_format or config.OUTPUT.get("FORMAT", "csv")
+    backend = OUTPUT_BACKENDS[output_format]
+    name, extension = os.path.splitext(backend.default_path)
+    path = path or f"{name}{suffix}{extension}"
+
+    if os.path.exists(path):
+        logging.warning(f"{path} already exists. It's replaced by the new output.")
+
+        for leftover in (path, f"{path}-journal", f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    return backend(path), path
+
+
+class ResultWriter(threading.Thread):
+    """
+    Long-lived writer for the results. Any thread (main or workers) can call write(), which only puts the rows in the
+    writer queue. This thread is the only one recording in the output, in batches of "BATCH_SIZE" rows or every
+    "FLUSH_SECONDS", so rows from different workers never interleave. The settings come from "OUTPUT" in config.json.
+    With a run journal, each batch is recorded in the journal before and after being written, with the last page
+    written for each query, and a query is only marked as done once all its rows are in the output. With a URL index,
+    the rows of each batch are flagged as first hits or repeats of their URL before being written, inside the journaled
+    batch, so a batch removed by reconcile() is removed from the index too. An error of the index never drops the
+    rows: they are written without the flag.
+    """
+
+    def __init__(self, output_format=None, path=None, policy=config.OUTPUT, journal=None, url_index=None):
+        super().__init__(name="result-writer", daemon=True)
+
+        output_format = output_format or policy.get("FORMAT", "csv")
+        if output_format not in OUTPUT_BACKENDS:
+            raise ValueError(f"Unknown output format '{output_format}'. Choose between: {', '.join(OUTPUT_BACKENDS)}.")
+
+        backend = OUTPUT_BACKENDS[output_format]
+        self.path = path or policy.get("PATH") or backend.default_path
+        self.backend = backend(self.path)
+
+        self.batch_size = policy.get("BATCH_SIZE", 50)
+        self.flush_seconds = policy.get("FLUSH_SECONDS", 5)
+        self.fsync = policy.get("FSYNC", False)
+
+        self.url_index = url_index
+
+        self.journal = journal
+        if journal is not None:
+            self.reconcile()
+
+        self.queue = queue.Queue()
+        self.rows_written = 0
+
+    def reconcile(self):
+        """
+        Removes the rows of a batch that was being written when the previous run was interrupted.
+        Its queries were not marked as done, so they will be searched again.
+        """
+
+        batch = self.journal.open_batch
+
+        if batch is None or batch["path"] != self.path:
+            return
+
+        self.backend.truncate(batch["position"])
+
+        if self.url_index is not None and batch.get("id"):
+            removed = self.url_index.rollback(batch["id"])
+            if removed:
+                logging.warning(f"{removed} results of the removed batch were removed from the URL index.")
+
+        self.journal.commit_batch([])
+        logging.warning(f"Partially written results of {len(batch['queries'])} queries were removed from {self.path}.")
+
+    def run(self):
+        batch = []
+        last_flush = perf_counter()
+        closing = False
+
+        while not closing:
+            timeout = max(self.flush_seconds - (perf_counter() - last_flush), 0.05)
+
+            try:
+                item = self.queue.get(timeout=timeout)
+
+                if item is None: # Sentinel sent by close()
+                    closing = True
+                else:
+                    batch.append(item)
+
+            except queue.Empty:
+                pass
+
+            rows = sum(len(item[1]) for item in batch)
+
+            if batch and (closing or rows >= self.batch_size or perf_counter() - last_flush >= self.flush_seconds):
+                self.flush(batch)
+                batch = []
+                last_flush = perf_counter()
+
+            elif not batch:
+                last_flush = perf_counter()
+
+        self.backend.close()
+
+    def flush(self, batch):
+        queries = list(dict.fromkeys(query for query, _, _, _ in batch))
+        rows = [row for _, query_rows, _, _ in batch for row in query_rows]
+        done = [query for query, _, _, finished in batch if finished]
+
+        pages = {}
+        positions = {}
+        for query, query_rows, page, _ in batch:
+            if page is not None:
+                pages[query] = max(pages.get(query, 0), page)
+
+            for row in query_rows:
+                if row.get("position") is not None:
+                    positions[query] = max(positions.get(query, 0), row["position"])
+
+        try:
+            batch_id = None
+            if self.journal is not None:
+                batch_id = self.journal.begin_batch(self.path, self.backend.position(), queries)
+
+            if self.url_index is not None:
+                self.annotate(rows, batch_id)
+
+            with STAGE_TIMINGS.span("write"):
+                self.backend.write(rows)
+                self.backend.flush(self.fsync)
+            self.rows_written += len(rows)
+
+            if self.journal is not None:
+                self.journal.commit_batch(done, pages, positions)
+
+            logging.info(f"{len(rows)} rows have been saved in {self.path}.")
+
+        except Exception as e:
+            logging.error(f"Unexpected error occured during the process to record information in {self.path}: {e}")
+
+    def annotate(self, rows, batch_id):
+        try:
+            with STAGE_TIMINGS.span("url_index"):
+                self.url_index.annotate(rows, batch_id)
+
+        except Exception as e:
+            # The index transaction was rolled back, so none of the rows is flagged.
+            for row in rows:
+                row["repeat"] = None
+
+            logging.error(f"Error while updating the URL index, {len(rows)} rows are written without the repeat flag: {e}")
+
+    def write(self, query, results, page=None, finished=True, key=None):
+        """
+        Sends the results of one query, or of one of its pages, to be recorded.
+
+        Args:
+            query: string
+            results: list of dictionaries, as returned by find_elements()
+            page: int, results page of a multi-page crawl, or None
+            finished: bool, False when more pages of the query will follow
+            key: string, key of the query in the run journal. Default: the query
+        """
+
+        self.write_rows(key or query, build_rows(query, results), page, finished)
+
+    def write_rows(self, key, rows, page=None, finished=True):
+        """
+        Sends rows already built with build_rows() to be recorded, with the same arguments as write().
+        """
+
+        self.queue.put((key, rows, page, finished))
+
+    def finish(self, key):
+        """
+        Marks a query whose pages were sent with write(..., finished=False) as complete.
+
+        Args:
+            key: string, key of the query in the run journal
+        """
+
+        self.queue.put((key, [], None, True))
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+
+class SharedResultWriter:
+    """
+    Writer of a node of a shared work queue, with the same interface as ResultWriter. The pages of a query are kept
+    with its lease in the SharedScheduler until the query is finished, and then its rows are committed to the work
+    queue with the lease. Only a committed query is sent to the local writer, so the rows of a query whose lease was
+    lost (and which another node may have searched again) are recorded by no one but the holder of the lease.
+
+    Args:
+        scheduler: SharedScheduler
+        writer: ResultWriter, for the local output of the node
+    """
+
+    def __init__(self, scheduler, writer):
+        self.scheduler = scheduler
+        self.writer = writer
+        self.path = writer.path
+
+        self.committed = 0
+        self.dropped = 0
+
+    def start(self):
+        self.writer.start()
+
+    def write(self, query, results, page=None, finished=True, key=None):
+        key = key or query
+
+        with self.scheduler.lock:
+            self.scheduler.held[key]["pages"].append((build_rows(query, results), page))
+
+        if finished:
+            self.finish(key)
+
+    def finish(self, key):
+        with self.scheduler.lock:
+            entry = self.scheduler.held[key]
+
+        rows = [row for page_rows, _ in entry["pages"] for row in page_rows]
+
+        with STAGE_TIMINGS.span("commit"):
+            committed = not entry["lost"] and self.scheduler.work_queue.commit(key, entry["lease"], rows, self.scheduler.node)
+
+        if not committed:
+            self.dropped += 1
+            logging.warning(f"The lease of '{key}' was lost before its results were committed. Its {len(rows)} rows were dropped.")
+            return
+
+        self.committed += 1
+
+        for page_rows, page in entry["pages"]:
+            self.writer.write_rows(key, page_rows, page, finished=False)
+        self.writer.finish(key)
+
+    def close(self):
+        self.writer.close()
+        logging.info(f"Work queue: {self.committed} queries committed by this node, {self.dropped} dropped after losing their lease.")
+
+
+class RunJournal:
+    """
+    Append-only journal of the run, in JSON lines, so an interrupted run can be resumed without redoing the queries
+    already recorded. Each line records a query state ("pending", "in_progress", "done" or "failed") with its attempt,
+    the last results page of a query written in the output (with the absolute position of its last result), or the
+    beginning/commit of a batch written by the ResultWriter, with the output position before the batch. The state of
+    every query of the run is also kept in memory, to answer is_done(), next_page() and next_position() without
+    reading the journal.
+    The settings come from "JOURNAL" in config.json.
+    """
+
+    def __init__(self, resume=False, policy=config.JOURNAL):
+        self.path = policy.get("PATH", "run_journal.jsonl")
+        self.fsync = policy.get("FSYNC", False)
+
+        self.lock = threading.Lock()
+        self.states = {}
+        self.delivered = {}
+        self.positions = {}
+        self.open_batch = None
+
+        if resume and os.path.exists(self.path):
+            self.replay()
+
+        # A new run starts a new journal. A resumed run keeps appending to it.
+        self.file = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def replay(self):
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+
+                except json.JSONDecodeError:
+                    logging.warning("Skipping an incomplete line in the run journal.")
+                    continue
+
+                if "batch" in record:
+                    self.open_batch = record if record["batch"] == "begin" else None
+
+                elif "page" in record:
+                    entry = self.states.setdefault(record["query"], {"state": "pending", "attempts": 0})
+                    entry["pages"] = record["page"]
+
+                    if record.get("position") is not None:
+                        entry["position"] = record["position"]
+
+                else:
+                    entry = self.states.setdefault(record["query"], {"state": "pending", "attempts": 0})
+                    entry.update(state=record["state"], attempts=record.get("attempt", 0))
+
+                    if "job" in record:
+                        entry["job"] = record["job"]
+
+        logging.info(f"Run journal loaded: {self.summary()}.")
+
+    def record(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+    def set_state(self, query, state, **fields):
+        with self.lock:
+            entry = self.states.setdefault(query, {"state": "pending", "attempts": 0})
+            entry["state"] = state
+
+            if state == "in_progress":
+                entry["attempts"] += 1
+
+            attempt = entry["attempts"]
+
+        self.record({"query": query, "state": state, "attempt": attempt, **fields})
+
+    def pending(self, job):
+        """
+        Records a new query as pending. The text and options of a query with its own options are recorded too,
+        so the run can be resumed without the input.
+
+        Args:
+            job: dictionary, or string for a query without options
+        """
+
+        job = as_job(job)
+
+        if job["key"] in self.states:
+            return
+
+        if job["options"]:
+            self.states[job["key"]] = {"state": "pending", "attempts": 0, "job": {"query": job["query"], "options": job["options"]}}
+            self.set_state(job["key"], "pending", job=self.states[job["key"]]["job"])
+
+        else:
+            self.set_state(job["key"], "pending")
+
+    def is_done(self, key):
+        return self.states.get(key, {}).get("state") == "done"
+
+    def start(self, query):
+        self.set_state(query, "in_progress")
+
+    def fail(self, query, error):
+        self.set_state(query, "failed", error=str(error))
+
+    def page_delivered(self, query, page, position=None):
+        """
+        Notes that a results page of the query was sent to the writer, so a retry continues from the next page, and
+        from the absolute position of its last result.
+        """
+
+        with self.lock:
+            self.delivered[query] = max(self.delivered.get(query, 0), page)
+
+            if position is not None:
+                self.positions[query] = max(self.positions.get(query, 0), position)
+
+    def next_page(self, query):
+        """
+        Returns the first results page of the query that was not sent to the writer yet.
+
+        Returns:
+            page: int
+        """
+
+        with self.lock:
+            return max(self.delivered.get(query, 0), self.states.get(query, {}).get("pages", 0)) + 1
+
+    def next_position(self, query):
+        """
+        Returns the number of results of the query already sent to the writer, the offset of the positions of its
+        next page. Google's pages don't always have 10 results, so it's counted, not computed from the page.
+
+        Returns:
+            position: int
+        """
+
+        with self.lock:
+            return max(self.positions.get(query, 0), self.states.get(query, {}).get("position", 0))
+
+    def begin_batch(self, path, position, queries):
+        """
+        Records the beginning of a batch of the ResultWriter.
+
+        Returns:
+            batch_id: string, id of the batch, so the other records of the batch (the URL index) can be rolled back
+        """
+
+        self.open_batch = {"batch": "begin", "id": uuid.uuid4().hex, "path": path, "position": position, "queries": queries}
+        self.record(self.open_batch)
+
+        return self.open_batch["id"]
+
+    def commit_batch(self, queries, pages=None, positions=None):
+        positions = positions or {}
+
+        for query, page in (pages or {}).items():
+            record = {"query": query, "page": page}
+
+            with self.lock:
+                entry = self.states.setdefault(query, {"state": "pending", "attempts": 0})
+                entry["pages"] = page
+
+                if query in positions:
+                    entry["position"] = record["position"] = positions[query]
+
+            self.record(record)
+
+        for query in queries:
+            self.set_state(query, "done")
+
+        self.record({"batch": "commit"})
+        self.open_batch = None
+
+    def remaining(self, queries=None):
+        """
+        Returns the queries that are not done yet, keeping their order.
+
+        Args:
+            queries: iterable of strings or jobs, or None to use all queries in the journal
+
+        Returns:
+            remaining: list of jobs
+        """
+
+        if queries is None:
+            queries = [
+                make_job(entry["job"]["query"], entry["job"]["options"]) if "job" in entry else key
+                for key, entry in self.states.items()
+            ]
+
+        return [job for job in map(as_job, queries) if not self.is_done(job["key"])]
+
+    def summary(self):
+        counts = {}
+        for entry in self.states.values():
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+
+        return ", ".join(f"{count} {state}" for state, count in counts.items()) or "empty"
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class ResultCache:
+    """
+    Persistent cache of the results, in a SQLite file, so a query repeated across runs doesn't need a proxy, a profile
+    and a search again. The key is the normalized query, the proxy geo (country, region and city), the browser type,
+    the depth, the search language and the search mode (a direct search sets the country and language in the URL).
+    Entries older than "TTL_HOURS" are ignored, and the least recently used entries are evicted above "MAX_ENTRIES".
+    The settings come from "CACHE" in config.json.
+    """
+
+    def __init__(self, policy=config.CACHE):
+        self.path = policy.get("PATH", "google_search_cache.db")
+        self.ttl = policy.get("TTL_HOURS", 24) * 3600
+        self.max_entries = policy.get("MAX_ENTRIES", 10000)
+
+        # Workers share the cache, so the connection is protected by a lock.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed);
+        """)
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query, options=None):
+        options = options or {}
+        normalized = " ".join(query.lower().split())
+
+        return "|".join([
+            normalized,
+            options.get("country", config.COUNTRY) or "",
+            options.get("region", config.REGION) or "",
+            options.get("city", config.CITY) or "",
+            config.BROWSER_TYPE,
+            str(options.get("depth", config.SEARCH_DEPTH)),
+            options.get("language") or config.SEARCH_LANGUAGE or "",
+            options.get("mode") or config.SEARCH_MODE or "",
+        ])
+
+    def get(self, query, options=None):
+        """
+        Returns the cached results for the query, or None if there is no valid entry.
+        """
+
+        key = self.key(query, options)
+        now = datetime.now().timestamp()
+
+        with self.lock:
+            row = self.connection.execute("SELECT results, created FROM cache WHERE key = ?", (key,)).fetchone()
+
+            if row is None or now - row[1] >= self.ttl:
+                self.misses += 1
+                return None
+
+            self.connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, query, options, results):
+        key = self.key(query, options)
+        now = datetime.now().timestamp()
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (key, results, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(results, ensure_ascii=False), now, now),
+            )
+            self.connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+
+        logging.info(f"Result cache: {self.hits} hits, {self.misses} misses (hit rate {hit_rate:.0f}%).")
+
+
+def create_result_cache():
+    """
+    Opens the result cache if it's enabled in config.json.
+
+    Returns:
+        cache: ResultCache, or None if it's disabled
+    """
+
+    if not config.CACHE.get("ENABLED", False):
+        return None
+
+    return ResultCache()
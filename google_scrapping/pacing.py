@@ -0,0 +1,184 @@
+"""
+Pacing: every delay of the script as a named delay point, with the delays of the selected pacing profile.
+"""
+
+import contextvars
+import logging
+import random
+import threading
+from time import perf_counter, sleep
+
+from . import config
+
+
+# Delay points used by the script, with the (min, max) seconds for each pacing profile. The delay is drawn
+# uniformly between min and max, so a fixed delay has the same min and max. Points missing in a profile don't wait.
+#   - "realistic": the original timing of the script.
+#   - "fast": keeps only the pauses that emulate a human (typing and between actions), and the time to solve a captcha.
+#   - "zero": no delay at all, for tests.
+PACING_PROFILES = {
+    "realistic": {
+        # API calls and payloads
+        "signin": (2, 2),
+        "proxy_request": (2, 2),
+        "proxy_generated": (1, 1),
+        "proxy_retrieved": (1, 1),
+        "proxy_payload": (1, 1),
+        "proxy_checked": (1, 1),
+        "proxy_failed": (2, 2),
+        "profile_payload": (1, 1),
+        "profile_start": (2, 2),
+        "profile_started": (1, 1),
+        "arguments": (1, 1),
+
+        # Browsing
+        "google_home": (1, 1),
+        "google_loaded": (1, 1),
+        "search_box": (1, 1),
+        "after_click": (3, 3),
+        "after_typing": (5, 5),
+        "after_enter": (5, 5),
+        "after_extraction": (1, 1),
+        "after_results": (2, 2),
+        "between_pages": (2, 2),
+        "between_queries": (1, 1),
+        "run_finished": (1, 1),
+
+        # Typing
+        "before_typing": (1, 1),
+        "typo_correction": (0.07, 0.2),
+        "after_punctuation": (0.3, 0.6),
+        "after_space": (0.15, 0.4),
+        "keystroke": (0.05, 0.2),
+        "typing_rhythm": (0.1, 0.3),
+
+        # Captcha
+        "captcha_check": (1, 1),
+        "captcha_solve": (30, 30),
+        "captcha_refresh": (15, 15),
+        "captcha_retry": (1, 1),
+    },
+    "fast": {
+        "after_click": (0.3, 0.8),
+        "after_typing": (0.5, 1.5),
+        "after_enter": (1, 2),
+        "between_pages": (1, 2),
+
+        "before_typing": (0.2, 0.5),
+        "typo_correction": (0.07, 0.2),
+        "after_punctuation": (0.2, 0.4),
+        "after_space": (0.1, 0.25),
+        "keystroke": (0.04, 0.12),
+        "typing_rhythm": (0.05, 0.15),
+
+        "captcha_solve": (30, 30),
+        "captcha_refresh": (15, 15),
+    },
+    "zero": {},
+}
+
+# Browsing points whose delays are scaled by the adaptive controller, to slow down a geo (or the whole run) that gets
+# captchas. The typing and captcha delays keep the values of the profile.
+ADAPTIVE_POINTS = {
+    "google_home", "google_loaded", "search_box", "after_click", "after_typing", "after_enter",
+    "after_extraction", "after_results", "between_pages", "between_queries",
+}
+
+# Geo key of the query of the current thread, for the pacing scale of its geo.
+PACING_GEO = contextvars.ContextVar("pacing_geo", default=None)
+
+
+class Pacer:
+    """
+    Centralizes every delay of the script in named delay points, using the delays of the selected pacing profile.
+    It also accounts the time spent sleeping in each point, so it's possible to compare it with the time spent working.
+    The browsing delays are multiplied by "scale", and by the scale of the geo of the thread's query in "geo_scales",
+    both set by the adaptive controller. The profile and the overrides for specific points come from "PACING" in
+    config.json.
+    """
+
+    def __init__(self, profile="realistic", overrides=None):
+        self.overrides = overrides or {}
+        self.lock = threading.Lock()
+        self.slept = {}
+        self.started = perf_counter()
+        self.scale = 1.0
+        self.geo_scales = {}
+        self.use(profile)
+
+    def configure(self, policy=None):
+        """
+        Applies "PACING" of config.json: the profile, and the overrides for specific points.
+
+        Args:
+            policy: dictionary, by default config.PACING
+        """
+
+        policy = config.PACING if policy is None else policy
+        self.overrides = policy.get("OVERRIDES") or {}
+        self.use(policy.get("PROFILE", "realistic"))
+
+    def use(self, profile):
+        if profile not in PACING_PROFILES:
+            raise ValueError(f"Unknown pacing profile '{profile}'. Choose between: {', '.join(PACING_PROFILES)}.")
+
+        self.profile = profile
+        self.delays = dict(PACING_PROFILES[profile])
+        self.delays.update({point: tuple(delay) for point, delay in self.overrides.items()})
+
+    def draw(self, point, rng=random):
+        """
+        Draws a delay of the point without sleeping, for delays that are slept elsewhere (e.g. in the browser).
+
+        Args:
+            point: string
+            rng: random.Random, or the random module
+
+        Returns:
+            delay: float, seconds
+        """
+
+        low, high = self.delays.get(point, (0, 0))
+        delay = rng.uniform(low, high)
+
+        if point in ADAPTIVE_POINTS:
+            delay *= self.scale * self.geo_scales.get(PACING_GEO.get(), 1.0)
+
+        return delay
+
+    def account(self, point, delay):
+        if delay <= 0:
+            return
+
+        with self.lock:
+            self.slept[point] = self.slept.get(point, 0.0) + delay
+
+    def pause(self, point):
+        delay = self.draw(point)
+
+        if delay <= 0:
+            return
+
+        sleep(delay)
+        self.account(point, delay)
+
+    def report(self, threads=1):
+        """
+        Logs the time spent sleeping versus working, and the delay points where most time was spent.
+
+        Args:
+            threads: int, number of threads that were pacing at the same time
+        """
+
+        busy = (perf_counter() - self.started) * threads
+        slept = sum(self.slept.values())
+        share = slept / busy * 100 if busy else 0
+
+        logging.info(f"Pacing '{self.profile}': {slept:.1f}s sleeping and {max(busy - slept, 0):.1f}s working ({share:.0f}% of the time sleeping).")
+
+        for point, total in sorted(self.slept.items(), key=lambda item: item[1], reverse=True)[:5]:
+            logging.info(f"Pacing point '{point}': {total:.1f}s.")
+
+
+PACER = Pacer()
+config.on_load(PACER.configure)
@@ -0,0 +1,337 @@
+"""
+Query sources: the queries of the command line and of the input files (text, CSV or JSONL), normalized,
+deduplicated and streamed as jobs with their own options.
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+
+from . import config
+
+
+# Options that a query can carry in its own line of an input file, with the function that normalizes each one.
+QUERY_OPTIONS = {
+    "country": lambda value: str(value).strip().upper(),
+    "region": lambda value: str(value).strip().lower(),
+    "city": lambda value: str(value).strip().lower(),
+    "language": lambda value: str(value).strip().lower(),
+    "mode": lambda value: str(value).strip().lower(),
+    "depth": int,
+}
+
+
+def query_geo(options=None):
+    """
+    Returns the proxy geo of a query: its own country, region and city, or the ones of config.json.
+
+    Args:
+        options: dictionary, or None
+
+    Returns:
+        geo: dictionary, with "country", "region" and "city"
+    """
+
+    options = options or {}
+
+    return {
+        "country": options.get("country", config.COUNTRY),
+        "region": options.get("region", config.REGION),
+        "city": options.get("city", config.CITY),
+    }
+
+
+def geo_key(geo):
+    """
+    Short name of a geo, e.g. "US" or "US/california/los_angeles", used to group the queries and in the run report.
+    """
+
+    return "/".join(part for part in (geo["country"], geo["region"], geo["city"]) if part)
+
+
+def normalize_query(query):
+    """
+    Removes the extra spaces of a query.
+
+    Args:
+        query: string
+
+    Returns:
+        query: string
+    """
+
+    return " ".join(str(query).split())
+
+
+def query_key(query, options=None):
+    """
+    Identity of a query with its own options, used by the scheduler, the run journal and the deduplication.
+    A query without options keeps its text as key.
+
+    Args:
+        query: string
+        options: dictionary, or None
+
+    Returns:
+        key: string
+    """
+
+    if not options:
+        return query
+
+    return f"{query} | " + ", ".join(f"{name}={value}" for name, value in sorted(options.items()))
+
+
+def make_job(query, options=None):
+    """
+    Builds the job of a query: its normalized text, its own options and its key.
+
+    Args:
+        query: string
+        options: dictionary with the raw options of the line, or None
+
+    Returns:
+        job: dictionary, with "query", "options" and "key"
+    """
+
+    query = normalize_query(query)
+    normalized = {}
+
+    for name, value in (options or {}).items():
+        if name not in QUERY_OPTIONS or value in (None, ""):
+            continue
+
+        normalized[name] = QUERY_OPTIONS[name](value)
+
+    if normalized.get("depth", 1) < 1:
+        raise ValueError("the depth must be at least 1 page")
+
+    if normalized.get("mode", "typing") not in ("typing", "direct"):
+        raise ValueError(f"unknown search mode '{normalized['mode']}'")
+
+    return {"query": query, "options": normalized, "key": query_key(query, normalized)}
+
+
+def as_job(item):
+    """
+    Accepts a query as a string or as a job, and returns the job.
+    """
+
+    if isinstance(item, dict):
+        return item if "key" in item else make_job(item["query"], item.get("options"))
+
+    return make_job(item)
+
+
+def read_text_queries(file):
+    """
+    Reads one query per line. Blank lines and lines starting with "#" are skipped.
+    """
+
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+
+        if line and not line.startswith("#"):
+            yield number, line, {}
+
+
+def read_csv_queries(file):
+    """
+    Reads a CSV file with a header. The query comes from the "query" column (or the first one), and the other
+    columns named as the query options (country, region, city, language, mode, depth) are its options.
+    """
+
+    reader = csv.DictReader(file)
+    query_column = "query" if reader.fieldnames and "query" in reader.fieldnames else (reader.fieldnames or [None])[0]
+
+    for row in reader:
+        options = {name: value for name, value in row.items() if name != query_column}
+        yield reader.line_num, row.get(query_column) or "", options
+
+
+def read_jsonl_queries(file):
+    """
+    Reads one JSON object per line, with "query" and the optional query options, or a JSON string with the query.
+    A line that is not valid JSON, or another JSON value (a number, a list...), is yielded with None as query and the
+    error as options.
+    """
+
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+
+        except json.JSONDecodeError as e:
+            yield number, None, e
+            continue
+
+        if isinstance(record, str):
+            record = {"query": record}
+
+        if not isinstance(record, dict):
+            yield number, None, f"{json.dumps(record)[:40]} is not a JSON object"
+            continue
+
+        yield number, record.get("query") or "", {name: value for name, value in record.items() if name != "query"}
+
+
+QUERY_READERS = {
+    "text": read_text_queries,
+    "csv": read_csv_queries,
+    "jsonl": read_jsonl_queries,
+}
+
+
+def input_format(path, input_format="auto"):
+    """
+    Chooses the format of a query input by its extension, when it's "auto". Stdin ("-") is read as text.
+
+    Returns:
+        input_format: string
+    """
+
+    if input_format != "auto":
+        return input_format
+
+    extension = os.path.splitext(path)[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}.get(extension, "text")
+
+
+class KeySet:
+    """
+    Set of the keys already seen, with the interface of BloomFilter, for an exact deduplication. Its memory grows with
+    the distinct keys, like the state of each query kept by the run journal.
+    """
+
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, key):
+        """
+        Adds a key to the set.
+
+        Returns:
+            new: bool, False if the key was already there
+        """
+
+        if key in self.keys:
+            return False
+
+        self.keys.add(key)
+        return True
+
+
+class BloomFilter:
+    """
+    Fixed-size set of the keys already seen, so the deduplication of a stream of queries uses a fixed amount of
+    memory, whatever the size of the input. A new key is wrongly taken as seen with a probability of "error_rate", as
+    long as there are no more than "capacity" keys, so a key taken as seen is only a probable duplicate.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key):
+        """
+        Adds a key to the set.
+
+        Returns:
+            new: bool, False if the key was (probably) already there
+        """
+
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        new = False
+        for i in range(self.hashes):
+            position = (first + i * second) % self.size
+            byte, bit = divmod(position, 8)
+
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+
+        return new
+
+
+def iter_queries(queries=(), inputs=(), input_format_name="auto", policy=config.INPUT):
+    """
+    Streams the jobs of the run: first the queries of the command line, then the lines of each input file, read
+    lazily ("-" is stdin). Queries are normalized, and the repeated ones (same text, case-insensitive, and same
+    options) are skipped as they stream. The deduplication is exact, with a KeySet. With "DEDUPE_BLOOM", it's done
+    with a BloomFilter instead, with a fixed amount of memory, but a new query can be taken as repeated with a
+    probability of "DEDUPE_ERROR_RATE": every query it skips is logged as a probable duplicate. The settings come
+    from "INPUT" in config.json.
+
+    Args:
+        queries: iterable of strings
+        inputs: list of paths
+        input_format_name: "auto", "text", "csv" or "jsonl"
+
+    Yields:
+        job: dictionary, with "query", "options" and "key"
+    """
+
+    bloom = policy.get("DEDUPE_BLOOM", False)
+    seen = None
+
+    if policy.get("DEDUPE", True):
+        seen = BloomFilter(policy.get("DEDUPE_CAPACITY", 1000000), policy.get("DEDUPE_ERROR_RATE", 0.0001)) if bloom else KeySet()
+
+    counts = {"read": 0, "duplicates": 0, "invalid": 0}
+
+    def accept(job):
+        counts["read"] += 1
+
+        if seen is not None and not seen.add(query_key(job["query"].lower(), job["options"])):
+            counts["duplicates"] += 1
+
+            if bloom:
+                logging.info(f"The query '{job['key']}' was skipped as a probable duplicate.")
+            return False
+
+        return True
+
+    for query in queries:
+        job = as_job(query)
+
+        if job["query"] and accept(job):
+            yield job
+
+    for path in inputs:
+        reader = QUERY_READERS[input_format(path, input_format_name)]
+        file = sys.stdin if path == "-" else open(path, "r", encoding="utf-8", newline="")
+
+        try:
+            for number, query, options in reader(file):
+                try:
+                    if query is None:
+                        raise ValueError(f"it could not be read ({options})")
+
+                    job = make_job(query, options)
+
+                    if not job["query"]:
+                        raise ValueError("there is no query")
+
+                except (TypeError, ValueError) as e:
+                    counts["invalid"] += 1
+                    logging.warning(f"Line {number} of {path} was skipped: {e}.")
+                    continue
+
+                if accept(job):
+                    yield job
+
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+    logging.info(f"Query input: {counts['read']} queries read, {counts['duplicates']} {'probable ' if bloom else ''}duplicates and {counts['invalid']} invalid lines skipped.")
@@ -0,0 +1,303 @@
+"""
+Worker pool and main function: the workers pull the queries from the scheduler, search them in their profile
+sessions and send the results to the writer.
+"""
+
+import logging
+import threading
+from itertools import islice
+from time import perf_counter
+
+from .logs import bind_log_context
+from .pacing import PACER, PACING_GEO
+from .timings import STAGE_TIMINGS
+from .api import create_proxy_pool
+from .queries import query_geo, geo_key, as_job
+from .scheduler import QueryScheduler, SharedScheduler, failure_class
+from .output import ResultWriter, SharedResultWriter, RunJournal, create_result_cache
+from .archive import create_serp_archive
+from .urlindex import create_url_index
+from .adaptive import create_adaptive_controller
+from .browser import report_page_state
+from .session import report_search_latency, ProfileSession, report_profile_reuse
+
+
+def search_outcome(result, error):
+    """
+    Outcome of a search for the adaptive controller: "ok", "captcha", "timeout", "empty" or "error". A results page
+    that never loaded raises a TimeoutException in read_results_page(), so it's a "timeout", not an "empty" search.
+    """
+
+    if result is None:
+        failure = failure_class(error)
+        return failure if failure in ("captcha", "timeout") else "error"
+
+    return "ok" if result else "empty"
+
+
+def search_worker(worker_id, scheduler, writer, stats, session, options=None, journal=None, controller=None):
+    """
+    Worker loop. It pulls queries from the shared scheduler until there is nothing left, running them
+    in its own proxy, quick profile and WebDriver, and sends the results of each page to the result writer.
+    With an adaptive controller, the worker is parked while it's above the number of active workers.
+
+    Args:
+        worker_id: int
+        scheduler: QueryScheduler
+        writer: ResultWriter
+        stats: dictionary, updated with "queries" and "elapsed" for this worker
+        session: ProfileSession, owned only by this worker
+        options: dictionary, passed to run_search()
+        journal: RunJournal or None
+        controller: AdaptiveController or None
+    """
+
+    started = perf_counter()
+    bind_log_context(worker=worker_id)
+
+    try:
+        while True:
+            bind_log_context(query=None)
+
+            if controller is not None and not controller.admits(worker_id):
+                # The profile is not kept open while the worker is parked.
+                session.stop("worker parked by the adaptive controller")
+                controller.wait_turn(worker_id)
+
+            job = scheduler.next(session.geo)
+
+            if job is None:
+                if controller is not None:
+                    controller.drain()
+                break
+
+            query, key = job["query"], job["key"]
+            bind_log_context(query=key)
+            logging.info(f"Worker {worker_id} picked the query: {key}")
+
+            # The options of the query's own line take precedence over the options of the run.
+            query_options = dict(options or {}, **job["options"])
+
+            if journal is not None:
+                journal.start(key)
+                query_options["start_page"] = journal.next_page(key)
+                query_options["start_position"] = journal.next_position(key)
+
+            def deliver(page, results, query=query, key=key):
+                # Each page is recorded as soon as it's extracted.
+                writer.write(query, results, page, finished=False, key=key)
+
+                if journal is not None:
+                    journal.page_delivered(key, page, results[-1]["position"] if results else None)
+
+            geo = geo_key(query_geo(query_options))
+            PACING_GEO.set(geo)
+            searched = perf_counter()
+
+            try:
+                result = session.search(query, query_options, on_page=deliver)
+                error = None
+
+            except Exception as e:
+                logging.error(f"Worker {worker_id} failed while searching '{key}': {e}")
+                result = None
+                error = e
+
+            STAGE_TIMINGS.record_geo(geo, "queries" if result is not None else "captchas" if error is None else "errors", perf_counter() - searched)
+
+            if controller is not None:
+                controller.observe(geo, search_outcome(result, error))
+
+            if result is None:
+                if journal is not None:
+                    journal.fail(key, error or "captcha")
+
+                scheduler.retry(job, error)
+                continue
+
+            writer.finish(key)
+            scheduler.done(job)
+            stats["queries"] += 1
+            PACER.pause("between_queries")
+
+    finally:
+        session.close()
+        stats["elapsed"] = perf_counter() - started
+        logging.info(f"Worker {worker_id} has finished.")
+
+
+def report_throughput(stats, elapsed):
+    """
+    Logs the throughput (queries per minute) for each worker, and the aggregate for the whole pool.
+
+    Args:
+        stats: list of dictionaries, with "worker", "queries" and "elapsed"
+        elapsed: float, wall clock time of the pool in seconds
+    """
+
+    for item in stats:
+        per_minute = item["queries"] / item["elapsed"] * 60 if item["elapsed"] else 0
+        logging.info(f"Worker {item['worker']}: {item['queries']} queries in {item['elapsed']:.1f}s ({per_minute:.2f} queries/min).")
+
+    total = sum(item["queries"] for item in stats)
+    per_minute = total / elapsed * 60 if elapsed else 0
+    logging.info(f"Pool: {total} queries in {elapsed:.1f}s with {len(stats)} workers ({per_minute:.2f} queries/min).")
+
+
+def run_worker_pool(scheduler, workers, writer, proxy_pool=None, options=None, cache=None, journal=None, archive=None, controller=None):
+    """
+    Runs the queries of the scheduler with one or more workers. Each worker owns its proxy, quick profile and
+    WebDriver, and all of them pull from the same scheduler. With one worker, it runs in the main thread. With an
+    adaptive controller, only its number of active workers search at a time. When the run is interrupted (Ctrl-C),
+    the scheduler is stopped and the workers are joined, after their current query and the stop of their profile,
+    before the interruption goes on, so the writer and the journal are only closed once no worker uses them.
+
+    Args:
+        scheduler: QueryScheduler
+        workers: int
+        writer: ResultWriter
+        proxy_pool: ProxyPool or None
+        options: dictionary, passed to run_search()
+        cache: ResultCache or None
+        journal: RunJournal or None
+        archive: SerpArchive or None
+        controller: AdaptiveController or None
+
+    Returns:
+        queries: int, number of queries done
+    """
+
+    stats = [{"worker": n, "queries": 0, "elapsed": 0.0} for n in range(1, workers + 1)]
+    sessions = [ProfileSession(proxy_pool=proxy_pool, cache=cache, archive=archive) for _ in stats]
+
+    started = perf_counter()
+
+    if workers == 1:
+        search_worker(1, scheduler, writer, stats[0], sessions[0], options, journal, controller)
+
+    else:
+        threads = [
+            threading.Thread(target=search_worker, args=(item["worker"], scheduler, writer, item, session, options, journal, controller), name=f"worker-{item['worker']}")
+            for item, session in zip(stats, sessions)
+        ]
+
+        logging.info(f"Starting {workers} workers.")
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                thread.join()
+
+        except KeyboardInterrupt:
+            logging.warning("Interrupted. Waiting for the workers to finish their current query and stop their profiles.")
+            scheduler.stop()
+
+            if controller is not None:
+                controller.drain()
+
+            for thread in threads:
+                while thread.is_alive():
+                    try:
+                        thread.join()
+
+                    except KeyboardInterrupt:
+                        logging.warning(f"Still waiting for {sum(thread.is_alive() for thread in threads)} workers to stop.")
+
+            raise
+
+    report_throughput(stats, perf_counter() - started)
+    report_profile_reuse(sessions)
+
+    return sum(item["queries"] for item in stats)
+
+
+def main(args_list, start_index=0, workers=1, options=None, journal=None, work_queue=None):
+
+    proxy_pool = create_proxy_pool()
+    cache = create_result_cache()
+    archive = create_serp_archive()
+    controller = create_adaptive_controller(workers)
+    url_index = create_url_index()
+
+    output_format = options.get("output_format") if options else None
+
+    if work_queue is not None:
+        # On a node of a shared work queue, the queue takes the place of the query list and of the run journal: the
+        # queries are claimed from it, and their results are committed to it before going to the local output.
+        journal = None
+        scheduler = SharedScheduler(work_queue)
+        writer = SharedResultWriter(scheduler, ResultWriter(output_format, url_index=url_index))
+
+    else:
+        if journal is None:
+            journal = RunJournal()
+
+        def pending(jobs):
+            # Queries are recorded in the journal as the scheduler pulls them, and the ones already done are skipped.
+            for job in map(as_job, jobs):
+                if journal.is_done(job["key"]):
+                    continue
+
+                journal.pending(job)
+                yield job
+
+        scheduler = QueryScheduler(pending(islice(args_list, start_index, None)))
+        writer = ResultWriter(output_format, journal=journal, url_index=url_index)
+
+    writer.start()
+
+    done = 0
+
+    try:
+        done = run_worker_pool(scheduler, workers, writer, proxy_pool, options, cache, journal, archive, controller)
+
+    finally:
+        if work_queue is not None:
+            scheduler.close()
+
+        writer.close()
+
+        if journal is not None:
+            logging.info(f"Run journal: {journal.summary()}.")
+            journal.close()
+
+        if proxy_pool is not None:
+            proxy_pool.close()
+
+        if cache is not None:
+            cache.close()
+
+        if archive is not None:
+            archive.close()
+
+        if url_index is not None:
+            url_index.close()
+
+    if proxy_pool is not None:
+        proxy_pool.report()
+
+    if cache is not None:
+        cache.report()
+
+    if archive is not None:
+        archive.report()
+
+    if url_index is not None:
+        url_index.report()
+
+    if controller is not None:
+        controller.report()
+
+    scheduler.report()
+    report_search_latency()
+    report_page_state()
+    PACER.report(workers)
+    report = STAGE_TIMINGS.write_report(done)
+
+    PACER.pause("run_finished")
+    query_word = "query" if scheduler.pulled == 1 else "queries"
+    logging.info(f"The search on Google for {scheduler.pulled} {query_word} has been finished. Please, check the output file: {writer.path}.")
+
+    return report
@@ -0,0 +1,409 @@
+"""
+Retry scheduler: the queue of queries for the workers, grouped by geo, with retries and backoff per failure class.
+"""
+
+import heapq
+import logging
+import random
+import threading
+from collections import deque
+from time import perf_counter
+
+from . import config
+from .queries import query_geo, geo_key, as_job
+
+
+class ProxyError(Exception):
+    """
+    Raised when it's not possible to get a valid proxy for a profile.
+    """
+
+
+def backoff_delay(attempt, policy=config.RETRY):
+    """
+    Exponential backoff with jitter for a retry.
+
+    Args:
+        attempt: int, number of attempts already done (1 for the first retry)
+
+    Returns:
+        delay: float, seconds
+    """
+
+    base = policy.get("BACKOFF_SECONDS", 5)
+    maximum = policy.get("MAX_BACKOFF_SECONDS", 300)
+    jitter = policy.get("JITTER", 0.5)
+
+    delay = min(base * 2 ** (attempt - 1), maximum)
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+def failure_class(error):
+    """
+    Classifies a failure for the retry counts of the run summary.
+
+    Args:
+        error: Exception, or None when the search was blocked by a captcha
+
+    Returns:
+        failure: string
+    """
+
+    if error is None:
+        return "captcha"
+
+    if isinstance(error, ProxyError):
+        return "proxy"
+
+    # Selenium is only imported here, so the modules that only need ProxyError or backoff_delay() (the API client,
+    # the work queue) don't load it.
+    from selenium.common.exceptions import TimeoutException
+
+    if isinstance(error, TimeoutException):
+        return "timeout"
+
+    return "error"
+
+
+class QueryScheduler:
+    """
+    Shared queue of queries for the workers, with retries. The queries are pulled lazily from their source (a list or
+    a stream from iter_queries()), so a long input starts producing results at once. Up to "LOOKAHEAD" queries are
+    read ahead and grouped by geo, and each worker gets the queries of the geo of its profile first, so one sticky
+    proxy and profile serve a location before switching. A failed query is requeued with exponential backoff and
+    jitter, and it's picked again once its backoff is over, so one stubborn query doesn't block the others, until it
+    reaches "MAX_ATTEMPTS". The settings come from "RETRY" and "GEO" in config.json.
+    """
+
+    def __init__(self, queries, policy=config.RETRY, geo_policy=config.GEO):
+        self.max_attempts = policy.get("MAX_ATTEMPTS", 3)
+        self.policy = policy
+
+        self.grouping = geo_policy.get("GROUPING", True)
+        self.lookahead = max(geo_policy.get("LOOKAHEAD", 1000), 1) if self.grouping else 1
+
+        self.condition = threading.Condition()
+        self.heap = []
+        self.sequence = 0
+        self.in_flight = 0
+        self.attempts = {}
+
+        # Set by stop(), when the run is interrupted.
+        self.stopping = threading.Event()
+
+        # Queries read ahead, in one queue per geo key.
+        self.buckets = {}
+        self.buffered = 0
+
+        # Only one worker reads the source at a time, without holding the queue.
+        self.source = iter(queries)
+        self.source_lock = threading.Lock()
+        self.pulled = 0
+
+        # Stats for the run summary
+        self.retries = {}
+        self.failed = []
+
+    def group(self, job):
+        return geo_key(query_geo(job["options"])) if self.grouping else ""
+
+    def push(self, job, ready_at):
+        heapq.heappush(self.heap, (ready_at, self.sequence, job))
+        self.sequence += 1
+
+    def fill(self, geo=None):
+        """
+        Reads queries from the source until one of the geo is found, the lookahead is full or the source is exhausted.
+
+        Args:
+            geo: string, geo key of the worker's profile, or None to read only one query
+        """
+
+        with self.source_lock:
+            while self.source is not None:
+                item = next(self.source, None)
+
+                with self.condition:
+                    if item is None:
+                        self.source = None
+                        self.condition.notify_all()
+                        return
+
+                    job = as_job(item)
+                    group = self.group(job)
+
+                    self.buckets.setdefault(group, deque()).append(job)
+                    self.buffered += 1
+                    self.pulled += 1
+                    self.condition.notify_all()
+
+                    if geo is None or group == geo or self.buffered >= self.lookahead:
+                        return
+
+    def take(self, geo, fallback):
+        """
+        Takes a query of the geo, or of the biggest group when "fallback" is True. Retries whose backoff is over go
+        first in their group. The caller holds the condition.
+
+        Returns:
+            job: dictionary, or None
+        """
+
+        now = perf_counter()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, job = heapq.heappop(self.heap)
+            self.buckets.setdefault(self.group(job), deque()).appendleft(job)
+            self.buffered += 1
+
+        group = geo if self.grouping else ""
+
+        if not self.buckets.get(group):
+            if not fallback or not self.buckets:
+                return None
+
+            group = max(self.buckets, key=lambda name: len(self.buckets[name]))
+
+        bucket = self.buckets[group]
+        job = bucket.popleft()
+
+        if not bucket:
+            del self.buckets[group]
+
+        self.buffered -= 1
+        self.in_flight += 1
+        return job
+
+    def next(self, geo=None):
+        """
+        Returns the next query to run, preferably of the geo of the worker's profile, waiting for the backoff
+        if there is nothing else to do.
+
+        Args:
+            geo: string, geo key of the worker's profile, or None
+
+        Returns:
+            job: dictionary, with "query", "options" and "key", or None when there is nothing left to do
+        """
+
+        while True:
+            with self.condition:
+                if self.stopping.is_set():
+                    return None
+
+                can_fill = self.source is not None and self.buffered < self.lookahead
+                job = self.take(geo, fallback=not can_fill or geo is None)
+
+                if job is not None:
+                    return job
+
+                if not can_fill:
+                    if self.heap:
+                        self.condition.wait(self.heap[0][0] - perf_counter())
+
+                    elif self.in_flight:
+                        # Another worker may still requeue its query.
+                        self.condition.wait()
+
+                    elif self.source is None:
+                        return None
+
+                    continue
+
+            self.fill(geo)
+
+    def done(self, job):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def stop(self):
+        """
+        Stops giving queries to the workers, so each one stops after its current query.
+        """
+
+        self.stopping.set()
+
+        with self.condition:
+            self.condition.notify_all()
+
+    def retry(self, job, error=None):
+        """
+        Requeues a failed query, with backoff.
+
+        Args:
+            job: dictionary
+            error: Exception, or None when the search was blocked by a captcha
+
+        Returns:
+            requeued: bool, False when the query reached the maximum of attempts
+        """
+
+        failure = failure_class(error)
+
+        with self.condition:
+            self.in_flight -= 1
+            attempts = self.attempts[job["key"]] = self.attempts.get(job["key"], 0) + 1
+
+            if attempts >= self.max_attempts:
+                self.failed.append(job["key"])
+                self.condition.notify_all()
+                logging.error(f"The query '{job['key']}' failed {attempts} times ({failure}). Giving up.")
+                return False
+
+            self.retries[failure] = self.retries.get(failure, 0) + 1
+            delay = backoff_delay(attempts, self.policy)
+            self.push(job, perf_counter() + delay)
+            self.condition.notify_all()
+
+        logging.warning(f"The query '{job['key']}' failed ({failure}). Retrying in {delay:.1f}s, after the other queries.")
+        return True
+
+    def report(self):
+        retries = ", ".join(f"{failure}: {count}" for failure, count in self.retries.items()) or "none"
+        logging.info(f"Retries per failure class: {retries}. Queries given up: {len(self.failed)}.")
+
+
+class SharedScheduler:
+    """
+    Scheduler of a node of a shared work queue, with the same interface as QueryScheduler: the workers claim their
+    queries from the queue with a lease, renewed in the background every third of "LEASE_SECONDS" while the query
+    runs. A failed query is released to the queue with backoff, for any node to claim it again. When nothing can be
+    claimed, the workers poll the queue every "POLL_SECONDS" until no query is queued or leased by any node, since a
+    crashed node's queries come back when their lease expires. The results are committed by SharedResultWriter with
+    the lease of the query. The settings come from "WORK_QUEUE", "RETRY" and "GEO" in config.json.
+
+    Args:
+        work_queue: SqliteWorkQueue or RemoteWorkQueue
+        node: string, name of the node. Default: node_name()
+    """
+
+    def __init__(self, work_queue, node=None, policy=config.WORK_QUEUE, retry_policy=config.RETRY, geo_policy=config.GEO):
+        from .workqueue import node_name
+
+        self.work_queue = work_queue
+        self.node = node or node_name(policy)
+        self.lease_seconds = policy.get("LEASE_SECONDS", 120)
+        self.poll_seconds = policy.get("POLL_SECONDS", 2)
+
+        self.max_attempts = retry_policy.get("MAX_ATTEMPTS", 3)
+        self.retry_policy = retry_policy
+        self.grouping = geo_policy.get("GROUPING", True)
+
+        # Leases held by this node, with the pages of each query waiting for the commit.
+        self.lock = threading.Lock()
+        self.held = {}
+        self.pulled = 0
+        self.lost = 0
+
+        # The heartbeat keeps renewing the leases after stop(), until the workers are done with their queries.
+        self.stopping = threading.Event()
+        self.stopped = threading.Event()
+        self.heartbeat = threading.Thread(target=self.renew_leases, name="lease-heartbeat", daemon=True)
+        self.heartbeat.start()
+
+        # Stats for the run summary
+        self.retries = {}
+        self.failed = []
+
+    def renew_leases(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            with self.lock:
+                leases = {key: entry["lease"] for key, entry in self.held.items() if not entry["lost"]}
+
+            if not leases:
+                continue
+
+            try:
+                lost = self.work_queue.renew(self.node, leases, self.lease_seconds)
+
+            except Exception as e:
+                logging.error(f"It was not possible to renew the leases of the work queue: {e}")
+                continue
+
+            with self.lock:
+                for key in lost:
+                    if key in self.held:
+                        self.held[key]["lost"] = True
+                        self.lost += 1
+
+            for key in lost:
+                logging.warning(f"The lease of '{key}' expired before it was renewed. Its results won't be committed by this node.")
+
+    def next(self, geo=None):
+        """
+        Claims the next query of the work queue, preferably of the geo of the worker's profile.
+
+        Returns:
+            job: dictionary, with "query", "options", "key", "lease" and "attempts", or None when there is nothing left
+        """
+
+        while not self.stopping.is_set():
+            job = self.work_queue.claim(self.node, self.lease_seconds, geo if self.grouping else None, self.max_attempts)
+
+            if job is not None:
+                with self.lock:
+                    self.held[job["key"]] = {"lease": job["lease"], "pages": [], "lost": False}
+                    self.pulled += 1
+
+                return job
+
+            counts = self.work_queue.counts()
+            if not counts["queued"] and not counts["leased"]:
+                return None
+
+            # Queries in backoff, or leased by other nodes, that may still come back to the queue.
+            self.stopping.wait(self.poll_seconds)
+
+        return None
+
+    def done(self, job):
+        with self.lock:
+            self.held.pop(job["key"], None)
+
+    def retry(self, job, error=None):
+        """
+        Releases a failed query to the work queue, with backoff.
+
+        Returns:
+            requeued: bool, False when the query reached the maximum of attempts (or the lease was lost)
+        """
+
+        failure = failure_class(error)
+        attempts = job["attempts"] + 1
+
+        with self.lock:
+            entry = self.held.pop(job["key"], None)
+
+        delay = backoff_delay(attempts, self.retry_policy)
+        state = self.work_queue.release(job["key"], entry["lease"], failure, delay, self.max_attempts) if entry else None
+
+        if state is None:
+            logging.warning(f"The query '{job['key']}' failed ({failure}) after its lease was lost. It's left to the node that holds it.")
+            return False
+
+        if state == "failed":
+            self.failed.append(job["key"])
+            logging.error(f"The query '{job['key']}' failed {attempts} times ({failure}). Giving up.")
+            return False
+
+        with self.lock:
+            self.retries[failure] = self.retries.get(failure, 0) + 1
+
+        logging.warning(f"The query '{job['key']}' failed ({failure}). Released to the work queue, to be retried in {delay:.1f}s.")
+        return True
+
+    def stop(self):
+        """
+        Stops claiming queries, so each worker stops after its current query.
+        """
+
+        self.stopping.set()
+
+    def close(self):
+        self.stopping.set()
+        self.stopped.set()
+        self.heartbeat.join()
+
+    def report(self):
+        retries = ", ".join(f"{failure}: {count}" for failure, count in self.retries.items()) or "none"
+        logging.info(f"Retries per failure class: {retries}. Queries given up: {len(self.failed)}. Leases lost: {self.lost}.")
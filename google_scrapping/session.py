@@ -0,0 +1,482 @@
+"""
+Search of a query in a quick profile: typed or direct, with the results pages crawled up to the depth, and the
+profile session that reuses a profile across queries.
+"""
+
+import logging
+import threading
+from itertools import groupby
+from time import perf_counter
+from urllib.parse import urlencode
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.keys import Keys
+
+from . import config
+from .logs import bind_log_context
+from .pacing import PACER
+from .timings import STAGE_TIMINGS
+from .api import stop_profile, fetch_proxy
+from .extraction import RESULTS_PER_PAGE
+from .queries import query_geo, geo_key
+from .scheduler import ProxyError
+from .browser import (
+    buid_qbp_payload, start_qbp, abandon_profile, browser_to_google, find_google_search, check_recaptcha, find_elements,
+    record_page_metrics, find_next_page, detect_page_state, accept_consent, human_typing,
+)
+
+
+def start_profile(proxy_pool=None, geo=None):
+    """
+    Gets a validated proxy for the geo, from the pool if there is one, and starts a quick profile with it.
+
+    Args:
+        proxy_pool: ProxyPool or None
+        geo: dictionary, with "country", "region" and "city", or None for the values of config.json
+
+    Returns:
+        driver: selenium webdriver
+        qbp_id: string
+        proxy: dictionary, the pool entry used by the profile (None without pool)
+    """
+
+    with STAGE_TIMINGS.span("proxy"):
+        if proxy_pool is not None:
+            proxy = proxy_pool.acquire(geo)
+            proxy_payload = proxy["payload"]
+
+        else:
+            proxy = None
+            proxy_payload = fetch_proxy(geo)
+
+    if proxy_payload is None:
+        raise ProxyError("It was not possible to get a valid proxy.")
+
+    payload = buid_qbp_payload(proxy_payload)
+
+    #Starting profile
+    try:
+        with STAGE_TIMINGS.span("profile_start"):
+            driver, qbp_id = start_qbp(payload)
+
+        #Selenium automation will start from here
+        try:
+            driver.maximize_window() # It can be else maximized via Selenium or added as a cmd_param.
+
+        except Exception:
+            abandon_profile(driver, qbp_id)
+            raise
+
+    except Exception:
+        if proxy is not None:
+            proxy_pool.release(proxy, healthy=False)
+        raise
+
+    return driver, qbp_id, proxy
+
+
+def typed_search(driver, query):
+    """
+    Searches the query as a human would do: Google's homepage, click in the search box, typing and ENTER.
+
+    Args:
+        driver: selenium webdriver
+        query: string
+    """
+
+    with STAGE_TIMINGS.span("page_load"):
+        browser_to_google(driver)
+
+    record_page_metrics(driver)
+
+    with STAGE_TIMINGS.span("typing"):
+        search_box = find_google_search(driver)
+        search_box.click()
+        logging.info("Search box clicked.")
+        PACER.pause("after_click")
+
+        human_typing(search_box, query)
+        PACER.pause("after_typing")
+
+        search_box.send_keys(Keys.ENTER)
+        logging.info("Query sent")
+        PACER.pause("after_enter")
+
+
+def build_search_url(query, language=None, country=None, start=0):
+    """
+    Builds an encoded Google search URL for the query.
+
+    Args:
+        query: string
+        language: string, used as "hl" (interface language)
+        country: string, ISO 3166 alpha-2, used as "gl" (results country)
+        start: int, offset of the first result, for the following pages
+
+    Returns:
+        url: string
+    """
+
+    params = {"q": query}
+
+    if language:
+        params["hl"] = language
+
+    if country:
+        params["gl"] = country.lower()
+
+    if start:
+        params["start"] = start
+
+    return f"https://www.google.com/search?{urlencode(params)}"
+
+
+def direct_search(driver, query, options):
+    """
+    Fast path for bulk jobs: navigates straight to the search URL, without the homepage, the search box and the typing.
+
+    Args:
+        driver: selenium webdriver
+        query: string
+        options: dictionary, with optional "language" and "country"
+    """
+
+    url = build_search_url(query, options.get("language", config.SEARCH_LANGUAGE), options.get("country", config.COUNTRY))
+
+    logging.info(f"Navigating to {url}")
+
+    with STAGE_TIMINGS.span("page_load"):
+        driver.get(url)
+
+
+# Latency of run_search() per search mode, for the run summary.
+SEARCH_LATENCY = {"typing": [], "direct": []}
+
+
+search_latency_lock = threading.Lock()
+
+
+def read_results_page(driver):
+    """
+    Reads the results page loaded in the driver: it waits for the page state, accepts the consent dialog, tries to
+    resolve the captcha and extracts the results.
+
+    Args:
+        driver: selenium webdriver
+
+    Returns:
+        results: list of dictionaries, or None if the page is blocked or the reCAPTCHA was not resolved
+
+    Raises:
+        TimeoutException: if no page state showed up and there are no results, so the page is not taken as empty
+    """
+
+    state = detect_page_state(driver)
+    record_page_metrics(driver)
+
+    if state == "consent" and accept_consent(driver):
+        state = detect_page_state(driver)
+
+    if state == "captcha":
+        with STAGE_TIMINGS.span("captcha"):
+            unresolved = check_recaptcha(driver)
+
+        if unresolved:
+            logging.warning("reCAPTCHA was still detected and it was not resolved.")
+            return None
+
+        state = detect_page_state(driver)
+
+    if state in ("captcha", "blocked"):
+        logging.warning(f"Google is blocking the search (page state '{state}').")
+        return None
+    
+    logging.info("No captcha has been found. Continuing.")
+
+    if state == "empty":
+        logging.info("Google returned no results for this page.")
+        return []
+
+    # The detector already waited for the results. On timeout, it's only one last try.
+    with STAGE_TIMINGS.span("extraction"):
+        results = find_elements(driver, timeout=15 if state == "results" else 0)
+
+    if state == "timeout" and not results:
+        raise TimeoutException(f"The results page did not load in {config.PAGE_STATE_TIMEOUT}s.")
+
+    PACER.pause("after_extraction")
+    return results
+
+
+def run_search(driver, query, options=None, on_page=None, archive=None):
+    """
+    Does the Google search for one query in a running profile, and extracts the results of up to "depth" pages.
+    It always starts from Google's homepage (or the search URL in "direct" mode), so it can be used again with the same driver.
+    The following pages are opened with the "next" link, in the same profile, and the crawl stops early on the last page,
+    on a page without results or on a captcha. Each result has its "page", and its absolute "position", counted from the
+    results of the previous pages, since Google's pages don't always have 10 results.
+
+    Args:
+        driver: selenium webdriver
+        query: string
+        options: dictionary, with optional "mode" ("typing" or "direct"), "language", "country", "depth" (pages) and
+            "start_page" and "start_position" (to continue a query whose first pages, with that many results, are
+            already recorded)
+        on_page: function called with (page, results) as soon as each page is extracted, or None
+        archive: SerpArchive, to save the page_source of each results page, or None
+
+    Returns:
+        results: list of dictionaries, or None if the first page was blocked or the reCAPTCHA was not resolved
+
+    Raises:
+        TimeoutException: if a results page never loaded. The pages before it were already sent to on_page, so the
+            retry of the query continues from that page
+    """
+
+    options = options or {}
+    mode = options.get("mode", config.SEARCH_MODE)
+    depth = options.get("depth", config.SEARCH_DEPTH)
+    page = options.get("start_page", 1)
+    offset = options.get("start_position", 0)
+    started = perf_counter()
+
+    if page > 1:
+        url = build_search_url(query, options.get("language", config.SEARCH_LANGUAGE), options.get("country", config.COUNTRY), (page - 1) * RESULTS_PER_PAGE)
+        logging.info(f"Continuing the query from page {page}: {url}")
+
+        with STAGE_TIMINGS.span("page_load"):
+            driver.get(url)
+
+    elif mode == "direct":
+        direct_search(driver, query, options)
+
+    else:
+        typed_search(driver, query)
+
+    results = []
+
+    while True:
+        page_results = read_results_page(driver)
+
+        if page_results is None:
+            PACER.pause("captcha_retry")
+
+            if not results:
+                logging.warning("The search was blocked, we need to restart the script. Retrying...")
+                return None
+
+            logging.warning(f"The search was blocked on page {page}. Stopping the crawl with {len(results)} results.")
+            break
+
+        digest = None
+        if archive is not None:
+            with STAGE_TIMINGS.span("archive"):
+                digest = archive.store(driver.page_source, query, page, geo_key(query_geo(options)), driver.current_url, offset)
+
+        for result in page_results:
+            result["position"] += offset
+            result["page"] = page
+            result["archive"] = digest
+
+        offset += len(page_results)
+
+        results.extend(page_results)
+        logging.info(f"Page {page}: {len(page_results)} results.")
+
+        if on_page is not None:
+            on_page(page, page_results)
+
+        if not page_results or page >= depth:
+            break
+
+        next_url = find_next_page(driver)
+        if next_url is None:
+            logging.info(f"Page {page} is the last results page.")
+            break
+
+        PACER.pause("between_pages")
+        page += 1
+
+        with STAGE_TIMINGS.span("page_load"):
+            driver.get(next_url)
+
+    with search_latency_lock:
+        SEARCH_LATENCY.setdefault(mode, []).append(perf_counter() - started)
+
+    logging.info(f"Number of results: {len(results)}")
+
+    PACER.pause("after_results")
+    return results
+
+
+def report_search_latency():
+    """
+    Logs the mean and max latency of the searches done in each mode.
+    """
+
+    for mode, latencies in SEARCH_LATENCY.items():
+        if latencies:
+            mean = sum(latencies) / len(latencies)
+            logging.info(f"Search mode '{mode}': {len(latencies)} searches, mean latency {mean:.1f}s, max {max(latencies):.1f}s.")
+
+
+class ProfileSession:
+    """
+    Keeps one quick profile and its driver alive across several queries. The profile is rotated (stopped, and a new
+    one started on the next query) on captcha, on errors, or when the budget of queries or minutes is exhausted.
+    The rotation policy comes from "PROFILE_REUSE" in config.json. When reuse is disabled, the budget is one query,
+    so every query gets its own profile as before. The profile is also rotated when a query has another geo, since
+    its proxy is bound to one location.
+    """
+
+    def __init__(self, policy=config.PROFILE_REUSE, proxy_pool=None, cache=None, archive=None):
+        enabled = policy.get("ENABLED", False)
+
+        self.max_queries = policy.get("MAX_QUERIES", 10) if enabled else 1
+        self.max_minutes = policy.get("MAX_MINUTES", 15) if enabled else None
+        self.rotate_on_captcha = policy.get("ROTATE_ON_CAPTCHA", True)
+        self.rotate_on_error = policy.get("ROTATE_ON_ERROR", True)
+
+        self.proxy_pool = proxy_pool
+        self.proxy = None
+        self.cache = cache
+        self.archive = archive
+
+        self.driver = None
+        self.qbp_id = None
+        self.geo = None
+        self.started_at = 0.0
+        self.profile_queries = 0
+
+        # Stats for the run summary
+        self.startups = 0
+        self.startup_time = 0.0
+        self.queries = 0
+
+    def start(self, geo=None):
+        started = perf_counter()
+        geo = geo or query_geo()
+
+        self.driver, self.qbp_id, self.proxy = start_profile(self.proxy_pool, geo)
+        self.geo = geo_key(geo)
+        bind_log_context(profile=self.qbp_id)
+        STAGE_TIMINGS.record_geo(self.geo, "profiles")
+
+        self.started_at = perf_counter()
+        self.startup_time += self.started_at - started
+        self.startups += 1
+        self.profile_queries = 0
+
+    def stop(self, reason=None, healthy=True):
+        if self.qbp_id is None:
+            return
+
+        if reason:
+            logging.info(f"Rotating profile {self.qbp_id}: {reason}.")
+
+        try:
+            with STAGE_TIMINGS.span("profile_stop"):
+                stop_profile(self.qbp_id)
+
+        except Exception as e:
+            logging.error(f"Error while stopping profile {self.qbp_id}: {e}")
+
+        if self.proxy is not None:
+            self.proxy_pool.release(self.proxy, healthy)
+
+        self.driver = None
+        self.qbp_id = None
+        self.proxy = None
+        bind_log_context(profile=None)
+
+    def budget_exhausted(self):
+        if self.profile_queries >= self.max_queries:
+            return True
+
+        if self.max_minutes is not None and perf_counter() - self.started_at >= self.max_minutes * 60:
+            return True
+
+        return False
+
+    def search(self, query, options=None, on_page=None):
+        """
+        Runs one query in the current profile, starting a new profile if there is none.
+        If the query is in the result cache, the cached results are returned without starting a profile.
+
+        Args:
+            query: string
+            options: dictionary, passed to run_search()
+            on_page: function called with (page, results) for each results page, passed to run_search()
+
+        Returns:
+            results: list of dictionaries, or None if the reCAPTCHA was not resolved
+        """
+
+        # Only a crawl from the first page has all the results of the query.
+        from_first_page = (options or {}).get("start_page", 1) == 1
+
+        if self.cache is not None and from_first_page:
+            cached = self.cache.get(query, options)
+
+            if cached is not None:
+                logging.info(f"Results for '{query}' found in the cache.")
+
+                if on_page is not None:
+                    for page, page_results in groupby(cached, key=lambda result: result.get("page", 1)):
+                        on_page(page, list(page_results))
+
+                return cached
+
+        geo = query_geo(options)
+
+        if self.driver is not None and self.geo != geo_key(geo):
+            self.stop(f"switching from {self.geo} to {geo_key(geo)}")
+
+        if self.driver is None:
+            self.start(geo)
+
+        try:
+            result = run_search(self.driver, query, options, on_page, self.archive)
+
+        except Exception:
+            if self.rotate_on_error:
+                self.stop("error during the search", healthy=False)
+            raise
+
+        self.profile_queries += 1
+        self.queries += 1
+
+        if result and self.cache is not None and from_first_page:
+            self.cache.put(query, options, result)
+
+        if result is None and self.rotate_on_captcha:
+            self.stop("captcha", healthy=False)
+
+        elif self.budget_exhausted():
+            self.stop("budget exhausted" if self.max_queries > 1 else None)
+
+        return result
+
+    def close(self):
+        self.stop()
+
+
+def report_profile_reuse(sessions):
+    """
+    Logs how many profiles were started for the queries done, and the time saved by not starting one profile per query.
+
+    Args:
+        sessions: list of ProfileSession
+    """
+
+    startups = sum(session.startups for session in sessions)
+    queries = sum(session.queries for session in sessions)
+    startup_time = sum(session.startup_time for session in sessions)
+
+    if not startups:
+        return
+
+    average = startup_time / startups
+    saved = max(queries - startups, 0) * average
+
+    logging.info(f"Profiles started: {startups} for {queries} queries. Average startup: {average:.1f}s. Time saved on profile startups: {saved:.1f}s.")
@@ -0,0 +1,285 @@
+"""
+Stage timings: the duration of each stage of a query, and the run performance report.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+
+from . import config
+
+
+def label_value(value):
+    """
+    Escapes a Prometheus label value (backslash, double quote and new line), as the text format requires.
+
+    Args:
+        value: any, e.g. a geo or a stage name
+
+    Returns:
+        value: string
+    """
+
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of values.
+
+    Args:
+        values: list of floats
+        fraction: float, between 0 and 1 (e.g. 0.95 for p95)
+
+    Returns:
+        value: float
+    """
+
+    ordered = sorted(values)
+    index = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+class StageTimings:
+    """
+    Collects the duration of each stage of a query (proxy, profile start, page load, typing, page state, captcha,
+    extraction, write...) from all workers, and writes the run performance report at the end: p50/p95/max per stage
+    and queries per minute, in JSON, and optionally in Prometheus text format for a node exporter textfile collector.
+    The paths come from "REPORT" in config.json.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Starts the measures again, e.g. for each scenario of a benchmark in the same process.
+        with self.lock:
+            self.durations = {}
+            self.transferred = []
+            self.geos = {}
+            self.typing = {"queries": 0, "keystrokes": 0, "round_trips": 0, "planned": 0.0, "actual": 0.0}
+            self.started = perf_counter()
+
+    @contextmanager
+    def span(self, stage):
+        started = perf_counter()
+
+        try:
+            yield
+
+        finally:
+            duration = perf_counter() - started
+
+            with self.lock:
+                self.durations.setdefault(stage, []).append(duration)
+
+    def record_page(self, transferred, ready=None):
+        """
+        Records the bytes transferred to load one page and, if known, its page-ready latency (as the "page_ready" stage).
+
+        Args:
+            transferred: int, bytes
+            ready: float, seconds, or None
+        """
+
+        with self.lock:
+            self.transferred.append(transferred)
+
+            if ready is not None:
+                self.durations.setdefault("page_ready", []).append(ready)
+
+    def record_geo(self, geo, outcome, duration=0.0):
+        """
+        Counts an outcome of a geo: "queries" (done), "captchas", "errors" or "profiles" (started), with the time spent.
+
+        Args:
+            geo: string, geo key
+            outcome: string
+            duration: float, seconds
+        """
+
+        with self.lock:
+            stats = self.geos.setdefault(geo, {"queries": 0, "captchas": 0, "errors": 0, "profiles": 0, "seconds": 0.0})
+            stats[outcome] += 1
+            stats["seconds"] += duration
+
+    def record_typing(self, keystrokes, round_trips, planned, actual):
+        """
+        Records the typing of one query: the keystrokes of its plan, the driver round trips used to send them, and
+        the planned versus actual duration.
+
+        Args:
+            keystrokes: int
+            round_trips: int
+            planned: float, seconds
+            actual: float, seconds
+        """
+
+        with self.lock:
+            self.typing["queries"] += 1
+            self.typing["keystrokes"] += keystrokes
+            self.typing["round_trips"] += round_trips
+            self.typing["planned"] += planned
+            self.typing["actual"] += actual
+
+    def summary(self, queries):
+        elapsed = perf_counter() - self.started
+
+        with self.lock:
+            stages = {
+                stage: {
+                    "count": len(durations),
+                    "total": sum(durations),
+                    "p50": percentile(durations, 0.5),
+                    "p95": percentile(durations, 0.95),
+                    "max": max(durations),
+                }
+                for stage, durations in self.durations.items()
+            }
+
+            transferred = sum(self.transferred)
+            pages = len(self.transferred)
+
+            geos = {}
+            for geo, stats in self.geos.items():
+                attempts = stats["queries"] + stats["captchas"] + stats["errors"]
+                geos[geo] = dict(
+                    stats,
+                    queries_per_minute=stats["queries"] / stats["seconds"] * 60 if stats["seconds"] else 0,
+                    captcha_rate=stats["captchas"] / attempts if attempts else 0,
+                )
+
+            typing = dict(self.typing)
+
+        return {
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "elapsed_seconds": elapsed,
+            "queries": queries,
+            "queries_per_minute": queries / elapsed * 60 if elapsed else 0,
+            "stages": stages,
+            "geos": geos,
+            "transfer": {
+                "profile_mode": config.PROFILE_MODE,
+                "pages": pages,
+                "bytes": transferred,
+                "bytes_per_page": transferred / pages if pages else 0,
+                "bytes_per_query": transferred / queries if queries else 0,
+            },
+            "typing": {
+                "queries": typing["queries"],
+                "keystrokes": typing["keystrokes"],
+                "round_trips": typing["round_trips"],
+                "planned_seconds": typing["planned"],
+                "actual_seconds": typing["actual"],
+                "overhead_seconds": typing["actual"] - typing["planned"],
+            },
+        }
+
+    def write_report(self, queries, policy=config.REPORT):
+        """
+        Logs the stage timings, and writes the JSON report (and the Prometheus file, if configured).
+
+        Args:
+            queries: int, number of queries done in the run
+
+        Returns:
+            report: dictionary
+        """
+
+        report = self.summary(queries)
+
+        for stage, stats in report["stages"].items():
+            logging.info(f"Stage '{stage}': {stats['count']} times, p50 {stats['p50']:.2f}s, p95 {stats['p95']:.2f}s, max {stats['max']:.2f}s.")
+
+        for geo, stats in report["geos"].items():
+            logging.info(f"Geo '{geo}': {stats['queries']} queries ({stats['queries_per_minute']:.2f} queries/min of search time), "
+                         f"captcha rate {stats['captcha_rate'] * 100:.0f}%, {stats['errors']} errors, {stats['profiles']} profiles started.")
+
+        transfer = report["transfer"]
+        if transfer["pages"]:
+            logging.info(f"Transfer ({transfer['profile_mode']} profiles): {transfer['bytes'] / 1024:.0f} KB for {transfer['pages']} pages, "
+                         f"{transfer['bytes_per_query'] / 1024:.0f} KB per query, {transfer['bytes_per_page'] / 1024:.0f} KB per page.")
+
+        typing = report["typing"]
+        if typing["queries"]:
+            logging.info(f"Typing: {typing['keystrokes']} keystrokes in {typing['round_trips']} round trips for {typing['queries']} queries, "
+                         f"planned {typing['planned_seconds']:.1f}s, actual {typing['actual_seconds']:.1f}s (overhead {typing['overhead_seconds']:.1f}s).")
+
+        logging.info(f"Run: {queries} queries in {report['elapsed_seconds']:.1f}s ({report['queries_per_minute']:.2f} queries/min).")
+
+        path = policy.get("PATH", os.path.join("logs", "run_report.json"))
+        if path:
+            try:
+                with open(path, "w", encoding="utf-8") as file:
+                    json.dump(report, file, indent=4)
+                logging.info(f"The run report has been saved in {path}.")
+
+            except OSError as e:
+                logging.error(f"It was not possible to save the run report in {path}: {e}")
+
+        prometheus_path = policy.get("PROMETHEUS_PATH", "")
+        if prometheus_path:
+            self.write_prometheus(report, prometheus_path)
+
+        return report
+
+    @staticmethod
+    def write_prometheus(report, path):
+        lines = [
+            "# HELP google_scrapping_stage_seconds Duration of each stage of a query.",
+            "# TYPE google_scrapping_stage_seconds summary",
+        ]
+
+        for stage, stats in report["stages"].items():
+            lines.append(f'google_scrapping_stage_seconds{{stage="{label_value(stage)}",quantile="0.5"}} {stats["p50"]:.6f}')
+            lines.append(f'google_scrapping_stage_seconds{{stage="{label_value(stage)}",quantile="0.95"}} {stats["p95"]:.6f}')
+            lines.append(f'google_scrapping_stage_seconds{{stage="{label_value(stage)}",quantile="1"}} {stats["max"]:.6f}')
+            lines.append(f'google_scrapping_stage_seconds_sum{{stage="{label_value(stage)}"}} {stats["total"]:.6f}')
+            lines.append(f'google_scrapping_stage_seconds_count{{stage="{label_value(stage)}"}} {stats["count"]}')
+
+        lines += [
+            "# HELP google_scrapping_queries Queries done in the last run.",
+            "# TYPE google_scrapping_queries gauge",
+            f"google_scrapping_queries {report['queries']}",
+            "# HELP google_scrapping_queries_per_minute Throughput of the last run.",
+            "# TYPE google_scrapping_queries_per_minute gauge",
+            f"google_scrapping_queries_per_minute {report['queries_per_minute']:.6f}",
+            "# HELP google_scrapping_transferred_bytes Bytes transferred by the browser in the last run.",
+            "# TYPE google_scrapping_transferred_bytes gauge",
+            f'google_scrapping_transferred_bytes{{profile_mode="{label_value(report["transfer"]["profile_mode"])}"}} {report["transfer"]["bytes"]}',
+            "# HELP google_scrapping_transferred_bytes_per_query Bytes transferred per query in the last run.",
+            "# TYPE google_scrapping_transferred_bytes_per_query gauge",
+            f'google_scrapping_transferred_bytes_per_query{{profile_mode="{label_value(report["transfer"]["profile_mode"])}"}} {report["transfer"]["bytes_per_query"]:.1f}',
+            "# HELP google_scrapping_geo_queries Queries done per geo in the last run.",
+            "# TYPE google_scrapping_geo_queries gauge",
+            *(f'google_scrapping_geo_queries{{geo="{label_value(geo)}"}} {stats["queries"]}' for geo, stats in report["geos"].items()),
+            "# HELP google_scrapping_geo_captcha_rate Share of the attempts blocked by a captcha per geo in the last run.",
+            "# TYPE google_scrapping_geo_captcha_rate gauge",
+            *(f'google_scrapping_geo_captcha_rate{{geo="{label_value(geo)}"}} {stats["captcha_rate"]:.6f}' for geo, stats in report["geos"].items()),
+            "# HELP google_scrapping_typing_seconds Planned and actual typing time in the last run.",
+            "# TYPE google_scrapping_typing_seconds gauge",
+            f'google_scrapping_typing_seconds{{kind="planned"}} {report["typing"]["planned_seconds"]:.6f}',
+            f'google_scrapping_typing_seconds{{kind="actual"}} {report["typing"]["actual_seconds"]:.6f}',
+            "# HELP google_scrapping_typing_round_trips Driver round trips used to type the queries in the last run.",
+            "# TYPE google_scrapping_typing_round_trips gauge",
+            f'google_scrapping_typing_round_trips {report["typing"]["round_trips"]}',
+        ]
+
+        # Written to a temporary file and renamed, so the collector never reads a half-written file.
+        try:
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                file.write("\n".join(lines) + "\n")
+            os.replace(f"{path}.tmp", path)
+            logging.info(f"The Prometheus metrics have been saved in {path}.")
+
+        except OSError as e:
+            logging.error(f"It was not possible to save the Prometheus metrics in {path}: {e}")
+
+
+STAGE_TIMINGS = StageTimings()
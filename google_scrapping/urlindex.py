@@ -0,0 +1,299 @@
+"""
+URL normalization and the URL index: an on-disk index of the fingerprint of every result URL recorded, so each result
+is flagged as the first hit of its URL or as a repeat, with per-domain counts and average positions kept as the
+results are written. The settings come from "URL_INDEX" in config.json.
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from . import config
+
+
+# Query parameters that only track the click, removed from the normalized URLs. The prefixes cover the families
+# (utm_source, utm_medium...).
+TRACKING_PARAMS = {
+    "gclid", "gclsrc", "dclid", "gbraid", "wbraid", "fbclid", "msclkid", "yclid", "igshid", "twclid", "ttclid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "_hsenc", "_hsmi", "ref_src", "srsltid",
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_", "hsa_")
+
+GOOGLE_HOST = re.compile(r"^(www\.)?google(\.[a-z]{2,3}){1,2}$")
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def unwrap_redirect(parts):
+    """
+    Returns the target of a Google redirect link (google.com/url?q=...), or the same URL.
+
+    Args:
+        parts: urllib.parse.SplitResult
+
+    Returns:
+        parts: urllib.parse.SplitResult
+    """
+
+    host = parts.hostname or ""
+
+    if parts.path != "/url" or (host and not GOOGLE_HOST.match(host)):
+        return parts
+
+    params = dict(parse_qsl(parts.query))
+    target = params.get("q") or params.get("url")
+
+    if target and target.startswith(("http://", "https://")):
+        return urlsplit(target)
+
+    return parts
+
+
+def normalize_url(url, strip_params=()):
+    """
+    Normalizes a result URL, so the same page has the same URL in every result: Google redirect links are unwrapped,
+    the scheme and host are lowercased (without "www." and the default port), the tracking parameters and the fragment
+    are removed, the other parameters are sorted, and a trailing slash is removed.
+
+    Args:
+        url: string
+        strip_params: iterable of strings, other parameters to remove
+
+    Returns:
+        url: string
+    """
+
+    if not url:
+        return url
+
+    parts = unwrap_redirect(urlsplit(url.strip()))
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").removeprefix("www.")
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+
+    strip = set(strip_params)
+    params = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in TRACKING_PARAMS and name not in strip and not name.lower().startswith(TRACKING_PREFIXES)
+    )
+
+    path = parts.path.rstrip("/") or "/"
+
+    return urlunsplit((scheme, host, path, urlencode(params), ""))
+
+
+def url_fingerprint(url):
+    """
+    Fingerprint of a normalized URL in the index: 16 bytes of its BLAKE2b hash, so every key has the same size.
+    """
+
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+
+
+class UrlIndex:
+    """
+    On-disk index of the result URLs, in a SQLite file. The ResultWriter annotates each batch before writing it: the
+    normalized URL of each row is looked up by its fingerprint (one B-tree lookup, whatever the size of the index), and
+    the row gets "repeat" False the first time the URL is seen and True afterwards. The hits, distinct URLs and sum of
+    positions of each domain are updated in the same transaction, so the domain aggregates can be read at any time
+    without reading the results again. The entries of the last batch are kept with the id of its journaled batch, so
+    they can be rolled back when the batch is removed from the output after a crash.
+    """
+
+    def __init__(self, policy=config.URL_INDEX):
+        self.path = policy.get("PATH", "url_index.db")
+
+        # The writer thread annotates the rows, and the report reads them, so the connection is protected by a lock.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                fingerprint BLOB PRIMARY KEY,
+                url TEXT NOT NULL,
+                domain TEXT NOT NULL,
+                query TEXT,
+                first_seen TEXT NOT NULL,
+                hits INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS domains (
+                domain TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL,
+                urls INTEGER NOT NULL,
+                position_sum INTEGER NOT NULL,
+                positions INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS last_batch (
+                batch TEXT NOT NULL,
+                fingerprint BLOB NOT NULL,
+                domain TEXT NOT NULL,
+                position INTEGER
+            );
+        """)
+
+        # Stats for the run summary
+        self.new = 0
+        self.repeats = 0
+
+    def annotate(self, rows, batch=None):
+        """
+        Flags each row as the first hit of its URL ("repeat": False) or as a repeat, and updates the domain aggregates.
+
+        Args:
+            rows: list of dictionaries, as built by build_rows()
+            batch: string, id of the batch in the run journal, or None without a journal
+        """
+
+        now = datetime.now().isoformat(timespec="seconds")
+
+        with self.lock, self.connection:
+            if batch is not None:
+                self.connection.execute("DELETE FROM last_batch")
+
+            for row in rows:
+                url = row.get("normalized_url") or row["url"]
+                fingerprint = url_fingerprint(url)
+
+                hits = self.connection.execute(
+                    "INSERT INTO urls (fingerprint, url, domain, query, first_seen, hits) VALUES (?, ?, ?, ?, ?, 1) "
+                    "ON CONFLICT (fingerprint) DO UPDATE SET hits = hits + 1 RETURNING hits",
+                    (fingerprint, url, row["domain"], row["query"], now),
+                ).fetchone()[0]
+
+                row["repeat"] = hits > 1
+                position = row.get("position")
+
+                self.connection.execute(
+                    "INSERT INTO domains (domain, hits, urls, position_sum, positions) VALUES (?, 1, ?, ?, ?) "
+                    "ON CONFLICT (domain) DO UPDATE SET hits = hits + 1, urls = urls + excluded.urls, "
+                    "position_sum = position_sum + excluded.position_sum, positions = positions + excluded.positions",
+                    (row["domain"], int(hits == 1), position or 0, int(position is not None)),
+                )
+
+                if batch is not None:
+                    self.connection.execute(
+                        "INSERT INTO last_batch (batch, fingerprint, domain, position) VALUES (?, ?, ?, ?)",
+                        (batch, fingerprint, row["domain"], position),
+                    )
+
+                if hits > 1:
+                    self.repeats += 1
+                else:
+                    self.new += 1
+
+    def rollback(self, batch):
+        """
+        Removes the hits of a batch from the index, if it was the last batch annotated.
+
+        Args:
+            batch: string, id of the batch in the run journal
+
+        Returns:
+            removed: int, number of hits removed
+        """
+
+        with self.lock, self.connection:
+            entries = self.connection.execute("SELECT fingerprint, domain, position FROM last_batch WHERE batch = ?", (batch,)).fetchall()
+
+            for fingerprint, domain, position in entries:
+                hits = self.connection.execute("UPDATE urls SET hits = hits - 1 WHERE fingerprint = ? RETURNING hits", (fingerprint,)).fetchone()[0]
+
+                if hits == 0:
+                    self.connection.execute("DELETE FROM urls WHERE fingerprint = ?", (fingerprint,))
+
+                self.connection.execute(
+                    "UPDATE domains SET hits = hits - 1, urls = urls - ?, position_sum = position_sum - ?, positions = positions - ? WHERE domain = ?",
+                    (int(hits == 0), position or 0, int(position is not None), domain),
+                )
+
+            self.connection.execute("DELETE FROM domains WHERE hits = 0")
+            self.connection.execute("DELETE FROM last_batch")
+
+        return len(entries)
+
+    def lookup(self, url):
+        """
+        Returns the entry of a URL in the index.
+
+        Returns:
+            entry: dictionary, with "url", "domain", "query" (of its first hit), "first_seen" and "hits", or None
+        """
+
+        url = normalize_url(url, config.URL_INDEX.get("STRIP_PARAMS", []))
+
+        with self.lock:
+            row = self.connection.execute("SELECT url, domain, query, first_seen, hits FROM urls WHERE fingerprint = ?", (url_fingerprint(url),)).fetchone()
+
+        return dict(zip(("url", "domain", "query", "first_seen", "hits"), row)) if row else None
+
+    def domain_stats(self, limit=20, domain=None):
+        """
+        Returns the aggregates of the domains with the most hits, or of one domain.
+
+        Args:
+            limit: int
+            domain: string, or None for the top domains
+
+        Returns:
+            stats: list of dictionaries, with "domain", "hits", "urls" (distinct) and "average_position"
+        """
+
+        with self.lock:
+            if domain is not None:
+                rows = self.connection.execute("SELECT domain, hits, urls, position_sum, positions FROM domains WHERE domain = ?", (domain,)).fetchall()
+            else:
+                rows = self.connection.execute("SELECT domain, hits, urls, position_sum, positions FROM domains ORDER BY hits DESC LIMIT ?", (limit,)).fetchall()
+
+        return [
+            {"domain": name, "hits": hits, "urls": urls, "average_position": position_sum / positions if positions else None}
+            for name, hits, urls, position_sum, positions in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def report(self):
+        total = self.new + self.repeats
+        share = self.repeats / total * 100 if total else 0
+
+        logging.info(f"URL index: {total} results, {self.new} new URLs and {self.repeats} repeats ({share:.0f}%).")
+
+
+def create_url_index():
+    """
+    Opens the URL index if it's enabled in config.json.
+
+    Returns:
+        index: UrlIndex, or None if it's disabled
+    """
+
+    if not config.URL_INDEX.get("ENABLED", False):
+        return None
+
+    return UrlIndex()
+
+
+def report_domains(stats):
+    """
+    Shows the aggregates of the domains in the URL index.
+
+    Args:
+        stats: list of dictionaries, as returned by domain_stats()
+    """
+
+    print(f"{'Domain':<40} {'Hits':>9} {'URLs':>9} {'Avg position':>13}")
+
+    for item in stats:
+        position = f"{item['average_position']:.1f}" if item["average_position"] is not None else "-"
+        print(f"{item['domain']:<40} {item['hits']:>9} {item['urls']:>9} {position:>13}")
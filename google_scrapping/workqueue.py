@@ -0,0 +1,741 @@
+"""
+Shared work queue, so several hosts (nodes) run the queries of one backlog. The queue is a SQLite file on a shared
+path, or a small TCP service in front of that file (serve_work_queue()), when the file can't be shared by the nodes.
+
+A node claims a query with a lease: the query is its own until the lease expires, and the lease is renewed while the
+query runs. The query of a crashed node is requeued when its lease expires. The results of a query are committed with
+the query, in one transaction, and only by the holder of its current lease, so each query has its results recorded
+exactly once, even when a node that lost its lease finishes the search later. The settings come from "WORK_QUEUE" in
+config.json.
+"""
+
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import time
+
+from . import config
+from .queries import query_geo, geo_key, as_job
+from .output import open_new_output
+
+
+QUEUE_STATES = ["queued", "leased", "done", "failed"]
+
+# Queries of results read at a time by export(), and sent in each answer of the TCP service.
+EXPORT_PAGE_SIZE = 100
+
+
+def node_name(policy=config.WORK_QUEUE):
+    """
+    Name of this node in the work queue: "NODE" in config.json, or the host name and the process ID.
+    """
+
+    return policy.get("NODE") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SqliteWorkQueue:
+    """
+    Work queue in a SQLite file. Every change is done in a transaction that takes the write lock of the file at once
+    (BEGIN IMMEDIATE), so two nodes never claim the same query. The times are the clocks of the nodes, which must be
+    roughly in sync; behind the TCP service, only the clock of the service is used.
+
+    Args:
+        path: string, path of the SQLite file
+    """
+
+    def __init__(self, path, policy=config.WORK_QUEUE):
+        self.path = path
+        self.status_window = policy.get("STATUS_WINDOW_MINUTES", 10) * 60
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # Workers share the connection, so it's protected by a lock. Transactions are opened explicitly.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=policy.get("BUSY_TIMEOUT", 30), isolation_level=None, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                options TEXT NOT NULL,
+                geo TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available REAL NOT NULL,
+                lease TEXT,
+                node TEXT,
+                expires REAL,
+                error TEXT,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (state, geo, available);
+            CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs (state, expires);
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                node TEXT NOT NULL,
+                rows TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                committed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_committed ON results (committed);
+            CREATE TABLE IF NOT EXISTS nodes (
+                node TEXT PRIMARY KEY,
+                started REAL NOT NULL,
+                seen REAL NOT NULL
+            );
+        """)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                yield self.connection
+
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+            self.connection.execute("COMMIT")
+
+    def enqueue(self, jobs):
+        """
+        Adds queries to the queue, in batches. The queries already in the queue (same key) are kept as they are.
+
+        Args:
+            jobs: iterable of queries (strings or jobs)
+
+        Returns:
+            added: int
+        """
+
+        added = 0
+        batch = []
+
+        def insert(batch):
+            now = time()
+
+            with self.transaction() as connection:
+                before = connection.total_changes
+                connection.executemany(
+                    "INSERT OR IGNORE INTO jobs (key, query, options, geo, state, available, updated) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                    [(job["key"], job["query"], json.dumps(job["options"]), geo_key(query_geo(job["options"])), now, now) for job in batch],
+                )
+                return connection.total_changes - before
+
+        for item in jobs:
+            batch.append(as_job(item))
+
+            if len(batch) >= 1000:
+                added += insert(batch)
+                batch = []
+
+        if batch:
+            added += insert(batch)
+
+        return added
+
+    def requeue_expired(self, connection, now, max_attempts):
+        # A lease that was not renewed in time belongs to a node that crashed or hung: the query goes back to the
+        # queue, and the lost lease counts as an attempt.
+        expired = connection.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END, attempts = attempts + 1, "
+            "error = 'lease expired on ' || node, lease = NULL, expires = NULL, available = ?, updated = ? "
+            "WHERE state = 'leased' AND expires < ?",
+            (max_attempts, now, now, now),
+        ).rowcount
+
+        if expired:
+            logging.warning(f"{expired} expired leases of the work queue were requeued.")
+
+    def claim(self, node, lease_seconds, geo=None, max_attempts=3):
+        """
+        Leases the next query of the queue to a node, preferably of its geo.
+
+        Args:
+            node: string, name of the node
+            lease_seconds: float, duration of the lease
+            geo: string, geo key of the worker's profile, or None
+            max_attempts: int, attempts after which a query whose lease expired is given up
+
+        Returns:
+            job: dictionary, with "query", "options", "key", "lease" and "attempts", or None if nothing is available
+        """
+
+        now = time()
+
+        with self.transaction() as connection:
+            self.requeue_expired(connection, now, max_attempts)
+
+            row = None
+            if geo is not None:
+                row = connection.execute(
+                    "SELECT key, query, options, attempts FROM jobs WHERE state = 'queued' AND geo = ? AND available <= ? ORDER BY available LIMIT 1",
+                    (geo, now),
+                ).fetchone()
+
+            if row is None:
+                row = connection.execute(
+                    "SELECT key, query, options, attempts FROM jobs WHERE state = 'queued' AND available <= ? ORDER BY available LIMIT 1",
+                    (now,),
+                ).fetchone()
+
+            connection.execute(
+                "INSERT INTO nodes (node, started, seen) VALUES (?, ?, ?) ON CONFLICT (node) DO UPDATE SET seen = excluded.seen",
+                (node, now, now),
+            )
+
+            if row is None:
+                return None
+
+            lease = uuid.uuid4().hex
+            connection.execute(
+                "UPDATE jobs SET state = 'leased', lease = ?, node = ?, expires = ?, updated = ? WHERE key = ?",
+                (lease, node, now + lease_seconds, now, row[0]),
+            )
+
+        return {"key": row[0], "query": row[1], "options": json.loads(row[2]), "attempts": row[3], "lease": lease}
+
+    def renew(self, node, leases, lease_seconds):
+        """
+        Extends the leases of the queries a node is running.
+
+        Args:
+            node: string
+            leases: dictionary, lease of each query key
+            lease_seconds: float
+
+        Returns:
+            lost: list of the query keys whose lease is no longer held by the node
+        """
+
+        now = time()
+        lost = []
+
+        with self.transaction() as connection:
+            for key, lease in leases.items():
+                renewed = connection.execute(
+                    "UPDATE jobs SET expires = ?, updated = ? WHERE key = ? AND lease = ? AND state = 'leased'",
+                    (now + lease_seconds, now, key, lease),
+                ).rowcount
+
+                if not renewed:
+                    lost.append(key)
+
+            connection.execute("UPDATE nodes SET seen = ? WHERE node = ?", (now, node))
+
+        return lost
+
+    def commit(self, key, lease, rows, node):
+        """
+        Records the results of a query and marks it as done, in one transaction, if the lease is still held. The lease
+        is kept with the done query, so a commit sent again with the same lease (e.g. after a broken connection to the
+        TCP service) is answered as committed, without recording the results twice.
+
+        Args:
+            key: string
+            lease: string, lease of the claim
+            rows: list of dictionaries, as built by build_rows()
+            node: string
+
+        Returns:
+            committed: bool, False when the lease was lost (the query was requeued or done by another node)
+        """
+
+        now = time()
+
+        with self.transaction() as connection:
+            done = connection.execute(
+                "UPDATE jobs SET state = 'done', expires = NULL, error = NULL, updated = ? WHERE key = ? AND lease = ? AND state = 'leased'",
+                (now, key, lease),
+            ).rowcount
+
+            if not done:
+                return connection.execute("SELECT 1 FROM jobs WHERE key = ? AND lease = ? AND state = 'done'", (key, lease)).fetchone() is not None
+
+            connection.execute(
+                "INSERT INTO results (key, node, rows, count, committed) VALUES (?, ?, ?, ?, ?)",
+                (key, node, json.dumps(rows, ensure_ascii=False), len(rows), now),
+            )
+            connection.execute("UPDATE nodes SET seen = ? WHERE node = ?", (now, node))
+
+        return True
+
+    def release(self, key, lease, error, delay=0, max_attempts=3):
+        """
+        Gives back a failed query, to be claimed again after a delay, or gives it up after "max_attempts". As with
+        commit(), a release sent again with the same lease gets the same answer, until the query is claimed again.
+
+        Args:
+            key: string
+            lease: string
+            error: string, failure class
+            delay: float, seconds before the query can be claimed again
+            max_attempts: int
+
+        Returns:
+            state: string, "queued" or "failed", or None when the lease was lost
+        """
+
+        now = time()
+
+        with self.transaction() as connection:
+            released = connection.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END, attempts = attempts + 1, "
+                "error = ?, expires = NULL, available = ?, updated = ? WHERE key = ? AND lease = ? AND state = 'leased'",
+                (max_attempts, error, now + delay, now, key, lease),
+            ).rowcount
+
+            if released:
+                return connection.execute("SELECT state FROM jobs WHERE key = ?", (key,)).fetchone()[0]
+
+            # A release sent again with the same lease gets the answer of the first one.
+            row = connection.execute("SELECT state FROM jobs WHERE key = ? AND lease = ? AND state IN ('queued', 'failed')", (key, lease)).fetchone()
+
+            return row[0] if row else None
+
+    def counts(self):
+        """
+        Returns:
+            counts: dictionary, number of queries in each state
+        """
+
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+
+        return {state: 0 for state in QUEUE_STATES} | dict(rows)
+
+    def status(self):
+        """
+        Aggregate of the queue: the queries in each state, and the queries done by each node, in total and per minute
+        over the last "STATUS_WINDOW_MINUTES".
+
+        Returns:
+            status: dictionary, with "states", "nodes", "queries_per_minute" and "window_minutes"
+        """
+
+        now = time()
+        since = now - self.status_window
+        counts = self.counts()
+
+        with self.lock:
+            nodes = self.connection.execute("""
+                SELECT nodes.node, nodes.started, nodes.seen,
+                       COUNT(results.key), COALESCE(SUM(results.count), 0), COALESCE(SUM(results.committed >= ?), 0),
+                       (SELECT COUNT(*) FROM jobs WHERE jobs.state = 'leased' AND jobs.node = nodes.node)
+                FROM nodes LEFT JOIN results ON results.node = nodes.node
+                GROUP BY nodes.node ORDER BY nodes.node
+            """, (since,)).fetchall()
+
+        report = []
+        for node, started, seen, done, rows, recent, leased in nodes:
+            # A node started inside the window is measured since it started (at least one minute).
+            span = max(now - max(since, started), 60)
+            report.append({
+                "node": node,
+                "done": done,
+                "rows": rows,
+                "leased": leased,
+                "queries_per_minute": recent / span * 60,
+                "seen_seconds_ago": now - seen,
+            })
+
+        return {
+            "states": counts,
+            "nodes": report,
+            "queries_per_minute": sum(item["queries_per_minute"] for item in report),
+            "window_minutes": self.status_window / 60,
+        }
+
+    def export_page(self, after=None, limit=EXPORT_PAGE_SIZE):
+        """
+        Returns the committed rows of the next queries, in the order they were committed. The lock is only held for one
+        page, so the nodes keep committing during an export.
+
+        Args:
+            after: list, [committed, key] of the last query of the previous page, or None for the first page
+            limit: int, number of queries
+
+        Returns:
+            page: dictionary, with "results" (list of the rows of each query) and "next" (the "after" of the next
+                page, or None after the last one)
+        """
+
+        committed, key = after or (float("-inf"), "")
+
+        with self.lock:
+            results = self.connection.execute(
+                "SELECT committed, key, rows FROM results WHERE (committed, key) > (?, ?) ORDER BY committed, key LIMIT ?",
+                (committed, key, limit),
+            ).fetchall()
+
+        return {
+            "results": [json.loads(rows) for _, _, rows in results],
+            "next": list(results[-1][:2]) if len(results) == limit else None,
+        }
+
+    def export(self):
+        """
+        Yields the committed rows of each query, in the order they were committed, one page at a time.
+        """
+
+        after = None
+
+        while True:
+            page = self.export_page(after)
+            yield from page["results"]
+
+            after = page["next"]
+            if after is None:
+                return
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Operations of the queue that the TCP service accepts, and the ones whose answer is kept by request ID, so a request
+# sent again after a broken connection is not run twice.
+REMOTE_OPERATIONS = ["enqueue", "claim", "renew", "commit", "release", "counts", "status", "export_page"]
+DEDUPED_OPERATIONS = ["enqueue", "claim", "renew", "commit", "release"]
+
+
+class RemoteWorkQueue:
+    """
+    Client of the TCP service of the work queue, with the same methods as SqliteWorkQueue. Each call is one JSON line
+    sent on a kept-alive connection, answered by one JSON line. The connection is shared by the workers, so the calls
+    are serialized by a lock, and it's opened again once when it breaks. Each call has a request ID, kept when it's
+    sent again, so the service answers a claim or a commit that it already ran with its first answer, and the shared
+    token of the service, if there is one.
+
+    Args:
+        address: string, "host:port"
+        token: string. Default: WORK_QUEUE_TOKEN from .env
+    """
+
+    def __init__(self, address, policy=config.WORK_QUEUE, token=None):
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.timeout = policy.get("BUSY_TIMEOUT", 30)
+        self.path = f"tcp://{address}"
+        self.token = token or config.WORK_QUEUE_TOKEN
+
+        self.lock = threading.Lock()
+        self.socket = None
+        self.file = None
+
+    def connect(self):
+        self.socket = socket.create_connection(self.address, timeout=self.timeout)
+        self.file = self.socket.makefile("rwb")
+
+    def disconnect(self):
+        if self.socket is not None:
+            self.file.close()
+            self.socket.close()
+            self.socket = self.file = None
+
+    def call(self, operation, *args):
+        request = {"operation": operation, "args": args, "request": uuid.uuid4().hex}
+        if self.token:
+            request["token"] = self.token
+
+        request = json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n"
+
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.socket is None:
+                        self.connect()
+
+                    self.file.write(request)
+                    self.file.flush()
+                    line = self.file.readline()
+
+                    if not line:
+                        raise ConnectionError("the work queue service closed the connection")
+
+                    break
+
+                except OSError:
+                    self.disconnect()
+
+                    if attempt:
+                        raise
+
+        response = json.loads(line)
+
+        if "error" in response:
+            raise RuntimeError(f"Work queue service: {response['error']}")
+
+        return response["result"]
+
+    def enqueue(self, jobs):
+        added = 0
+        batch = []
+
+        for item in jobs:
+            batch.append(as_job(item))
+
+            if len(batch) >= 1000:
+                added += self.call("enqueue", batch)
+                batch = []
+
+        if batch:
+            added += self.call("enqueue", batch)
+
+        return added
+
+    def claim(self, node, lease_seconds, geo=None, max_attempts=3):
+        return self.call("claim", node, lease_seconds, geo, max_attempts)
+
+    def renew(self, node, leases, lease_seconds):
+        return self.call("renew", node, leases, lease_seconds)
+
+    def commit(self, key, lease, rows, node):
+        return self.call("commit", key, lease, rows, node)
+
+    def release(self, key, lease, error, delay=0, max_attempts=3):
+        return self.call("release", key, lease, error, delay, max_attempts)
+
+    def counts(self):
+        return self.call("counts")
+
+    def status(self):
+        return self.call("status")
+
+    def export_page(self, after=None, limit=EXPORT_PAGE_SIZE):
+        return self.call("export_page", after, limit)
+
+    def export(self):
+        # One page per call, so a big queue is never sent as one answer.
+        after = None
+
+        while True:
+            page = self.export_page(after)
+            yield from page["results"]
+
+            after = page["next"]
+            if after is None:
+                return
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+
+class WorkQueueHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                operation = request["operation"]
+
+                if self.server.token and not hmac.compare_digest(str(request.get("token") or ""), self.server.token):
+                    raise PermissionError("invalid or missing token")
+
+                if operation not in REMOTE_OPERATIONS:
+                    raise ValueError(f"unknown operation '{operation}'")
+
+                def run(operation=operation, args=request.get("args", [])):
+                    return getattr(self.server.work_queue, operation)(*args)
+
+                if operation in DEDUPED_OPERATIONS and request.get("request"):
+                    result = self.server.run_once(request["request"], run)
+                else:
+                    result = run()
+
+                response = {"result": result}
+
+            except Exception as e:
+                logging.error(f"Work queue service: the request from {self.client_address[0]} failed: {e}")
+                response = {"error": str(e)}
+
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class WorkQueueServer(socketserver.ThreadingTCPServer):
+    """
+    TCP service in front of a SqliteWorkQueue on the local disk of one host, for nodes that don't share a file system.
+    The answers of the last "REQUEST_CACHE" requests that change the queue are kept by request ID. The service has no
+    encryption: with a token, only the clients that send it are answered.
+
+    Args:
+        work_queue: SqliteWorkQueue
+        address: string, "host:port"
+        token: string. Default: WORK_QUEUE_TOKEN from .env
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, work_queue, address, policy=config.WORK_QUEUE, token=None):
+        host, port = address.rsplit(":", 1)
+        super().__init__((host, int(port)), WorkQueueHandler)
+        self.work_queue = work_queue
+        self.token = token or config.WORK_QUEUE_TOKEN
+
+        self.request_cache = policy.get("REQUEST_CACHE", 10000)
+        self.requests = OrderedDict()
+        self.requests_lock = threading.Lock()
+
+    def run_once(self, request_id, run):
+        """
+        Runs a request once per request ID. The same request sent again gets the answer of the first one, waiting for
+        it if it's still running (its connection broke before the answer was sent).
+
+        Args:
+            request_id: string
+            run: function, running the request
+
+        Returns:
+            result: the result of the request
+        """
+
+        with self.requests_lock:
+            entry = self.requests.get(request_id)
+            first = entry is None
+
+            if first:
+                entry = self.requests[request_id] = {"done": threading.Event(), "result": None, "error": None}
+
+                while len(self.requests) > self.request_cache:
+                    self.requests.popitem(last=False)
+
+        if first:
+            try:
+                entry["result"] = run()
+
+            except Exception as e:
+                entry["error"] = e
+                raise
+
+            finally:
+                entry["done"].set()
+
+        else:
+            logging.info(f"Work queue service: request {request_id} was sent again. Answering with its first result.")
+            entry["done"].wait()
+
+            if entry["error"] is not None:
+                raise entry["error"]
+
+        return entry["result"]
+
+
+def open_work_queue(url=None, policy=config.WORK_QUEUE):
+    """
+    Opens the work queue of a URL: "tcp://host:port" for the TCP service, or "sqlite:///path/queue.db" (or only the
+    path) for the SQLite file.
+
+    Args:
+        url: string. Default: "URL" of WORK_QUEUE in config.json
+
+    Returns:
+        work_queue: SqliteWorkQueue or RemoteWorkQueue
+    """
+
+    url = url or policy.get("URL") or "work_queue.db"
+
+    if url.startswith("tcp://"):
+        return RemoteWorkQueue(url.removeprefix("tcp://"), policy)
+
+    return SqliteWorkQueue(url.removeprefix("sqlite://"), policy)
+
+
+def is_loopback(address):
+    """
+    Tells if a "host:port" address is only reachable from this host.
+    """
+
+    host = address.rsplit(":", 1)[0].strip("[]")
+
+    if host == "localhost":
+        return True
+
+    try:
+        return ipaddress.ip_address(host).is_loopback
+
+    except ValueError:
+        return False
+
+
+def serve_work_queue(work_queue, address=None, policy=config.WORK_QUEUE):
+    """
+    Serves a SQLite work queue over TCP until the process is interrupted.
+
+    Args:
+        work_queue: SqliteWorkQueue
+        address: string, "host:port". Default: "SERVE_ADDRESS" of WORK_QUEUE in config.json
+    """
+
+    address = address or policy.get("SERVE_ADDRESS", "127.0.0.1:8766")
+
+    with WorkQueueServer(work_queue, address, policy) as server:
+        if not server.token and not is_loopback(address):
+            logging.warning(f"The work queue service listens on {address} without WORK_QUEUE_TOKEN: any host that reaches it can add, claim and export queries.")
+
+        logging.info(f"Work queue service of {work_queue.path} listening on tcp://{address}.")
+
+        try:
+            server.serve_forever()
+
+        except KeyboardInterrupt:
+            logging.info("Work queue service stopped.")
+
+
+def export_work_queue(work_queue, output_format=None, path=None):
+    """
+    Records the results committed to the work queue by all the nodes in a new output, with no search. The results
+    are read one page at a time, and the output of a previous export is replaced.
+
+    Args:
+        work_queue: SqliteWorkQueue or RemoteWorkQueue
+        output_format: string, "csv", "jsonl" or "sqlite". Default: OUTPUT.FORMAT in config.json
+        path: string, output file. Default: the default path of the format, with "_queue"
+
+    Returns:
+        rows: int, number of rows recorded
+    """
+
+    output, path = open_new_output(output_format, path, "_queue")
+
+    queries = rows = 0
+
+    try:
+        for query_rows in work_queue.export():
+            output.write(query_rows)
+            queries += 1
+            rows += len(query_rows)
+
+    finally:
+        output.close()
+
+    logging.info(f"Work queue: {rows} rows of {queries} queries saved in {path}.")
+    return rows
+
+
+def report_work_queue(status):
+    """
+    Shows the status of the work queue: the queries in each state, and the throughput of each node and of all nodes.
+
+    Args:
+        status: dictionary, as returned by status()
+    """
+
+    states = ", ".join(f"{count} {state}" for state, count in status["states"].items())
+    print(f"Queries: {states}.")
+    print(f"Throughput over the last {status['window_minutes']:.0f} minutes: {status['queries_per_minute']:.2f} queries/min with {len(status['nodes'])} nodes.")
+
+    for item in status["nodes"]:
+        print(f"    {item['node']:<30} {item['done']:>8} done  {item['rows']:>9} rows  {item['leased']:>4} leased  "
+              f"{item['queries_per_minute']:>8.2f} queries/min  seen {item['seen_seconds_ago']:.0f}s ago")
@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+from google_scrapping import config
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True, scope="session")
+def load_config():
+    # The defaults of config.json, without a .env file.
+    config.load_config(os.path.join(ROOT, "config.json"), env_path=os.devnull)
@@ -0,0 +1,55 @@
+import pytest
+
+from google_scrapping.extraction import compile_selector, parse_html, parse_results, select
+
+
+PAGE = """
+<html><body><div id="rso">
+  <div class="MjjYud">
+    <a href="https://example.com/first"><h3>First result</h3></a>
+    <cite>example.com</cite>
+    <div class="VwiC3b">Snippet of the first result.</div>
+  </div>
+  <div class="MjjYud">
+    <a href="/relative"><h3>Second result</h3></a>
+  </div>
+  <div class="MjjYud">
+    <a href="https://example.com/first"><h3>Same link again</h3></a>
+  </div>
+  <a href="https://example.com/no-title">No heading</a>
+</div></body></html>
+"""
+
+
+def test_compile_selector_matches_tags_classes_and_attributes():
+    root = parse_html('<div id="main"><p class="a b" data-x="value">text</p><p class="a">other</p></div>')
+
+    assert len(select(root, "p.a")) == 2
+    assert len(select(root, "p.a.b")) == 1
+    assert len(select(root, '#main p[data-x^="val"]')) == 1
+    assert len(select(root, 'div:has(p[data-x]), span')) == 1
+    assert select(root, "span") == []
+
+
+def test_compile_selector_rejects_unsupported_syntax():
+    with pytest.raises(ValueError):
+        compile_selector("div > p")
+
+
+def test_parse_results_extracts_title_url_and_snippet():
+    results = parse_results(PAGE, base_url="https://www.google.com/search?q=x")
+
+    assert [result["position"] for result in results] == [1, 2]
+    assert results[0] == {
+        "position": 1,
+        "title": "First result",
+        "url": "https://example.com/first",
+        "displayed_url": "example.com",
+        "snippet": "Snippet of the first result.",
+    }
+    assert results[1]["url"] == "https://www.google.com/relative"
+    assert results[1]["snippet"] == ""
+
+
+def test_parse_results_of_a_page_without_results():
+    assert parse_results("<html><body><div id='search'></div></body></html>") == []
@@ -0,0 +1,39 @@
+from google_scrapping.output import ResultWriter, RunJournal, build_rows
+
+
+def rows(query, count):
+    return build_rows(query, [{"position": i, "title": f"Title {i}", "url": f"https://example.com/{query}/{i}"} for i in range(1, count + 1)])
+
+
+def test_reconcile_removes_a_partially_written_batch(tmp_path):
+    policy = {"PATH": str(tmp_path / "run_journal.jsonl")}
+    output = str(tmp_path / "results.csv")
+
+    journal = RunJournal(policy=policy)
+    writer = ResultWriter("csv", output, journal=journal)
+    writer.flush([("coffee", rows("coffee", 3), 1, True)])
+    committed = writer.backend.position()
+
+    # Crash in the middle of the next batch: its rows are in the file, but the batch was never committed.
+    journal.begin_batch(output, committed, ["tea"])
+    writer.backend.write(rows("tea", 2))
+    writer.backend.flush()
+    writer.backend.close()
+    journal.close()
+
+    resumed = RunJournal(resume=True, policy=policy)
+    assert resumed.open_batch is not None
+
+    writer = ResultWriter("csv", output, journal=resumed)
+    assert writer.backend.position() == committed
+    writer.backend.close()
+
+    with open(output, "r", encoding="utf-8") as file:
+        assert len(file.readlines()) == 4
+
+    assert resumed.open_batch is None
+    assert resumed.is_done("coffee")
+    assert not resumed.is_done("tea")
+    assert resumed.next_page("coffee") == 2
+    assert resumed.next_position("coffee") == 3
+    resumed.close()
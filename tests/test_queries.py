@@ -0,0 +1,48 @@
+import pytest
+
+from google_scrapping.queries import iter_queries, make_job
+
+
+def test_make_job_normalizes_the_query_and_options():
+    job = make_job("  best   coffee ", {"country": " us ", "city": "Los_Angeles", "depth": "2", "unknown": "x", "region": ""})
+
+    assert job["query"] == "best coffee"
+    assert job["options"] == {"country": "US", "city": "los_angeles", "depth": 2}
+    assert job["key"] == "best coffee | city=los_angeles, country=US, depth=2"
+
+
+def test_make_job_without_options_keeps_the_text_as_key():
+    assert make_job("coffee")["key"] == "coffee"
+
+
+@pytest.mark.parametrize("options", [{"depth": 0}, {"mode": "fast"}])
+def test_make_job_rejects_invalid_options(options):
+    with pytest.raises(ValueError):
+        make_job("coffee", options)
+
+
+def test_iter_queries_dedupes_across_sources(tmp_path):
+    path = tmp_path / "queries.jsonl"
+    path.write_text(
+        '{"query": "Coffee"}\n'
+        '{"query": "coffee", "country": "FR"}\n'
+        'not json\n'
+        '{"query": "tea"}\n',
+        encoding="utf-8",
+    )
+
+    jobs = list(iter_queries(["coffee", "  coffee "], [str(path)], policy={"DEDUPE": True}))
+
+    assert [job["key"] for job in jobs] == ["coffee", "coffee | country=FR", "tea"]
+
+
+def test_iter_queries_without_dedupe_keeps_repeats():
+    jobs = list(iter_queries(["coffee", "coffee"], policy={"DEDUPE": False}))
+
+    assert len(jobs) == 2
+
+
+def test_iter_queries_with_bloom_filter():
+    jobs = list(iter_queries([f"query {i}" for i in range(100)] + ["query 1"], policy={"DEDUPE_BLOOM": True, "DEDUPE_CAPACITY": 1000, "DEDUPE_ERROR_RATE": 0.0001}))
+
+    assert len(jobs) == 100
@@ -0,0 +1,69 @@
+import pytest
+
+from google_scrapping.queries import geo_key, make_job, query_geo
+from google_scrapping.scheduler import ProxyError, QueryScheduler, backoff_delay, failure_class
+
+
+RETRY = {"MAX_ATTEMPTS": 2, "BACKOFF_SECONDS": 0.01, "MAX_BACKOFF_SECONDS": 0.05, "JITTER": 0}
+
+
+def test_backoff_delay_doubles_up_to_the_maximum():
+    policy = {"BACKOFF_SECONDS": 5, "MAX_BACKOFF_SECONDS": 30, "JITTER": 0}
+
+    assert [backoff_delay(attempt, policy) for attempt in range(1, 6)] == [5, 10, 20, 30, 30]
+
+
+def test_backoff_delay_jitter_stays_in_range():
+    policy = {"BACKOFF_SECONDS": 10, "MAX_BACKOFF_SECONDS": 300, "JITTER": 0.5}
+
+    assert all(5 <= backoff_delay(1, policy) <= 15 for _ in range(100))
+
+
+def test_failure_class():
+    assert failure_class(None) == "captcha"
+    assert failure_class(ProxyError("no proxy")) == "proxy"
+    assert failure_class(ValueError("boom")) == "error"
+
+
+def test_failure_class_of_a_page_timeout():
+    exceptions = pytest.importorskip("selenium.common.exceptions")
+
+    assert failure_class(exceptions.TimeoutException()) == "timeout"
+
+
+def test_retry_requeues_until_the_maximum_of_attempts():
+    scheduler = QueryScheduler(["coffee", "tea"], policy=RETRY, geo_policy={"GROUPING": False})
+
+    first = scheduler.next()
+    assert scheduler.retry(first, ProxyError("no proxy"))
+
+    # The other query goes first, while the failed one is in backoff.
+    second = scheduler.next()
+    assert second["key"] != first["key"]
+    scheduler.done(second)
+
+    again = scheduler.next()
+    assert again["key"] == first["key"]
+    assert not scheduler.retry(again, None)
+
+    assert scheduler.next() is None
+    assert scheduler.failed == [first["key"]]
+    assert scheduler.retries == {"proxy": 1}
+
+
+def test_next_prefers_the_geo_of_the_worker():
+    jobs = [make_job("coffee", {"country": "US"}), make_job("tea", {"country": "FR"}), make_job("juice", {"country": "US"})]
+    france = geo_key(query_geo({"country": "FR"}))
+
+    scheduler = QueryScheduler(jobs, policy=RETRY, geo_policy={"GROUPING": True, "LOOKAHEAD": 10})
+
+    assert scheduler.next(france)["query"] == "tea"
+    # Nothing left for France: the worker gets a query of the biggest group.
+    assert scheduler.next(france)["query"] == "coffee"
+
+
+def test_stop_ends_the_queue():
+    scheduler = QueryScheduler(["coffee"], policy=RETRY)
+    scheduler.stop()
+
+    assert scheduler.next() is None
@@ -0,0 +1,41 @@
+from google_scrapping import config
+from google_scrapping.urlindex import UrlIndex, normalize_url, url_fingerprint
+
+
+def test_normalize_url_removes_tracking_and_sorts_params():
+    url = "HTTPS://www.Example.com:443/page/?utm_source=x&b=2&gclid=y&a=1#top"
+
+    assert normalize_url(url) == "https://example.com/page?a=1&b=2"
+
+
+def test_normalize_url_unwraps_google_redirects():
+    url = "https://www.google.com/url?q=https://example.com/page%3Fref%3D1&sa=U"
+
+    assert normalize_url(url) == "https://example.com/page?ref=1"
+
+
+def test_normalize_url_keeps_other_ports_and_strips_extra_params():
+    assert normalize_url("http://example.com:8080/?session=1&id=2", strip_params=["session"]) == "http://example.com:8080/?id=2"
+
+
+def test_fingerprint_is_stable_and_fixed_size():
+    assert url_fingerprint("https://example.com/") == url_fingerprint("https://example.com/")
+    assert url_fingerprint("https://example.com/") != url_fingerprint("https://example.com/other")
+    assert len(url_fingerprint("https://example.com/" + "x" * 1000)) == 16
+
+
+def test_annotate_flags_repeats_and_rollback_removes_the_batch(tmp_path):
+    index = UrlIndex({"PATH": str(tmp_path / "url_index.db")})
+    row = lambda url: {"url": url, "normalized_url": normalize_url(url), "domain": "example.com", "query": "q", "position": 1}
+
+    first = [row("https://example.com/a"), row("https://www.example.com/a/")]
+    index.annotate(first, "batch-1")
+    assert [r["repeat"] for r in first] == [False, True]
+
+    second = [row("https://example.com/b")]
+    index.annotate(second, "batch-2")
+    assert index.rollback("batch-2") == 1
+
+    assert index.lookup("https://example.com/b") is None
+    assert index.lookup("https://example.com/a")["hits"] == 2
+    index.close()
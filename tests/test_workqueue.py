@@ -0,0 +1,74 @@
+import pytest
+
+from google_scrapping.workqueue import SqliteWorkQueue
+
+
+@pytest.fixture
+def work_queue(tmp_path):
+    work_queue = SqliteWorkQueue(str(tmp_path / "work_queue.db"))
+    yield work_queue
+    work_queue.close()
+
+
+def test_enqueue_keeps_existing_queries(work_queue):
+    assert work_queue.enqueue(["coffee", "tea"]) == 2
+    assert work_queue.enqueue(["coffee"]) == 0
+    assert work_queue.counts()["queued"] == 2
+
+
+def test_commit_sent_again_records_the_results_once(work_queue):
+    work_queue.enqueue(["coffee"])
+    job = work_queue.claim("node-a", 60)
+
+    rows = [{"query": "coffee", "url": "https://example.com/"}]
+    assert work_queue.commit(job["key"], job["lease"], rows, "node-a")
+    assert work_queue.commit(job["key"], job["lease"], rows, "node-a")
+
+    assert list(work_queue.export()) == [rows]
+    assert work_queue.counts()["done"] == 1
+
+
+def test_release_sent_again_gets_the_same_answer(work_queue):
+    work_queue.enqueue(["coffee"])
+    job = work_queue.claim("node-a", 60)
+
+    assert work_queue.release(job["key"], job["lease"], "captcha", max_attempts=1) == "failed"
+    assert work_queue.release(job["key"], job["lease"], "captcha", max_attempts=1) == "failed"
+    assert work_queue.counts()["failed"] == 1
+
+
+def test_expired_lease_is_requeued_and_its_commit_refused(work_queue):
+    work_queue.enqueue(["coffee"])
+    stale = work_queue.claim("node-a", -1)
+
+    job = work_queue.claim("node-b", 60)
+    assert job["key"] == stale["key"]
+    assert job["attempts"] == 1
+
+    assert not work_queue.commit(stale["key"], stale["lease"], [], "node-a")
+    assert work_queue.renew("node-a", {stale["key"]: stale["lease"]}, 60) == [stale["key"]]
+    assert work_queue.commit(job["key"], job["lease"], [], "node-b")
+
+
+def test_claim_prefers_the_geo_and_nothing_is_claimed_twice(work_queue):
+    work_queue.enqueue([{"query": "coffee", "options": {"country": "US"}}, {"query": "tea", "options": {"country": "FR"}}])
+
+    claimed = work_queue.claim("node-a", 60, geo="FR")
+    assert claimed["query"] == "tea"
+    assert work_queue.claim("node-b", 60)["query"] == "coffee"
+    assert work_queue.claim("node-c", 60) is None
+
+
+def test_export_pages(work_queue):
+    work_queue.enqueue([f"query {i}" for i in range(5)])
+
+    for _ in range(5):
+        job = work_queue.claim("node-a", 60)
+        work_queue.commit(job["key"], job["lease"], [{"query": job["query"]}], "node-a")
+
+    first = work_queue.export_page(limit=2)
+    assert len(first["results"]) == 2
+
+    rest = work_queue.export_page(first["next"], limit=10)
+    assert len(rest["results"]) == 3
+    assert rest["next"] is None